@@ -1,14 +1,30 @@
 from aiogram import F
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from aiogram.filters import Command
-from database import is_user_admin, add_admin, remove_admin, get_all_admins, get_user_info, update_balance, update_subscription, get_user_id_by_username, dict_factory
-from config import ROOT_ADMIN_ID
+from async_database import is_user_admin, add_admin, remove_admin, get_all_admins, get_user_info, update_balance, update_subscription, get_user_id_by_username, get_recent_errors, clear_error_logs
+from config import ROOT_ADMIN_ID, TELEGRAM_MESSAGE_LIMIT
 from shared import dp, bot
-import sqlite3
 from datetime import datetime, timedelta
 from state import admin_states, last_bot_messages, message_history
-from error_logger import get_recent_errors, clear_error_logs
 from error_handler import error_handler, sync_error_handler
+from live_reply import split_message
+from typing import List
+
+
+def pack_sections(sections: List[str], limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Собирает разделы отчета в сообщения не длиннее limit; раздел переносится в следующее сообщение целиком"""
+    messages = []
+    current = ""
+    for section in sections:
+        # Раздел длиннее лимита сам делится по строкам
+        for part in split_message(section.strip(), limit):
+            if current and len(current) + 2 + len(part) > limit:
+                messages.append(current)
+                current = ""
+            current = f"{current}\n\n{part}" if current else part
+    if current:
+        messages.append(current)
+    return messages
 
 
 @sync_error_handler
@@ -50,7 +66,7 @@ def get_admins_keyboard() -> InlineKeyboardMarkup:
 @error_handler
 async def handle_admin_command(message: Message):
     """Обработчик команды /admin"""
-    if not is_user_admin(message.from_user.id):
+    if not await is_user_admin(message.from_user.id):
         await message.answer("❌ У вас нет прав администратора!")
         return
 
@@ -63,25 +79,16 @@ async def handle_admin_command(message: Message):
 @error_handler
 async def handle_admin_stats(callback: CallbackQuery):
     """Показывает статистику"""
-    from database import get_user
+    from async_database import get_system_stats
 
     # Получаем общую статистику
-    with sqlite3.connect("users.db") as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0]
-
-        cursor.execute("SELECT COUNT(*) FROM admins")
-        total_admins = cursor.fetchone()[0] + 1  # +1 для root админа
-
-        cursor.execute("SELECT SUM(balance) FROM users")
-        total_balance = cursor.fetchone()[0] or 0
+    stats = await get_system_stats()
 
     stats_text = (
         "📊 <b>Статистика системы</b>\n\n"
-        f"👥 Всего пользователей: {total_users}\n"
-        f"👨‍💼 Администраторов: {total_admins}\n"
-        f"💰 Общий баланс: {total_balance} руб."
+        f"👥 Всего пользователей: {stats['total_users']}\n"
+        f"👨‍💼 Администраторов: {stats['total_admins']}\n"
+        f"💰 Общий баланс: {stats['total_balance']} руб."
     )
 
     buttons = [[InlineKeyboardButton(
@@ -154,7 +161,7 @@ async def handle_list_admins(callback: CallbackQuery):
     """Показывает список администраторов"""
     from config import ROOT_ADMIN_ID
 
-    admins = get_all_admins()
+    admins = await get_all_admins()
 
     # Добавляем root админа в список
     all_admins = [{'user_id': ROOT_ADMIN_ID,
@@ -199,7 +206,7 @@ async def handle_list_admins(callback: CallbackQuery):
 @error_handler
 async def handle_user_info(message: Message, user_id: int):
     """Получает информацию о пользователе"""
-    user_info = get_user_info(user_id)
+    user_info = await get_user_info(user_id)
     if not user_info:
         await message.answer("❌ Пользователь не найден")
         return
@@ -230,12 +237,12 @@ async def handle_user_info(message: Message, user_id: int):
 @error_handler
 async def handle_user_balance(message: Message, user_id: int, amount: int):
     """Изменяет баланс пользователя"""
-    user_info = get_user_info(user_id)
+    user_info = await get_user_info(user_id)
     if not user_info:
         await message.answer("❌ Пользователь не найден")
         return
 
-    update_balance(user_id, amount)
+    await update_balance(user_id, amount)
 
     new_balance = user_info['balance'] + \
         amount if 'balance' in user_info else amount
@@ -249,7 +256,7 @@ async def handle_user_balance(message: Message, user_id: int, amount: int):
 @error_handler
 async def handle_user_subscription(message: Message, user_id: int, sub_type: str):
     """Изменяет подписку пользователя"""
-    user_info = get_user_info(user_id)
+    user_info = await get_user_info(user_id)
     if not user_info:
         await message.answer("❌ Пользователь не найден")
         return
@@ -259,7 +266,7 @@ async def handle_user_subscription(message: Message, user_id: int, sub_type: str
         return
 
     # Устанавливаем подписку на 30 дней
-    update_subscription(user_id, sub_type, 30)
+    await update_subscription(user_id, sub_type, 30)
 
     sub_names = {
         'free': 'Zenith Spark',
@@ -323,7 +330,7 @@ async def handle_admin_users(callback: CallbackQuery):
 @error_handler
 async def handle_user_command(message: Message):
     """Обработчик команды /user"""
-    if not is_user_admin(message.from_user.id):
+    if not await is_user_admin(message.from_user.id):
         await message.answer("❌ У вас нет прав администратора!")
         return
 
@@ -361,7 +368,7 @@ async def handle_user_command(message: Message):
 @error_handler
 async def handle_create_discount_for_user(message: Message, user_id: int, discount_percent: int, max_uses: int, target_subscription: str = None):
     """Создает скидочный код для конкретного пользователя"""
-    from database import create_discount_code
+    from async_database import create_discount_code
     import hashlib
     import time
 
@@ -374,7 +381,7 @@ async def handle_create_discount_for_user(message: Message, user_id: int, discou
         code = f"{code}_{target_subscription.upper()}"
 
     # Создаем скидку
-    if create_discount_code(code, discount_percent, max_uses, message.from_user.id):
+    if await create_discount_code(code, discount_percent, max_uses, message.from_user.id):
         target_info = f" для подписки {target_subscription}" if target_subscription else ""
         await message.answer(
             f"✅ Скидочный код успешно создан для пользователя {user_id}!\n\n"
@@ -391,7 +398,7 @@ async def handle_create_discount_for_user(message: Message, user_id: int, discou
 @error_handler
 async def handle_admin_callback(callback: CallbackQuery):
     """Обработчик callback'ов админ панели"""
-    if not is_user_admin(callback.from_user.id):
+    if not await is_user_admin(callback.from_user.id):
         await callback.answer("❌ У вас нет прав администратора!", show_alert=True)
         return
 
@@ -479,8 +486,8 @@ async def handle_admin_callback(callback: CallbackQuery):
         from messages import get_welcome_message
         from bot import get_main_keyboard
 
-        welcome_text = get_welcome_message(callback.from_user.id)
-        keyboard = get_main_keyboard(callback.from_user.id)
+        welcome_text = await get_welcome_message(callback.from_user.id)
+        keyboard = await get_main_keyboard(callback.from_user.id)
 
         # Редактируем сообщение вместо отправки нового
         try:
@@ -552,9 +559,9 @@ async def handle_delete_discount_start(callback: CallbackQuery):
 @error_handler
 async def handle_list_discounts(callback: CallbackQuery):
     """Показывает список всех скидок"""
-    from database import get_all_discount_codes
+    from async_database import get_all_discount_codes
 
-    discounts = get_all_discount_codes()
+    discounts = await get_all_discount_codes()
 
     if not discounts:
         discounts_text = "🎟 <b>Скидочные коды</b>\n\nСписок скидок пуст."
@@ -594,7 +601,7 @@ async def handle_list_discounts(callback: CallbackQuery):
 @error_handler
 async def handle_admin_text_message(message: Message):
     """Обработчик текстовых сообщений от админов"""
-    if not is_user_admin(message.from_user.id):
+    if not await is_user_admin(message.from_user.id):
         return
 
     user_id = message.from_user.id
@@ -631,8 +638,8 @@ async def handle_admin_text_message(message: Message):
                     await message.answer("❌ Максимум использований должен быть больше 0")
                     return
 
-                from database import create_discount_code
-                if create_discount_code(code, discount_percent, max_uses, user_id):
+                from async_database import create_discount_code
+                if await create_discount_code(code, discount_percent, max_uses, user_id):
                     await message.answer(
                         f"✅ Скидочный код успешно создан!\n\n"
                         f"🎫 Код: {code}\n"
@@ -653,8 +660,8 @@ async def handle_admin_text_message(message: Message):
                 # Обработка удаления скидки
                 code = message.text.upper()
 
-                from database import delete_discount_code
-                if delete_discount_code(code):
+                from async_database import delete_discount_code
+                if await delete_discount_code(code):
                     await message.answer(
                         f"✅ Скидочный код {code} успешно удален!",
                         reply_markup=get_discounts_keyboard()
@@ -671,7 +678,7 @@ async def handle_admin_text_message(message: Message):
             elif state == 'waiting_for_admin_id_to_add':
                 # Добавляем администратора по ID
                 target_user_id = int(message.text)
-                if add_admin(target_user_id, user_id):
+                if await add_admin(target_user_id, user_id):
                     await message.answer(
                         f"✅ Пользователь {target_user_id} успешно назначен администратором!",
                         reply_markup=get_admins_keyboard()
@@ -691,10 +698,9 @@ async def handle_admin_text_message(message: Message):
                 username = message.text.strip().lstrip('@')
 
                 # Ищем пользователя по username в базе данных
-                from database import get_user_id_by_username
-                target_user_id = get_user_id_by_username(username)
+                target_user_id = await get_user_id_by_username(username)
                 if target_user_id:
-                    if add_admin(target_user_id, user_id):
+                    if await add_admin(target_user_id, user_id):
                         await message.answer(
                             f"✅ Пользователь @{username} (ID: {target_user_id}) успешно назначен администратором!",
                             reply_markup=get_admins_keyboard()
@@ -718,7 +724,7 @@ async def handle_admin_text_message(message: Message):
             elif state == 'waiting_for_admin_id_to_remove':
                 # Удаляем администратора
                 target_user_id = int(message.text)
-                if remove_admin(target_user_id):
+                if await remove_admin(target_user_id):
                     await message.answer(
                         f"✅ Пользователь {target_user_id} успешно удален из администраторов!",
                         reply_markup=get_admins_keyboard()
@@ -746,7 +752,7 @@ async def handle_admin_text_message(message: Message):
 async def handle_admin_panel_callback(callback: CallbackQuery):
     """Обработчик кнопки админ-панели в главном меню"""
     # Проверяем, является ли пользователь админом
-    if not is_user_admin(callback.from_user.id):
+    if not await is_user_admin(callback.from_user.id):
         await callback.answer("❌ У вас нет прав администратора!", show_alert=True)
         return
 
@@ -769,37 +775,18 @@ async def handle_admin_panel_callback(callback: CallbackQuery):
 @error_handler
 async def handle_referral_stats(callback: CallbackQuery):
     """Показывает статистику реферальной системы"""
-    with sqlite3.connect("users.db") as conn:
-        conn.row_factory = dict_factory
-        cursor = conn.cursor()
-
-        # Общая статистика
-        cursor.execute("SELECT COUNT(*) as count FROM referrals")
-        total_referrals = cursor.fetchone()['count']
-
-        cursor.execute("SELECT SUM(amount) as total FROM referral_payments")
-        total_payments = cursor.fetchone()['total'] or 0
-
-        cursor.execute("""
-            SELECT u.user_id, u.username, COUNT(r.user_id) as referrals_count, 
-                   SUM(rp.amount) as earned_total
-            FROM users u
-            LEFT JOIN referrals r ON u.user_id = r.referrer_id
-            LEFT JOIN referral_payments rp ON u.user_id = rp.referrer_id
-            GROUP BY u.user_id
-            ORDER BY earned_total DESC
-            LIMIT 10
-        """)
-        top_referrers = cursor.fetchall()
+    from async_database import get_referral_system_stats
+
+    stats = await get_referral_system_stats()
 
     stats_text = (
         "📊 <b>Реферальная статистика</b>\n\n"
-        f"👥 Всего рефералов: {total_referrals}\n"
-        f"💰 Всего выплачено: {total_payments:.2f} руб.\n\n"
+        f"👥 Всего рефералов: {stats['total_referrals']}\n"
+        f"💰 Всего выплачено: {stats['total_payments']:.2f} руб.\n\n"
         "🏆 <b>Топ рефереров</b>:\n"
     )
 
-    for i, referrer in enumerate(top_referrers, 1):
+    for i, referrer in enumerate(stats['top_referrers'], 1):
         stats_text += (
             f"{i}. @{referrer['username']} (ID: {referrer['user_id']})\n"
             f"   👥 Рефералов: {referrer['referrals_count']}\n"
@@ -817,10 +804,10 @@ async def handle_referral_stats(callback: CallbackQuery):
 @error_handler
 async def handle_referral_withdrawal(callback: CallbackQuery):
     """Обработчик вывода реферальных средств"""
-    from database import get_user
+    from async_database import get_user
 
     user_id = callback.from_user.id
-    user = get_user(user_id)
+    user = await get_user(user_id)
 
     if not user:
         await callback.answer("Пользователь не найден", show_alert=True)
@@ -850,7 +837,7 @@ async def handle_referral_withdrawal(callback: CallbackQuery):
 @error_handler
 async def handle_withdrawal_request(message: Message):
     """Обработчик команды для подтверждения вывода средств"""
-    if not is_user_admin(message.from_user.id):
+    if not await is_user_admin(message.from_user.id):
         await message.answer("❌ У вас нет прав администратора!")
         return
 
@@ -925,7 +912,7 @@ async def handle_admin_settings(callback: CallbackQuery):
 @error_handler
 async def handle_view_errors(callback: CallbackQuery):
     """Просмотр последних ошибок"""
-    errors = get_recent_errors(20)  # Получаем последние 20 ошибок
+    errors = await get_recent_errors(20)  # Получаем последние 20 ошибок
 
     if not errors:
         errors_text = "📝 <b>Журнал ошибок</b>\n\nНет записей об ошибках."
@@ -963,7 +950,7 @@ async def handle_view_errors(callback: CallbackQuery):
 @error_handler
 async def handle_clear_errors(callback: CallbackQuery):
     """Очистка логов ошибок"""
-    if clear_error_logs():
+    if await clear_error_logs():
         await callback.answer("✅ Логи ошибок успешно очищены!", show_alert=True)
     else:
         await callback.answer("❌ Ошибка при очистке логов", show_alert=True)
@@ -975,7 +962,7 @@ async def handle_clear_errors(callback: CallbackQuery):
 @error_handler
 async def handle_console_command(message: Message):
     """Обработчик консольных команд администратора"""
-    if not is_user_admin(message.from_user.id):
+    if not await is_user_admin(message.from_user.id):
         await message.answer("❌ У вас нет прав администратора!")
         return
 
@@ -990,8 +977,13 @@ async def handle_console_command(message: Message):
                 "<code>/console errors</code> - последние ошибки\n"
                 "<code>/console clear_errors</code> - очистить логи ошибок\n"
                 "<code>/console users count</code> - количество пользователей\n"
+                "<code>/console db</code> - кэши, контекст диалогов, лимиты токенов, очередь записи и архив\n"
                 "<code>/console user [ID] info</code> - информация о пользователе\n"
-                "<code>/console broadcast [сообщение]</code> - рассылка всем пользователям"
+                "<code>/console broadcast [сообщение]</code> - рассылка всем пользователям\n"
+                "<code>/console broadcasts</code> - последние рассылки\n"
+                "<code>/console broadcast_pause [ID]</code> - приостановить рассылку\n"
+                "<code>/console broadcast_resume [ID]</code> - продолжить рассылку\n"
+                "<code>/console broadcast_cancel [ID]</code> - отменить рассылку"
             )
             return
 
@@ -1003,10 +995,12 @@ async def handle_console_command(message: Message):
         elif command == "errors":
             await handle_console_errors(message)
         elif command == "clear_errors":
-            if clear_error_logs():
+            if await clear_error_logs():
                 await message.answer("✅ Логи ошибок успешно очищены!")
             else:
                 await message.answer("❌ Ошибка при очистке логов")
+        elif command == "db":
+            await handle_console_db(message)
         elif command == "users" and len(parts) > 1 and parts[1] == "count":
             await handle_console_users_count(message)
         elif command == "user" and len(parts) >= 3 and parts[2] == "info":
@@ -1016,39 +1010,40 @@ async def handle_console_command(message: Message):
             except ValueError:
                 await message.answer("❌ Неверный формат ID")
         elif command == "broadcast" and len(parts) > 1:
-            await handle_console_broadcast(message, " ".join(parts[1:]))
+            # Текст рассылки - как есть, с переносами строк
+            await handle_console_broadcast(message, command_text[len(parts[0]):].strip())
+        elif command == "broadcasts":
+            await handle_console_broadcasts(message)
+        elif command in ("broadcast_pause", "broadcast_resume", "broadcast_cancel") and len(parts) > 1:
+            try:
+                job_id = int(parts[1])
+            except ValueError:
+                await message.answer("❌ Неверный формат ID")
+                return
+            await handle_console_broadcast_control(message, command.split("_")[1], job_id)
         else:
             await message.answer("❌ Неизвестная команда. Используйте /console для помощи.")
 
     except Exception as e:
-        from error_logger import log_error
+        from async_database import log_error
         import traceback
-        log_error("ConsoleCommandError", str(e),
-                  traceback.format_exc(), message.from_user.id)
+        await log_error("ConsoleCommandError", str(e),
+                        traceback.format_exc(), message.from_user.id)
         await message.answer(f"❌ Ошибка выполнения команды: {str(e)}")
 
 
 @error_handler
 async def handle_console_stats(message: Message):
     """Консольная команда статистики"""
-    from database import get_user
-
-    with sqlite3.connect("users.db") as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0]
+    from async_database import get_system_stats
 
-        cursor.execute("SELECT COUNT(*) FROM admins")
-        total_admins = cursor.fetchone()[0] + 1
-
-        cursor.execute("SELECT SUM(balance) FROM users")
-        total_balance = cursor.fetchone()[0] or 0
+    stats = await get_system_stats()
 
     stats_text = (
         "📊 <b>Статистика системы (консоль)</b>\n\n"
-        f"👥 Всего пользователей: {total_users}\n"
-        f"👨‍💼 Администраторов: {total_admins}\n"
-        f"💰 Общий баланс: {total_balance} руб."
+        f"👥 Всего пользователей: {stats['total_users']}\n"
+        f"👨‍💼 Администраторов: {stats['total_admins']}\n"
+        f"💰 Общий баланс: {stats['total_balance']} руб."
     )
 
     await message.answer(stats_text)
@@ -1057,7 +1052,7 @@ async def handle_console_stats(message: Message):
 @error_handler
 async def handle_console_errors(message: Message):
     """Консольная команда просмотра ошибок"""
-    errors = get_recent_errors(10)
+    errors = await get_recent_errors(10)
 
     if not errors:
         await message.answer("📝 Нет записей об ошибках.")
@@ -1075,45 +1070,222 @@ async def handle_console_errors(message: Message):
 @error_handler
 async def handle_console_users_count(message: Message):
     """Консольная команда подсчета пользователей"""
-    with sqlite3.connect("users.db") as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0]
+    from async_database import get_users_count
+
+    total_users = await get_users_count()
 
     await message.answer(f"👥 Общее количество пользователей: {total_users}")
 
 
+@error_handler
+async def handle_console_db(message: Message):
+    """Консольная команда: метрики кэша пользователей, очереди отложенной записи и архива"""
+    from write_queue import get_write_queue_stats
+    from retention import get_retention_stats
+    from context_buffer import chat_histories
+    from context_summary import context_compactor
+    from quota import quota
+    from response_cache import response_cache
+    from coalescer import chat_coalescer
+    from scheduler import llm_scheduler
+    from providers import model_router
+    from send_queue import telegram_send_queue
+    from message_cleanup import deletion_scheduler
+
+    from user_cache import user_cache
+
+    # Разделов много (и по одному на каждый файл БД), поэтому они уходят несколькими
+    # сообщениями: каждое не длиннее лимита Telegram, раздел не разрывается
+    sections = []
+
+    cache = user_cache.stats()
+    sections.append(
+        "👤 <b>Кэш пользователей</b>\n\n"
+        f"📦 Записей: {cache['size']}/{cache['max_size']}\n"
+        f"🎯 Попаданий: {cache['hits']}, промахов: {cache['misses']} "
+        f"({cache['hit_rate'] * 100:.1f}%)\n"
+        f"♻️ Вытеснено: {cache['evictions']}, сброшено: {cache['invalidations']}"
+    )
+
+    context = chat_histories.stats()
+    sections.append(
+        "💬 <b>Контекст диалогов</b>\n\n"
+        f"📦 Буферов: {context['buffers']}, реплик: {context['turns']}\n"
+        f"🧠 Память: {context['bytes'] / 1024 / 1024:.1f} из {context['memory_budget'] / 1024 / 1024:.0f} МБ\n"
+        f"🎯 Из памяти: {context['hits']}, загрузок из БД: {context['hydrations']}, "
+        f"вытеснено: {context['evictions']}"
+    )
+
+    summaries = context_compactor.stats()
+    if summaries['enabled']:
+        sections.append(
+            "📝 <b>Сводки диалогов</b>\n\n"
+            f"📦 В памяти: {summaries['summaries']}, обновляется: {summaries['running']}\n"
+            f"✂️ Запросов со сводкой: {summaries['compacted']}, обновлений: {summaries['refreshes']}, "
+            f"свернуто реплик: {summaries['folded_turns']}, ошибок: {summaries['failures']}"
+        )
+
+    tokens = quota.stats()
+    sections.append(
+        "🎟 <b>Лимиты токенов</b>\n\n"
+        f"👥 Пользователей в памяти: {tokens['users']}\n"
+        f"🔒 В резерве: {tokens['reserved']}, не записано в БД: {tokens['unflushed']}\n"
+        f"✅ Резервирований: {tokens['reservations']}, отказов по лимиту: {tokens['rejections']}"
+    )
+
+    bursts = chat_coalescer.stats()
+    sections.append(
+        "📨 <b>Склейка сообщений</b>\n\n"
+        f"📥 Сообщений: {bursts['received']}, запросов к модели: {bursts['turns']}\n"
+        f"🔗 Склеено: {bursts['merged']}, прервано ответов: {bursts['cancelled']}"
+    )
+
+    queue = llm_scheduler.stats()
+    section = (
+        "🚦 <b>Очередь к модели</b>\n\n"
+        f"⚙️ Генераций: {queue['in_flight']}/{queue['max_concurrency']}, в очереди: {queue['queued']}\n"
+    )
+    for name, tier in queue['tiers'].items():
+        p95 = f"≤{tier['p95_wait']} с" if tier['p95_wait'] is not None else "больше минуты"
+        section += (
+            f"• {name} (вес {tier['weight']}): ждут {tier['queued']}, обслужено {tier['granted']}, "
+            f"среднее ожидание {tier['avg_wait']} с, p95 {p95}\n"
+        )
+    sections.append(section)
+
+    router = model_router.stats()
+    breaker = router['breaker']
+    breaker_states = {'closed': "✅ закрыт", 'open': "⛔ открыт", 'half_open': "🔶 пробный запрос"}
+    section = (
+        "🤖 <b>Модели</b>\n\n"
+        f"📨 Запросов: {router['requests']}, переключений: {router['failovers']}, "
+        f"дублирующих: {router['hedges']}, без ответа: {router['exhausted']}, "
+        f"упёрлись в лимит: {router['throttled']}\n"
+        f"🔌 Выключатель: {breaker_states[breaker['state']]}, срабатываний: {breaker['opens']}, "
+        f"ответов «заняты»: {breaker['short_circuits']}\n"
+    )
+    for model in router['models']:
+        state = "✅" if model['available'] else f"⏸ ещё {model['cooldown_left']} с"
+        p95 = f"{model['ttft_p95']:.2f} с" if model['ttft_p95'] is not None else "—"
+        section += (
+            f"{state} {model['model']}: ответов {model['successes']}/{model['requests']}, "
+            f"ошибок {model['failures']}, выиграно дублем {model['hedge_wins']}, p95 TTFT {p95}\n"
+        )
+        limiter = model['limiter']
+        section += (
+            f"   ⏱ {limiter['rpm']} запр./мин, ожиданий {limiter['waits']} "
+            f"(в среднем {limiter['avg_wait']} с), 429: {limiter['retry_after_events']}\n"
+        )
+    sections.append(section)
+
+    outgoing = telegram_send_queue.stats()
+    queued = outgoing['queued_by_priority']
+    waits = outgoing['avg_wait']
+    sections.append(
+        "📤 <b>Отправка в Telegram</b>\n\n"
+        f"📥 В очереди: {outgoing['queued']} (ответы {queued['interactive']}, служебные {queued['normal']}, "
+        f"рассылки {queued['bulk']}), ждут лимита чата: {outgoing['waiting_chat']}\n"
+        f"✅ Отправлено: {outgoing['sent']}, чатов в памяти: {outgoing['chats']}\n"
+        f"⏳ Среднее ожидание: ответы {waits['interactive']} с, служебные {waits['normal']} с, "
+        f"рассылки {waits['bulk']} с, максимум {outgoing['max_wait']} с\n"
+        f"🛑 429: {outgoing['retry_after_events']}, повторов: {outgoing['retries']}, "
+        f"не отправлено: {outgoing['gave_up']}, пауза ещё {outgoing['paused_for']} с"
+    )
+
+    deletions = deletion_scheduler.stats()
+    sections.append(
+        "🗑 <b>Отложенное удаление</b>\n\n"
+        f"⏳ Ждут: {deletions['pending']}, поставлено: {deletions['scheduled']}\n"
+        f"✅ Удалено: {deletions['deleted']} за {deletions['batches']} запросов, не удалось: {deletions['failed']}"
+    )
+
+    answers = response_cache.stats()
+    if answers['enabled']:
+        sections.append(
+            "🗂 <b>Кэш ответов модели</b>\n\n"
+            f"📦 Ответов: {answers['entries']}, {answers['bytes'] / 1024:.0f} из {answers['max_bytes'] / 1024:.0f} КБ\n"
+            f"🎯 Попаданий: {answers['hits']} (с диска: {answers['disk_hits']}), промахов: {answers['misses']} "
+            f"({answers['hit_rate'] * 100:.1f}%)\n"
+            f"♻️ Сохранено: {answers['stores']}, вытеснено: {answers['evictions']}"
+        )
+
+    for stats in get_retention_stats():
+        sections.append(
+            "🗃 <b>Архив сообщений</b>\n\n"
+            f"🔥 В message_logs: {stats['hot_rows']} (до {stats['hot_turns']} на пользователя, "
+            f"не старше {stats['hot_days']} дн.)\n"
+            f"📦 Перенесено: {stats['archived_rows']} в {stats['archived_batches']} пачках, "
+            f"сжатие x{stats['compression_ratio']}\n"
+            f"🧹 Удалено пачек: {stats['purged_batches']}, проходов: {stats['passes']}, "
+            f"последний {stats['last_run_ms']} мс"
+        )
+
+    queues = get_write_queue_stats()
+    if not queues:
+        sections.append("🗄 Очередь записи в БД еще не использовалась.")
+    for i, stats in enumerate(queues):
+        sections.append(
+            ("🗄 <b>Очередь записи в БД</b>\n\n" if i == 0 else "") +
+            f"📁 {stats['database']} ({stats['durability']})\n"
+            f"📥 В очереди: {stats['depth']} (максимум: {stats['max_depth']})\n"
+            f"💾 Сбросов: {stats['flush_count']}, строк: {stats['rows_flushed']}, ошибок: {stats['failed_rows']}\n"
+            f"⏱ Сброс: последний {stats['last_flush_ms']} мс, "
+            f"средний {stats['avg_flush_ms']} мс, максимум {stats['max_flush_ms']} мс\n"
+            f"⏳ Ожиданий из-за заполненного буфера: {stats['backpressure_waits']}"
+        )
+
+    for text in pack_sections(sections):
+        await message.answer(text)
+
+
 @error_handler
 async def handle_console_broadcast(message: Message, broadcast_text: str):
     """Консольная команда рассылки сообщений"""
-    from database import get_all_users_ids
-    from shared import bot
+    from broadcast import broadcast_engine
 
     try:
-        # Получаем все ID пользователей
-        with sqlite3.connect("users.db") as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT user_id FROM users")
-            user_ids = [row[0] for row in cursor.fetchall()]
+        # Прогресс рассылки приходит отдельным сообщением и обновляется в нем
+        await broadcast_engine.start(broadcast_text, message.from_user.id, message.chat.id)
+    except Exception as e:
+        await message.answer(f"❌ Ошибка при рассылке: {str(e)}")
 
-        success_count = 0
-        failed_count = 0
 
-        for user_id in user_ids:
-            try:
-                await bot.send_message(chat_id=user_id, text=broadcast_text)
-                success_count += 1
-            except Exception:
-                failed_count += 1
+@error_handler
+async def handle_console_broadcasts(message: Message):
+    """Консольная команда: последние рассылки"""
+    from async_database import get_recent_broadcast_jobs
+    from broadcast import STATUS_NAMES
+
+    jobs = await get_recent_broadcast_jobs(10)
+    if not jobs:
+        await message.answer("📢 Рассылок еще не было.")
+        return
 
-        await message.answer(
-            f"📢 Рассылка завершена!\n\n"
-            f"✅ Успешно отправлено: {success_count}\n"
-            f"❌ Не отправлено: {failed_count}"
+    text = "📢 <b>Последние рассылки</b>\n\n"
+    for job in jobs:
+        preview = job['text'][:40].replace("<", "&lt;").replace(">", "&gt;")
+        text += (
+            f"#{job['id']} [{job['created_at']}] {STATUS_NAMES.get(job['status'], job['status'])}\n"
+            f"   ✅ {job['sent']}, 🚫 {job['blocked']}, ❌ {job['failed']} из {job['total']}: {preview}\n"
         )
+    await message.answer(text)
 
-    except Exception as e:
-        await message.answer(f"❌ Ошибка при рассылке: {str(e)}")
+
+@error_handler
+async def handle_console_broadcast_control(message: Message, action: str, job_id: int):
+    """Консольные команды паузы, продолжения и отмены рассылки"""
+    from broadcast import broadcast_engine
+
+    actions = {
+        'pause': (broadcast_engine.pause, "⏸ Рассылка #{} приостановлена", "идет"),
+        'resume': (broadcast_engine.resume, "▶️ Рассылка #{} продолжается", "на паузе"),
+        'cancel': (broadcast_engine.cancel, "⛔ Рассылка #{} отменена", "идет или на паузе"),
+    }
+    handler, done_text, expected = actions[action]
+    if await handler(job_id):
+        await message.answer(done_text.format(job_id))
+    else:
+        await message.answer(f"❌ Рассылка #{job_id} не найдена или не {expected}")
 
 
 @sync_error_handler
@@ -0,0 +1,147 @@
+"""
+Асинхронный доступ к базе данных для хендлеров.
+
+Синхронные функции database.py выполняются в выделенных пулах потоков,
+поэтому обращения к SQLite (и fsync при записи) не блокируют event loop диспетчера.
+Чтение и запись идут разными полосами: читатели не ждут в очереди за записями,
+а все записи выполняются одним потоком, так что SQLite не упирается в busy-блокировки.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+import database
+import error_logger
+
+DB_READ_WORKERS = 4
+DB_WRITE_WORKERS = 1
+
+_read_executor = ThreadPoolExecutor(
+    max_workers=DB_READ_WORKERS, thread_name_prefix="db-read")
+_write_executor = ThreadPoolExecutor(
+    max_workers=DB_WRITE_WORKERS, thread_name_prefix="db-write")
+
+
+def _run_in(executor: ThreadPoolExecutor, func):
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
+    return wrapper
+
+
+def _read(func):
+    return _run_in(_read_executor, func)
+
+
+def _write(func):
+    return _run_in(_write_executor, func)
+
+
+def _flush(func):
+    # Ожидание сброса очереди записи может длиться секунды - в общем пуле, не занимая поток записи
+    return _run_in(None, func)
+
+
+async def run_write(func, *args, **kwargs):
+    """Выполняет синхронную запись в потоке записи - для модулей вне database.py"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_write_executor, partial(func, *args, **kwargs))
+
+
+def shutdown():
+    """Дожидается выполнения поставленных запросов и останавливает пулы"""
+    _read_executor.shutdown(wait=True)
+    _write_executor.shutdown(wait=True)
+
+
+# === Пользователи ===
+get_user = _read(database.get_user)
+get_user_info = _read(database.get_user_info)
+get_user_id_by_username = _read(database.get_user_id_by_username)
+get_all_users_ids = _read(database.get_all_users_ids)
+create_user = _write(database.create_user)
+update_user_mode = _write(database.update_user_mode)
+
+# === Балансы ===
+update_balance = _write(database.update_balance)
+update_purchase_balance = _write(database.update_purchase_balance)
+update_referral_balance = _write(database.update_referral_balance)
+transfer_referral_to_purchase_balance = _write(
+    database.transfer_referral_to_purchase_balance)
+
+# === Подписки и токены ===
+get_subscription_info = _read(database.get_subscription_info)
+get_active_subscription = _read(database.get_active_subscription)
+is_subscription_active = _read(database.is_subscription_active)
+update_subscription = _write(database.update_subscription)
+reset_daily_tokens_if_needed = _write(database.reset_daily_tokens_if_needed)
+increment_token_usage = _write(database.increment_token_usage)
+add_token_usage = _write(database.add_token_usage)
+
+# === История сообщений ===
+get_last_messages = _read(database.get_last_messages)
+log_message = _write(database.log_message)
+get_messages_after = _read(database.get_messages_after)
+get_conversation_summary = _read(database.get_conversation_summary)
+save_conversation_summary = _write(database.save_conversation_summary)
+
+# === Администраторы ===
+get_all_admins = _read(database.get_all_admins)
+add_admin = _write(database.add_admin)
+remove_admin = _write(database.remove_admin)
+
+
+async def is_user_admin(user_id: int) -> bool:
+    # Множество админов хранится в памяти (загружается в init_db),
+    # поэтому проверка выполняется прямо в event loop без пула потоков
+    return database.is_user_admin(user_id)
+
+
+# === Статистика ===
+get_system_stats = _read(database.get_system_stats)
+get_users_count = _read(database.get_users_count)
+get_referral_system_stats = _read(database.get_referral_system_stats)
+
+# === Скидки ===
+get_user_active_discount = _read(database.get_user_active_discount)
+get_discount_code = _read(database.get_discount_code)
+get_all_discount_codes = _read(database.get_all_discount_codes)
+apply_discount_to_user = _write(database.apply_discount_to_user)
+mark_discount_as_used = _write(database.mark_discount_as_used)
+create_discount_code = _write(database.create_discount_code)
+use_discount_code = _write(database.use_discount_code)
+delete_discount_code = _write(database.delete_discount_code)
+deactivate_discount_code = _write(database.deactivate_discount_code)
+
+# === Реферальная система ===
+get_referrer_id = _read(database.get_referrer_id)
+get_referrals = _read(database.get_referrals)
+get_referral_stats = _read(database.get_referral_stats)
+add_referral = _write(database.add_referral)
+add_referral_payment = _write(database.add_referral_payment)
+
+# === Рассылки ===
+set_user_blocked = _write(database.set_user_blocked)
+count_broadcast_recipients = _read(database.count_broadcast_recipients)
+get_broadcast_page = _read(database.get_broadcast_page)
+get_broadcast_recipients_done = _read(database.get_broadcast_recipients_done)
+create_broadcast_job = _write(database.create_broadcast_job)
+get_broadcast_job = _read(database.get_broadcast_job)
+get_broadcast_jobs = _read(database.get_broadcast_jobs)
+get_recent_broadcast_jobs = _read(database.get_recent_broadcast_jobs)
+set_broadcast_progress_message = _write(database.set_broadcast_progress_message)
+set_broadcast_status = _write(database.set_broadcast_status)
+save_broadcast_recipient = _write(database.save_broadcast_recipient)
+save_broadcast_progress = _write(database.save_broadcast_progress)
+flush_broadcast_writes = _flush(database.flush_broadcast_writes)
+
+# === Отложенное удаление сообщений ===
+save_scheduled_deletion = _write(database.save_scheduled_deletion)
+remove_scheduled_deletions = _write(database.remove_scheduled_deletions)
+get_scheduled_deletions = _read(database.get_scheduled_deletions)
+
+# === Журнал ошибок ===
+get_recent_errors = _read(error_logger.get_recent_errors)
+clear_error_logs = _write(error_logger.clear_error_logs)
+log_error = _write(error_logger.log_error)
@@ -0,0 +1,216 @@
+"""
+Нагрузка на режим чата: N чатов одновременно задают вопрос модели.
+
+Сообщения проходят настоящий путь бота - bot.handle_message, склейку
+сообщений, квоту, очередь к модели (scheduler.py), маршрутизатор моделей и
+потоковый ответ LiveReply с очередью отправки в Telegram (send_queue.py).
+Модель - локальная заглушка OpenRouter (openrouter_mock.py), Telegram -
+подмененная сессия aiogram, которая отвечает через --tg-latency секунд и
+запоминает, когда в чат пришел текст.
+
+Для каждого уровня нагрузки (--chats, по умолчанию 10, 100 и 1000 чатов)
+печатаются:
+- время до первого токена: от сообщения пользователя до первого фрагмента
+  ответа в Telegram (сообщение о месте в очереди не считается);
+- полное время ответа: от сообщения до конца обработки хода;
+- пропускная способность: ответов и токенов ответа в секунду.
+
+Каждый чат отправляет --turns сообщений по очереди, следующее - после ответа
+на предыдущее. Лимиты Telegram соблюдает очередь отправки; --no-send-queue
+отключает ее, чтобы отделить задержки модели от задержек отправки.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_chat_load.py [--chats 10 100 1000] [--turns 1]
+        [--ttft 0.2 0.5] [--tps 100] [--tokens 100] [--tg-latency 0.03] [--window 0] [--no-send-queue]
+
+Бенчмарк работает во временной директории и не трогает рабочий users.db.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageText, SendMessage
+from aiogram.types import Chat, Message, User
+
+MODEL = "stub/bench"
+QUEUE_STATUS_PREFIX = "⏳"
+
+
+def quantile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class FakeTelegramSession(BaseSession):
+    """Сессия aiogram без сети: запросы «выполняются» за latency секунд"""
+
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+        self.calls = 0
+        self.first_text = {}    # {chat_id: время первого фрагмента ответа}
+        self._ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, (SendMessage, EditMessageText)):
+            if not method.text.startswith(QUEUE_STATUS_PREFIX):
+                self.first_text.setdefault(method.chat_id, time.monotonic())
+            message_id = next(self._ids) if isinstance(method, SendMessage) else method.message_id
+            return Message(message_id=message_id, date=datetime.now(),
+                           chat=Chat(id=method.chat_id, type="private"), text=method.text).as_(bot)
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+
+def incoming(bot, user_id: int, text: str) -> Message:
+    user = User(id=user_id, is_bot=False, first_name=f"Bench {user_id}", username=f"bench{user_id}")
+    return Message(message_id=1, date=datetime.now(), chat=Chat(id=user_id, type="private"),
+                   from_user=user, text=text).as_(bot)
+
+
+async def run_level(chats: int, turns: int, first_user_id: int, session: FakeTelegramSession):
+    import bot as bot_module
+    import database
+    from coalescer import chat_coalescer
+
+    user_ids = range(first_user_id, first_user_id + chats)
+    for user_id in user_ids:
+        database.create_user(user_id, f"bench{user_id}", f"Bench {user_id}")
+        database.update_subscription(user_id, 'tier3', 30)
+        bot_module.chat_modes[user_id] = "chat"
+
+    done = {}       # {chat_id: Future хода, который сейчас обрабатывается}
+    ttfts, latencies = [], []
+
+    async def timed_turn(batch):
+        try:
+            await bot_module.handle_chat_turn(batch)
+        finally:
+            future = done.get(batch[-1].chat.id)
+            if future is not None and not future.done():
+                future.set_result(time.monotonic())
+
+    async def chat(user_id: int):
+        for turn in range(turns):
+            session.first_text.pop(user_id, None)
+            done[user_id] = asyncio.get_running_loop().create_future()
+            started = time.monotonic()
+            await bot_module.handle_message(
+                incoming(bot_module.bot, user_id, f"Вопрос {turn + 1} из чата {user_id}: как дела?"))
+            finished = await done[user_id]
+            latencies.append(finished - started)
+            if user_id in session.first_text:
+                ttfts.append(session.first_text[user_id] - started)
+
+    chat_coalescer.handler = timed_turn
+    calls_before = session.calls
+    started = time.monotonic()
+    await asyncio.gather(*(chat(user_id) for user_id in user_ids))
+    elapsed = time.monotonic() - started
+    return ttfts, latencies, elapsed, session.calls - calls_before
+
+
+def report(chats: int, turns: int, tokens: int, ttfts, latencies, elapsed, calls, router):
+    answers = len(latencies)
+    print(f"{chats} чатов, {answers} ответов за {elapsed:.2f} с")
+    if ttfts:
+        print(f"  до первого токена: p50 {quantile(ttfts, 0.5):.3f} с, p95 {quantile(ttfts, 0.95):.3f} с, "
+              f"p99 {quantile(ttfts, 0.99):.3f} с, максимум {max(ttfts):.3f} с")
+    print(f"  полный ответ:      p50 {quantile(latencies, 0.5):.3f} с, p95 {quantile(latencies, 0.95):.3f} с, "
+          f"p99 {quantile(latencies, 0.99):.3f} с, максимум {max(latencies):.3f} с")
+    print(f"  пропускная способность: {answers / elapsed:.1f} ответов/с, "
+          f"{answers * tokens / elapsed:.0f} токенов/с")
+    model = router.endpoints[0].stats()
+    print(f"  без первого токена: {chats * turns - len(ttfts)}, запросов к модели {model['requests']}, "
+          f"ошибок модели {model['failures']}, запросов к Telegram {calls}")
+    print()
+
+
+async def run(levels, turns: int, mock_profile: dict, tg_latency: float, window, send_queue: bool):
+    import bot as bot_module
+    import openrouter_mock
+    from coalescer import chat_coalescer
+    from config import LLM_MAX_CONCURRENCY
+    from context_summary import context_compactor
+    from llm import close_session
+    from providers import ModelEndpoint, model_router
+    from write_queue import shutdown_write_queues
+    from db_pool import close_all_connections
+    from send_queue import telegram_send_queue
+
+    session = FakeTelegramSession(tg_latency)
+    if send_queue:
+        session.middleware(telegram_send_queue)
+    bot_module.bot.session = session
+    if window is not None:
+        chat_coalescer.window = window
+
+    runner, url = await openrouter_mock.start(seed=1, default=mock_profile)
+    print(f"Модель: {mock_profile}; генераций одновременно: {LLM_MAX_CONCURRENCY}, "
+          f"склейка сообщений: {chat_coalescer.window} с, Telegram: {tg_latency} с на запрос, "
+          f"очередь отправки {'включена' if send_queue else 'выключена'}")
+    print()
+    try:
+        first_user_id = 1
+        for chats in levels:
+            # Для каждого уровня - своя модель со свежей статистикой и без ограничителя на клиенте
+            model_router.endpoints = [ModelEndpoint(MODEL, url, rpm=10 ** 9, burst=10 ** 9)]
+            result = await run_level(chats, turns, first_user_id, session)
+            report(chats, turns, mock_profile["tokens"], *result, model_router)
+            first_user_id += chats
+    finally:
+        await context_compactor.stop()
+        await close_session()
+        await runner.cleanup()
+        shutdown_write_queues()
+        close_all_connections()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--turns", type=int, default=1)
+    parser.add_argument("--ttft", type=float, nargs="+", default=[0.2, 0.5],
+                        help="задержка модели до первого токена: число или интервал")
+    parser.add_argument("--tps", type=float, default=100, help="скорость генерации, токенов в секунду")
+    parser.add_argument("--tokens", type=int, default=100, help="длина ответа модели в токенах")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов модели с HTTP-ошибкой")
+    parser.add_argument("--tg-latency", type=float, default=0.03, help="задержка запроса к Telegram, секунд")
+    parser.add_argument("--window", type=float, default=None,
+                        help="окно склейки сообщений (по умолчанию CHAT_COALESCE_WINDOW)")
+    parser.add_argument("--no-send-queue", action="store_true", help="отправлять в Telegram без лимитов")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_chat_load_")
+    os.chdir(workdir)
+
+    import database
+    database.DATABASE_NAME = os.path.join(workdir, "bench.db")
+    database.init_db()
+
+    mock_profile = {"ttft": (args.ttft[0], args.ttft[-1]), "tps": args.tps, "tokens": args.tokens,
+                    "error_rate": args.error_rate}
+    asyncio.run(run(args.chats, args.turns, mock_profile, args.tg_latency, args.window,
+                    not args.no_send_queue))
+
+
+if __name__ == "__main__":
+    main()
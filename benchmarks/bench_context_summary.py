@@ -0,0 +1,130 @@
+"""
+Размер запроса к модели на длинном разговоре: со сводкой и без.
+
+Моделирует разговор из --turns ходов (вопрос пользователя и ответ ассистента
+случайной длины) через настоящие ContextBuffer, журнал message_logs и
+ContextCompactor. На каждом ходу считает оценку токенов истории в запросе
+тремя способами:
+
+- вся история разговора;
+- последние MAX_HISTORY_LENGTH - 1 реплик (как бот собирал запрос раньше);
+- сводка + последние реплики в окне CONTEXT_RECENT_TOKENS.
+
+Вместо модели сводку строит детерминированная заглушка: она дописывает первые
+слова новых реплик и обрезает сводку до CONTEXT_SUMMARY_MAX_TOKENS. Фоновые
+обновления сводки дожидаются между ходами, как будто пользователь думает над
+ответом дольше, чем модель пишет сводку.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_context_summary.py [--turns 200] [--seed 1]
+
+Бенчмарк работает во временной директории и не трогает рабочий users.db.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+USER_ID = 1
+WORDS = ("модель", "запрос", "ответ", "данные", "пример", "вопрос", "задача", "текст",
+         "python", "функция", "список", "база", "ошибка", "проверка", "идея", "план")
+
+
+def phrase(rng: random.Random, low: int, high: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high))) + "."
+
+
+def history_tokens(messages) -> int:
+    from quota import estimate_prompt_tokens
+    return estimate_prompt_tokens(messages)
+
+
+async def run(turns: int, seed: int):
+    import database
+    from config import MAX_HISTORY_LENGTH, CONTEXT_SUMMARY_MAX_TOKENS
+    from context_buffer import ContextBuffer
+    from context_summary import ContextCompactor, SUMMARY_HEADER
+    from quota import estimate_tokens
+    from write_queue import flush_writes
+
+    calls = 0
+
+    async def summarize(summary, new_turns, max_tokens):
+        nonlocal calls
+        calls += 1
+        notes = " ".join(" ".join(message.split()[:6]) for role, message in new_turns if role == "user")
+        text = f"{summary} {notes}".strip()
+        # Сводка ограничена max_tokens: отбрасываем самое старое
+        while estimate_tokens(text) > max_tokens:
+            text = text[len(text) // 10:]
+        return text
+
+    rng = random.Random(seed)
+    buffer = ContextBuffer()
+    compactor = ContextCompactor(enabled=True, summarize=summarize)
+    full_history = []
+    rows = []
+
+    for turn in range(1, turns + 1):
+        question = phrase(rng, 10, 60)
+        history = await buffer.get(USER_ID)
+        window = history[-(MAX_HISTORY_LENGTH - 1):]
+        summary, recent = await compactor.build(USER_ID, window)
+
+        full = full_history + [{"role": "user", "content": question}]
+        last_n = [{"role": item['role'], "content": item['message']} for item in window]
+        last_n.append({"role": "user", "content": question})
+        compact = [{"role": "system", "content": SUMMARY_HEADER + summary}] if summary else []
+        compact += [{"role": item['role'], "content": item['message']} for item in recent]
+        compact.append({"role": "user", "content": question})
+        rows.append((turn, history_tokens(full), history_tokens(last_n), history_tokens(compact)))
+
+        answer = phrase(rng, 40, 250)
+        for role, message in (("user", question), ("assistant", answer)):
+            buffer.append(USER_ID, role, message)
+            database.log_message(USER_ID, role, message)
+            full_history.append({"role": role, "content": message})
+        flush_writes(database.DATABASE_NAME)
+
+        # Пользователь отвечает не мгновенно: фоновое обновление сводки успевает завершиться
+        await asyncio.gather(*list(compactor._tasks.values()))
+
+    print(f"{'ход':>5} {'вся история':>12} {'последние N':>12} {'сводка+окно':>12}")
+    for turn, full, last_n, compact in rows:
+        if turn in (1, 10, 25, 50, 75, 100, 150, 200) or turn == turns:
+            print(f"{turn:>5} {full:>12} {last_n:>12} {compact:>12}")
+
+    tail = rows[len(rows) // 2:]
+    print()
+    print(f"Максимум на второй половине разговора: последние N - {max(r[2] for r in tail)}, "
+          f"сводка+окно - {max(r[3] for r in tail)} токенов")
+    print(f"Среднее на второй половине: последние N - {sum(r[2] for r in tail) / len(tail):.0f}, "
+          f"сводка+окно - {sum(r[3] for r in tail) / len(tail):.0f} токенов")
+    print(f"Обновлений сводки: {calls}, свернуто реплик: {compactor.folded_turns}, "
+          f"потолок сводки {CONTEXT_SUMMARY_MAX_TOKENS} токенов")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_context_summary_")
+    os.chdir(workdir)
+
+    import database
+    database.DATABASE_NAME = os.path.join(workdir, "bench.db")
+    database.init_db()
+    database.create_user(USER_ID, "bench", "Bench")
+
+    asyncio.run(run(args.turns, args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Сравнение пропускной способности get_user / log_message:
+новое соединение на каждый вызов против долгоживущего соединения из db_pool.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_db_pool.py [--iterations 5000]
+
+Бенчмарк работает во временной директории и не трогает рабочий users.db.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def per_call_get_user(db_path: str, user_id: int):
+    with sqlite3.connect(db_path) as conn:
+        conn.row_factory = lambda cursor, row: {
+            col[0]: row[idx] for idx, col in enumerate(cursor.description)}
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+        return cursor.fetchone()
+
+
+def per_call_log_message(db_path: str, user_id: int, role: str, message: str):
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO message_logs (user_id, role, message)
+            VALUES (?, ?, ?)
+        """, (user_id, role, message))
+        conn.commit()
+
+
+def measure(label: str, func, iterations: int):
+    started = time.perf_counter()
+    for i in range(iterations):
+        func(i)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<32} {iterations / elapsed:>10.0f} ops/s  ({elapsed * 1000:.1f} ms)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_db_pool_")
+    os.chdir(workdir)
+
+    import database
+    from db_pool import close_all_connections
+
+    db_path = os.path.join(workdir, "bench.db")
+    database.DATABASE_NAME = db_path
+    database.init_db()
+    for user_id in range(args.users):
+        database.create_user(user_id, f"user{user_id}", f"User {user_id}")
+
+    users = args.users
+    n = args.iterations
+
+    print(f"get_user / log_message, {n} итераций, {users} пользователей\n")
+    t_read_old = measure("get_user (connect per call)",
+                         lambda i: per_call_get_user(db_path, i % users), n)
+    t_read_new = measure("get_user (pooled)",
+                         lambda i: database.get_user(i % users), n)
+    t_write_old = measure("log_message (connect per call)",
+                          lambda i: per_call_log_message(db_path, i % users, "user", "hello"), n)
+    t_write_new = measure("log_message (pooled)",
+                          lambda i: database.log_message(i % users, "user", "hello"), n)
+
+    print(f"\nУскорение get_user:    x{t_read_old / t_read_new:.1f}")
+    print(f"Ускорение log_message: x{t_write_old / t_write_new:.1f}")
+
+    close_all_connections()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Выгрузка и загрузка базы через db_transfer на большом числе пользователей.
+
+Создает базу с --users пользователями (по умолчанию миллион), по реферальной
+связи и сообщению на каждого десятого, затем выгружает ее в NDJSON и CSV и
+загружает обратно в пустую базу. Печатает скорость и пиковый RSS процесса,
+который не должен расти вместе с числом строк.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_db_transfer.py [--users 1000000] [--format ndjson]
+
+Бенчмарк работает во временной директории и не трогает рабочий users.db.
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss в Linux - в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def seed(conn, users: int):
+    batch = 50000
+    with conn:
+        for start in range(0, users, batch):
+            ids = range(start + 1, min(start + batch, users) + 1)
+            conn.executemany(
+                "INSERT INTO users (user_id, username, full_name, balance) VALUES (?, ?, ?, ?)",
+                ((i, f"user{i}", f"Пользователь {i}", i % 1000) for i in ids))
+            conn.executemany(
+                "INSERT INTO referrals (user_id, referrer_id) VALUES (?, ?)",
+                ((i, i // 10 + 1) for i in ids if i % 10 == 0))
+            conn.executemany(
+                "INSERT INTO message_logs (user_id, role, message) VALUES (?, ?, ?)",
+                ((i, "user", f"Сообщение пользователя {i}") for i in ids if i % 10 == 0))
+
+
+def run(label: str, func) -> float:
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28} {elapsed:7.1f} с   пиковый RSS {peak_rss_mb():7.1f} МБ")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--format", choices=("ndjson", "csv", "both"), default="both")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_db_transfer_")
+    os.chdir(workdir)
+
+    import database
+    import db_transfer
+    from db_pool import get_connection
+
+    database.DATABASE_NAME = os.path.join(workdir, "source.db")
+    database.init_db()
+    print(f"Создание базы на {args.users} пользователей...")
+    seed(get_connection(database.DATABASE_NAME), args.users)
+    print(f"RSS после создания: {peak_rss_mb():.1f} МБ\n")
+
+    formats = ("ndjson", "csv") if args.format == "both" else (args.format,)
+    tables = "users,referrals,message_logs"
+    for fmt in formats:
+        dump_dir = os.path.join(workdir, f"dump_{fmt}")
+        target = os.path.join(workdir, f"target_{fmt}.db")
+
+        t_export = run(f"export {fmt}", lambda: db_transfer.main(
+            ["export", dump_dir, "--format", fmt, "--tables", tables,
+             "--database", os.path.join(workdir, "source.db")]))
+        size_mb = sum(os.path.getsize(os.path.join(dump_dir, name))
+                      for name in os.listdir(dump_dir)) / 1024 / 1024
+        t_import = run(f"import {fmt}", lambda: db_transfer.main(
+            ["import", dump_dir, "--format", fmt, "--tables", tables, "--database", target]))
+
+        imported = get_connection(target).execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        print(f"{fmt}: {size_mb:.1f} МБ, выгрузка {args.users / t_export:,.0f} польз./с, "
+              f"загрузка {args.users / t_import:,.0f} польз./с, загружено {imported}\n")
+
+
+if __name__ == "__main__":
+    main()
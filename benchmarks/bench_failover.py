@@ -0,0 +1,134 @@
+"""
+Переключение моделей и дублирующие запросы на локальной заглушке (openrouter_mock.py).
+
+Сценарии:
+- «хвост задержек»: основная модель в 10% ответов молчит 3 секунды, запасная
+  быстрая. Сравнивается время до первого токена без дублирования и с ним;
+- «отказ основной»: основная модель отвечает 500 на все запросы. Все ответы
+  должны прийти от запасной, а основная после нескольких ошибок уйти на паузу
+  и перестать получать запросы;
+- «лимит провайдера»: у основной модели 60 запросов в минуту. Без ограничителя
+  на клиенте лишние запросы получают 429, с ним корзина подстраивается под
+  X-RateLimit-* и лишние запросы сразу уходят к запасной модели;
+- «все модели лежат»: после LLM_BREAKER_FAILURES неудач подряд выключатель
+  срабатывает, и остальные запросы получают LLMBusy без обращения к API.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_failover.py [--requests 300] [--concurrency 20]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+MESSAGES = [{"role": "user", "content": "Привет"}]
+# В сценариях, где проверяется не ограничитель, он не должен мешать
+UNLIMITED = {"rpm": 10 ** 9, "burst": 10 ** 9}
+
+
+def quantile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+async def run_load(router, requests: int, concurrency: int):
+    from llm import LLMError
+    from ratelimit import LLMBusy
+
+    semaphore = asyncio.Semaphore(concurrency)
+    ttfts, errors, models = [], 0, {}
+    busy = 0
+
+    async def one():
+        nonlocal errors, busy
+        async with semaphore:
+            started = time.monotonic()
+            first = None
+            usage = {}
+            try:
+                async for _ in router.stream(MESSAGES, usage=usage):
+                    if first is None:
+                        first = time.monotonic() - started
+            except LLMBusy:
+                busy += 1
+                return
+            except LLMError:
+                errors += 1
+                return
+            ttfts.append(first)
+            models[usage.get('model')] = models.get(usage.get('model'), 0) + 1
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return ttfts, errors, busy, models
+
+
+def report(label, ttfts, errors, busy, models, router):
+    print(f"{label}")
+    if ttfts:
+        print(f"  TTFT p50 {quantile(ttfts, 0.5):.3f} с, p95 {quantile(ttfts, 0.95):.3f} с, "
+              f"p99 {quantile(ttfts, 0.99):.3f} с, максимум {max(ttfts):.3f} с")
+    stats = router.stats()
+    print(f"  ошибок {errors}, «заняты» {busy}, дублирующих запросов {stats['hedges']}, "
+          f"переключений {stats['failovers']}, выключатель: {stats['breaker']}")
+    print(f"  ответили: {models}")
+    for model in stats['models']:
+        print(f"  {model['model']}: запросов {model['requests']}, ошибок {model['failures']}, "
+              f"429: {model['limiter']['retry_after_events']}, "
+              f"на паузе: {'нет' if model['available'] else 'да'}")
+    print()
+
+
+async def run(requests: int, concurrency: int):
+    import openrouter_mock
+    from llm import close_session
+    from providers import ModelRouter
+
+    runner, url = await openrouter_mock.start(seed=1)
+    try:
+        models = [dict(UNLIMITED, model="stub/slow-tail", url=url), dict(UNLIMITED, model="stub/fast", url=url)]
+        for hedge in (False, True):
+            router = ModelRouter(models, hedge=hedge)
+            result = await run_load(router, requests, concurrency)
+            report(f"Хвост задержек, дублирование {'включено' if hedge else 'выключено'}:", *result, router)
+
+        router = ModelRouter([dict(UNLIMITED, model="stub/failing", url=url),
+                              dict(UNLIMITED, model="stub/fast", url=url)])
+        result = await run_load(router, requests, concurrency)
+        report("Отказ основной модели:", *result, router)
+
+        for limited in (False, True):
+            runner_limited, url_limited = await openrouter_mock.start(seed=1)
+            # Без ограничителя - корзина, которая никогда не пустеет и не читает заголовки
+            primary = {"model": "stub/limited", "url": url_limited}
+            router = ModelRouter([primary if limited else dict(UNLIMITED, **primary),
+                                  dict(UNLIMITED, model="stub/fast", url=url_limited)], hedge=False)
+            if not limited:
+                router.endpoints[0].limiter.observe = lambda headers: None
+            result = await run_load(router, requests, concurrency)
+            report(f"Лимит провайдера 60/мин, ограничитель {'включен' if limited else 'выключен'}:",
+                   *result, router)
+            await runner_limited.cleanup()
+
+        router = ModelRouter([dict(UNLIMITED, model="stub/failing", url=url)], hedge=False)
+        result = await run_load(router, requests, concurrency)
+        report("Все модели лежат:", *result, router)
+    finally:
+        await close_session()
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
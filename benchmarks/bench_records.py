@@ -0,0 +1,119 @@
+"""
+Сравнение материализации строк: старый dict_factory (словарь на каждую строку,
+обернутый в sync_error_handler) против компактных записей из records.py.
+
+Меряется время и пиковый объем выделенной памяти (tracemalloc) для
+get_referrals и get_all_discount_codes на больших выборках.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_records.py [--rows 100000] [--repeat 5]
+
+Бенчмарк работает во временной директории и не трогает рабочий users.db.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+REFERRER_ID = 1
+
+REFERRALS_SQL = """
+    SELECT u.user_id, u.username, u.full_name, r.registration_date
+    FROM referrals r
+    JOIN users u ON r.user_id = u.user_id
+    WHERE r.referrer_id = ?
+    ORDER BY r.registration_date DESC
+"""
+DISCOUNT_CODES_SQL = "SELECT * FROM discount_codes ORDER BY created_at DESC"
+
+
+def fill(conn: sqlite3.Connection, rows: int):
+    with conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, username, full_name) VALUES (?, ?, ?)",
+            ((i, f"user{i}", f"User {i}") for i in range(2, rows + 2)))
+        conn.executemany(
+            "INSERT INTO referrals (user_id, referrer_id) VALUES (?, ?)",
+            ((i, REFERRER_ID) for i in range(2, rows + 2)))
+        conn.executemany(
+            "INSERT INTO discount_codes (code, discount_percent, max_uses, created_by) VALUES (?, ?, ?, ?)",
+            ((f"CODE{i}", 10 + i % 50, 100, REFERRER_ID) for i in range(rows)))
+
+
+def measure(label: str, func, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+        del result
+
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rows = len(result)
+    del result
+
+    print(f"{label:<40} {best * 1000:>8.1f} ms  {peak / 1024 / 1024:>7.1f} MiB  ({rows} строк)")
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_records_")
+    os.chdir(workdir)
+
+    from error_handler import sync_error_handler
+    from migrations import run_migrations
+    from records import Referral, DiscountCode
+
+    # Так строки материализовались до перехода на records.py
+    @sync_error_handler
+    def dict_factory(cursor, row):
+        return {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
+
+    conn = sqlite3.connect(os.path.join(workdir, "bench.db"))
+    run_migrations(conn)
+    fill(conn, args.rows)
+
+    def dict_rows(sql, params=()):
+        cursor = conn.cursor()
+        cursor.row_factory = dict_factory
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+    print(f"{args.rows} строк, лучшее из {args.repeat} запусков\n")
+    results = {}
+    results["get_referrals"] = (
+        measure("get_referrals (dict_factory)",
+                lambda: dict_rows(REFERRALS_SQL, (REFERRER_ID,)), args.repeat),
+        measure("get_referrals (records.Referral)",
+                lambda: Referral.fetch_all(conn.execute(REFERRALS_SQL, (REFERRER_ID,))), args.repeat),
+    )
+    results["get_all_discount_codes"] = (
+        measure("get_all_discount_codes (dict_factory)",
+                lambda: dict_rows(DISCOUNT_CODES_SQL), args.repeat),
+        measure("get_all_discount_codes (records)",
+                lambda: DiscountCode.fetch_all(conn.execute(DISCOUNT_CODES_SQL)), args.repeat),
+    )
+
+    print()
+    for name, ((t_old, m_old), (t_new, m_new)) in results.items():
+        print(f"{name:<24} время x{t_old / t_new:.1f}, память x{m_old / m_new:.1f}")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Прием обновлений через вебхук (webhook.py): синтетические обновления Telegram
+отправляются POST-запросами во встроенный aiohttp-сервер, как их отправлял бы
+Telegram.
+
+Каждый из --chats пользователей присылает /start (создание пользователя,
+приветствие с клавиатурой), --concurrency запросов одновременно. Telegram -
+подмененная сессия aiogram из bench_chat_load.py, отвечает через --tg-latency
+секунд. Лимиты Telegram соблюдает очередь отправки (send_queue.py), поэтому
+при тысячах чатов время до ответа бота определяет она; --no-send-queue
+отключает ее, чтобы измерить сам прием и обработку. Печатаются:
+- время ответа сервера на запрос (то, сколько ждет Telegram);
+- время от запроса до первого сообщения бота в чат;
+- время ответа на уведомление ЮKassa о неизвестном платеже.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_webhook.py [--chats 300] [--concurrency 50] [--tg-latency 0.03] [--no-send-queue]
+
+Бенчмарк работает во временной директории и не трогает рабочий users.db.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import aiohttp
+from aiohttp import web
+
+from bench_chat_load import FakeTelegramSession, quantile
+
+
+def start_update(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()), "text": "/start",
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"Bench {user_id}"},
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}]
+        }
+    }
+
+
+def print_latencies(label: str, values):
+    print(f"  {label}: p50 {quantile(values, 0.5) * 1000:.1f} мс, p95 {quantile(values, 0.95) * 1000:.1f} мс, "
+          f"p99 {quantile(values, 0.99) * 1000:.1f} мс, максимум {max(values) * 1000:.1f} мс")
+
+
+async def wait_idle(server):
+    while server.in_flight():
+        await asyncio.sleep(0.01)
+
+
+async def run(chats: int, concurrency: int, tg_latency: float, send_queue: bool):
+    import bot as bot_module
+    from admin import register_admin_handlers
+    from config import WEBHOOK_PATH, YOOKASSA_WEBHOOK_PATH
+    from send_queue import telegram_send_queue
+    from webhook import WebhookServer
+    from write_queue import shutdown_write_queues
+    from db_pool import close_all_connections
+
+    session = FakeTelegramSession(tg_latency)
+    if send_queue:
+        session.middleware(telegram_send_queue)
+    bot_module.bot.session = session
+    bot_module.register_handlers()
+    register_admin_handlers()
+
+    # Уведомления ЮKassa в бенчмарке приходят с локального адреса
+    server = WebhookServer(bot_module.bot, bot_module.dp, secret="bench", yookassa_networks=[])
+    runner = web.AppRunner(server.make_app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    base = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    acks, firsts = [], []
+    semaphore = asyncio.Semaphore(concurrency)
+    try:
+        async with aiohttp.ClientSession(headers={"X-Telegram-Bot-Api-Secret-Token": "bench"}) as client:
+            async def post(user_id: int):
+                async with semaphore:
+                    started = time.monotonic()
+                    async with client.post(base + WEBHOOK_PATH, json=start_update(user_id, user_id)) as response:
+                        assert response.status == 200, response.status
+                    acks.append((user_id, started, time.monotonic() - started))
+
+            started = time.monotonic()
+            await asyncio.gather(*(post(user_id) for user_id in range(1, chats + 1)))
+            accepted = time.monotonic() - started
+            await wait_idle(server)
+            elapsed = time.monotonic() - started
+
+            async with client.post(base + WEBHOOK_PATH, json=start_update(0, 0),
+                                   headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}) as response:
+                rejected_status = response.status
+
+            # Первое уведомление импортирует yookassa_integration - в замеры не идет
+            payment_acks = []
+            with contextlib.redirect_stdout(io.StringIO()):
+                for i in range(21):
+                    notification = {"event": "payment.succeeded",
+                                    "object": {"id": f"bench-{i}", "metadata": {"payment_id": f"bench-{i}"}}}
+                    payment_started = time.monotonic()
+                    async with client.post(base + YOOKASSA_WEBHOOK_PATH, json=notification) as response:
+                        assert response.status == 200, response.status
+                    if i:
+                        payment_acks.append(time.monotonic() - payment_started)
+                await wait_idle(server)
+
+        for user_id, sent_at, _ in acks:
+            if user_id in session.first_text:
+                firsts.append(session.first_text[user_id] - sent_at)
+
+        print(f"{chats} обновлений /start, {concurrency} запросов одновременно, Telegram {tg_latency} с на запрос, "
+              f"очередь отправки {'включена' if send_queue else 'выключена'}")
+        print(f"  приняты за {accepted:.2f} с ({chats / accepted:.0f} в секунду), обработаны за {elapsed:.2f} с")
+        print_latencies("ответ сервера", [ack for _, _, ack in acks])
+        if firsts:
+            print_latencies("до первого сообщения бота", firsts)
+        print(f"  без ответа бота: {chats - len(firsts)}, запросов к Telegram: {session.calls}")
+        print(f"  запрос с неверным секретом: HTTP {rejected_status}")
+        print_latencies("ответ на уведомление ЮKassa", payment_acks)
+    finally:
+        await runner.cleanup()
+        shutdown_write_queues()
+        close_all_connections()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--tg-latency", type=float, default=0.03, help="задержка запроса к Telegram, секунд")
+    parser.add_argument("--no-send-queue", action="store_true", help="отправлять в Telegram без лимитов")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_webhook_")
+    os.chdir(workdir)
+
+    import database
+    database.DATABASE_NAME = os.path.join(workdir, "bench.db")
+    database.init_db()
+
+    asyncio.run(run(args.chats, args.concurrency, args.tg_latency, not args.no_send_queue))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Локальная заглушка OpenRouter /chat/completions для бенчмарков без выхода в сеть.
+
+Поведение выбирается по имени модели в запросе (PROFILES), неизвестные модели
+получают профиль по умолчанию (его можно задать флагами командной строки):
+
+- ttft - задержка до первого токена (интервал, секунды), slow_rate и slow_ttft -
+  доля «зависших» ответов и их задержка;
+- tokens - длина ответа в токенах (не больше max_tokens из запроса), tps -
+  скорость генерации, токенов в секунду;
+- error_rate и status - доля ответов с HTTP-ошибкой и ее код;
+- stream_error_rate - доля ответов, которые обрываются ошибкой посреди потока
+  (как OpenRouter: событие с полем error и finish_reason "error");
+- rpm - лимит запросов в минуту с заголовками X-RateLimit-* и 429 + Retry-After.
+
+"stream": true - ответ потоком SSE: пока модель «думает», идут комментарии
+": OPENROUTER PROCESSING", затем фрагменты, usage и finish_reason, в конце
+[DONE]. "stream": false - один JSON с полным текстом после того же времени
+генерации. prompt_tokens оцениваются по длине сообщений запроса.
+
+Запуск отдельно (например, чтобы направить на нее бота через LLM_MODELS):
+    python benchmarks/openrouter_mock.py [--port 8808] [--ttft 0.3] [--tps 50] [--tokens 200]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+PROFILES = {
+    # Быстрая и стабильная
+    "stub/fast": {"ttft": (0.05, 0.15)},
+    # Обычно быстрая, но каждый десятый ответ начинается через 3 секунды
+    "stub/slow-tail": {"ttft": (0.05, 0.15), "slow_rate": 0.1, "slow_ttft": 3.0},
+    # Лежит
+    "stub/failing": {"error_rate": 1.0, "status": 500},
+    # Часто отвечает 429
+    "stub/rate-limited": {"ttft": (0.05, 0.15), "error_rate": 0.3, "status": 429},
+    # Честный лимит провайдера: 60 запросов в минуту
+    "stub/limited": {"ttft": (0.05, 0.15), "rpm": 60},
+    # Похожа на настоящую модель: первый токен через 0.3-0.8 с, дальше 50 токенов в секунду
+    "stub/realistic": {"ttft": (0.3, 0.8), "tokens": 150, "tps": 50},
+    # Иногда обрывает ответ на середине
+    "stub/flaky-stream": {"ttft": (0.05, 0.15), "stream_error_rate": 0.2},
+}
+DEFAULTS = {
+    "ttft": (0.05, 0.15),
+    "slow_rate": 0.0,
+    "slow_ttft": 0.0,
+    "error_rate": 0.0,
+    "stream_error_rate": 0.0,
+    "status": 500,
+    "rpm": 0,
+    "tokens": 40,
+    "tps": 200,
+}
+# Комментарий SSE, которым OpenRouter держит соединение, пока модель не начала отвечать
+KEEPALIVE = b": OPENROUTER PROCESSING\n\n"
+KEEPALIVE_INTERVAL = 0.5
+
+
+def estimate_prompt_tokens(messages) -> int:
+    return sum(len(str(message.get("content", ""))) // 4 + 4 for message in messages)
+
+
+def make_app(profiles=None, seed=None, default=None) -> web.Application:
+    profiles = PROFILES if profiles is None else profiles
+    default = dict(DEFAULTS, **(default or {}))
+    rng = random.Random(seed)
+    counters = {}
+    windows = {}   # {model: [начало минуты, запросов в ней]}
+
+    def error_response(status: int, message: str, headers=None) -> web.Response:
+        return web.json_response({"error": {"message": message, "code": status}},
+                                 status=status, headers=headers)
+
+    async def completions(request: web.Request) -> web.StreamResponse:
+        try:
+            body = await request.json()
+        except ValueError:
+            return error_response(400, "Invalid JSON")
+        model = body.get("model", "")
+        profile = dict(default, **profiles.get(model, {}))
+        counters[model] = counters.get(model, 0) + 1
+
+        headers = {}
+        if profile["rpm"]:
+            now = time.time()
+            window = windows.setdefault(model, [now, 0])
+            if now - window[0] >= 60:
+                window[:] = [now, 0]
+            window[1] += 1
+            reset_at = window[0] + 60
+            headers = {
+                "X-RateLimit-Limit": str(profile["rpm"]),
+                "X-RateLimit-Remaining": str(max(profile["rpm"] - window[1], 0)),
+                "X-RateLimit-Reset": str(int(reset_at * 1000)),
+            }
+            if window[1] > profile["rpm"]:
+                headers["Retry-After"] = str(max(int(reset_at - now), 1))
+                return error_response(429, "Rate limit exceeded", headers)
+
+        if rng.random() < profile["error_rate"]:
+            return error_response(profile["status"], f"{model} недоступна")
+
+        ttft = rng.uniform(*profile["ttft"])
+        if rng.random() < profile["slow_rate"]:
+            ttft = profile["slow_ttft"]
+        tokens = min(profile["tokens"], body.get("max_tokens") or profile["tokens"])
+        # Номер токена, на котором поток оборвется ошибкой (None - не оборвется)
+        break_at = rng.randrange(tokens) if tokens and rng.random() < profile["stream_error_rate"] else None
+        prompt_tokens = estimate_prompt_tokens(body.get("messages") or [])
+        token_delay = 1 / profile["tps"] if profile["tps"] else 0.0
+        name = model.split("/")[-1]
+        completion_id = f"gen-{counters[model]}"
+
+        finish_reason = "length" if tokens == body.get("max_tokens") else "stop"
+
+        if not body.get("stream"):
+            await asyncio.sleep(ttft + tokens * token_delay)
+            if break_at is not None:
+                return error_response(502, f"{model}: генерация прервана")
+            text = "".join(f"{name}{i} " for i in range(tokens))
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": finish_reason}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": tokens,
+                          "total_tokens": prompt_tokens + tokens}
+            }, headers=headers)
+
+        response = web.StreamResponse(headers=dict(headers, **{"Content-Type": "text/event-stream"}))
+        try:
+            await response.prepare(request)
+            waited = 0.0
+            while ttft - waited > KEEPALIVE_INTERVAL:
+                await asyncio.sleep(KEEPALIVE_INTERVAL)
+                waited += KEEPALIVE_INTERVAL
+                await response.write(KEEPALIVE)
+            await asyncio.sleep(ttft - waited)
+
+            started = time.monotonic()
+            for i in range(tokens):
+                if i == break_at:
+                    failure = {"id": completion_id, "error": {"message": f"{model}: генерация прервана", "code": 502},
+                               "choices": [{"delta": {"content": ""}, "finish_reason": "error"}]}
+                    await response.write(f"data: {json.dumps(failure)}\n\n".encode())
+                    return response
+                chunk = {"id": completion_id, "model": model,
+                         "choices": [{"index": 0, "delta": {"content": f"{name}{i} "}}]}
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                # Темп держится по часам, а не суммой пауз - так sleep не накапливает отставание
+                lag = started + (i + 1) * token_delay - time.monotonic()
+                await asyncio.sleep(max(lag, 0))
+            final = {"id": completion_id, "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}],
+                     "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": tokens,
+                               "total_tokens": prompt_tokens + tokens}}
+            await response.write(f"data: {json.dumps(final)}\n\n".encode())
+            await response.write(b"data: [DONE]\n\n")
+        except ConnectionResetError:
+            # Клиент отменил запрос (например, дублирующий ответ пришел раньше)
+            pass
+        return response
+
+    app = web.Application(client_max_size=16 * 1024 ** 2)
+    # Путь как у OpenRouter и короткий - как у прочих OpenAI-совместимых API
+    app.router.add_post("/api/v1/chat/completions", completions)
+    app.router.add_post("/v1/chat/completions", completions)
+    app["requests"] = counters
+    return app
+
+
+async def start(port: int = 0, profiles=None, seed=None, default=None):
+    """Запускает заглушку в текущем event loop: (runner, url)"""
+    runner = web.AppRunner(make_app(profiles, seed, default))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/api/v1/chat/completions"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8808)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--ttft", type=float, nargs="+", help="задержка до первого токена: число или интервал")
+    parser.add_argument("--tps", type=float, help="токенов в секунду")
+    parser.add_argument("--tokens", type=int, help="длина ответа в токенах")
+    parser.add_argument("--error-rate", type=float, help="доля ответов с HTTP-ошибкой")
+    parser.add_argument("--status", type=int, help="HTTP-статус ошибки")
+    parser.add_argument("--stream-error-rate", type=float, help="доля ответов, оборванных посреди потока")
+    parser.add_argument("--rpm", type=int, help="лимит запросов в минуту")
+    args = parser.parse_args()
+
+    default = {key: value for key, value in {
+        "tps": args.tps, "tokens": args.tokens, "error_rate": args.error_rate, "status": args.status,
+        "stream_error_rate": args.stream_error_rate, "rpm": args.rpm
+    }.items() if value is not None}
+    if args.ttft:
+        default["ttft"] = (args.ttft[0], args.ttft[-1])
+
+    print(f"Модели: {', '.join(PROFILES)}; остальные - {dict(DEFAULTS, **default)}")
+    print(f"URL: http://127.0.0.1:{args.port}/api/v1/chat/completions")
+    web.run_app(make_app(seed=args.seed, default=default), host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,20 +8,26 @@ from aiogram.types import (
 from aiogram.filters import Command
 import aiohttp
 import asyncio
-
-from config import OPENROUTER_API_KEY, AI_NAME
-from database import (
-    init_db,
+from contextlib import aclosing
+
+from config import OPENROUTER_API_KEY, AI_NAME, MAX_HISTORY_LENGTH, LLM_BUSY_REPLY, BOT_RUN_MODE
+from llm import close_session as close_llm_session, LLMError
+from providers import model_router
+from ratelimit import LLMBusy
+from live_reply import LiveReply, split_message
+from coalescer import chat_coalescer
+import response_cache
+from response_cache import response_cache as llm_response_cache
+from quota import quota, QuotaExceeded, estimate_tokens, tier_for
+from scheduler import llm_scheduler
+from database import init_db, get_storage
+from async_database import (
     get_user,
     create_user,
     update_user_mode,
-    reset_daily_tokens_if_needed,
-    increment_token_usage,
-    get_subscription_info,
     log_message,
-    get_last_messages,
-    is_subscription_active,
-    is_user_admin
+    is_user_admin,
+    set_user_blocked
 )
 from profile import (
     show_profile,
@@ -33,31 +39,32 @@ from profile import (
     process_referral_withdrawal_amount
 )
 from messages import get_welcome_message
-from state import message_history, chat_histories, last_bot_messages
+from db_pool import close_all_connections
+from write_queue import shutdown_write_queues
+from retention import start_retention, stop_retention
+from async_database import shutdown as shutdown_db_executors
+from storage import shutdown as shutdown_storage
+from state import message_history, last_bot_messages
+from context_buffer import chat_histories
+from context_summary import context_compactor
+from prompts import template_for, build_messages, is_known_mode
+from broadcast import broadcast_engine
+from webhook import run_webhook
+from message_cleanup import deletion_scheduler
 from shared import bot, dp
 from admin import register_admin_handlers, handle_admin_text_message
-from error_handler import error_handler, sync_error_handler
-from typing import Dict
+from error_handler import error_handler, sync_error_handler, set_main_loop
+from typing import Dict, List
 from aiogram.enums import ContentType
 
 
 # === Константы ===
-BASE_SYSTEM_PROMPT = "Ты умный, дружелюбный ассистент. Отвечай кратко, на русском языке."
-
-MODEL_PROMPTS = {
-    "teacher": "Ты опытный учитель с 20-летним стажем...",
-    "content_manager": "Ты профессиональный контент-менеджер...",
-    "editor": "Ты профессиональный редактор текстов...",
-    "chat": "Ты дружелюбный собеседник..."
-}
-
-MAX_HISTORY_LENGTH = 21
 chat_modes: Dict[int, str] = {}   # {chat_id: "menu" | "chat"}
 
 
 # === Главное меню ===
-@sync_error_handler
-def get_main_keyboard(user_id: int = None) -> InlineKeyboardMarkup:
+@error_handler
+async def get_main_keyboard(user_id: int = None) -> InlineKeyboardMarkup:
     buttons = [
         [
             InlineKeyboardButton(text="👤 Профиль", callback_data="profile"),
@@ -65,7 +72,7 @@ def get_main_keyboard(user_id: int = None) -> InlineKeyboardMarkup:
         ],
         [InlineKeyboardButton(text="💬 Чат", callback_data="start_chat")]
     ]
-    if user_id and is_user_admin(user_id):
+    if user_id and await is_user_admin(user_id):
         buttons.append([InlineKeyboardButton(
             text="👑 Админ-панель", callback_data="admin_panel")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
@@ -83,12 +90,16 @@ async def handle_start(message: Message):
     except:
         pass
 
-    if not get_user(user_id):
-        create_user(user_id, message.from_user.username,
-                    message.from_user.full_name)
+    user = await get_user(user_id)
+    if not user:
+        await create_user(user_id, message.from_user.username,
+                          message.from_user.full_name)
+    elif user.get('is_blocked'):
+        # Пользователь разблокировал бота - снова получает рассылки
+        await set_user_blocked(user_id, False)
 
-    welcome_text = get_welcome_message(user_id)
-    keyboard = get_main_keyboard(user_id)
+    welcome_text = await get_welcome_message(user_id)
+    keyboard = await get_main_keyboard(user_id)
 
     msg = await message.answer(welcome_text, reply_markup=keyboard)
     message_history[chat_id] = {"user_msgs": [], "bot_msgs": [msg]}
@@ -120,7 +131,10 @@ async def handle_modes(callback: CallbackQuery):
 async def handle_set_mode(callback: CallbackQuery):
     user_id = callback.from_user.id
     mode = callback.data.replace("mode_", "")
-    update_user_mode(user_id, mode)
+    if not is_known_mode(mode):
+        await callback.answer()
+        return
+    await update_user_mode(user_id, mode)
     await callback.answer(f"✅ Режим изменён на {mode}")
 
 
@@ -156,8 +170,8 @@ async def handle_back_to_main(callback: CallbackQuery):
     user_id = callback.from_user.id
     chat_modes[chat_id] = "menu"
 
-    welcome_text = get_welcome_message(user_id)
-    keyboard = get_main_keyboard(user_id)
+    welcome_text = await get_welcome_message(user_id)
+    keyboard = await get_main_keyboard(user_id)
 
     msg = await callback.message.answer(welcome_text, reply_markup=keyboard)
     message_history[chat_id] = {"user_msgs": [], "bot_msgs": [msg]}
@@ -219,27 +233,124 @@ async def handle_message(message: Message):
         )
 
         # Удаляем информационное сообщение через 10 секунд
-        await asyncio.sleep(10)
-        try:
-            await info_msg.delete()
-        except:
-            pass
+        await deletion_scheduler.schedule(chat_id, info_msg.message_id, 10)
+        return
+
+    # Сообщения, отправленные подряд, уйдут в модель одним вопросом
+    chat_coalescer.submit(message)
 
-        # Удаляем уведомление о закреплении через 10 секунд
-        await asyncio.sleep(10)
-        try:
-            # Получаем последние сообщения в чате и ищем уведомление о закреплении
-            async for msg in bot.get_chat_history(chat_id, limit=5):
-                if msg.text and "закрепил(а) удалённое сообщение" in msg.text.lower():
-                    await msg.delete()
-                    break
-        except:
-            pass
 
+async def handle_chat_turn(batch: List[Message]):
+    """Обработчик склеенных сообщений: последнее передается отдельно, чтобы error_handler нашел, кому ответить"""
+    await answer_chat_turn(batch[-1], batch)
+
+
+@error_handler
+async def answer_chat_turn(message: Message, batch: List[Message]):
+    """Отвечает на сообщения режима чата (склеенные подряд идущие) потоковым ответом модели"""
+    chat_id = message.chat.id
+    user_id = message.from_user.id
+    text = "\n".join(item.text for item in batch)
+
+    user = await get_user(user_id)
+    if not user:
+        await create_user(user_id, message.from_user.username,
+                          message.from_user.full_name)
+        user = await get_user(user_id)
+
+    # Промпт режима собран заранее; режим - из записи пользователя, которая читается через кэш
+    template = template_for(user.get('mode') if user else None)
+    # История берется из буфера в памяти, до того как в него попадет текущая реплика
+    history = await chat_histories.get(user_id)
+    # Длинный разговор: старые реплики заменяются сводкой, дословно идут только последние
+    summary, recent = await context_compactor.build(user_id, history[-(MAX_HISTORY_LENGTH - 1):])
+    messages, prompt_tokens = build_messages(template, summary, recent, text)
+
+    # Вопрос без контекста мог уже задаваться в этом режиме - отвечаем из кэша без модели и лимита
+    cache_key = None
+    if llm_response_cache.enabled and response_cache.is_cacheable(messages):
+        cache_key = response_cache.make_key(template.mode, template.text, text, template.hash)
+        cached = await llm_response_cache.get(cache_key)
+        if cached:
+            chat_coalescer.mark_answered(chat_id)
+            chat_histories.append(user_id, "user", text)
+            await log_message(user_id, "user", text)
+            for part in split_message(cached):
+                await bot.send_message(chat_id, part, parse_mode=None)
+            chat_histories.append(user_id, "assistant", cached)
+            await log_message(user_id, "assistant", cached)
+            return
+
+    # Лимит проверяется до обращения к модели; max_tokens ответа - из остатка лимита
+    try:
+        reservation = await quota.reserve(user_id, messages, prompt_tokens)
+    except QuotaExceeded as e:
+        await message.answer(
+            f"⛔ Дневной лимит токенов исчерпан ({e.used}/{e.limit}).\n"
+            "Лимит обновится завтра, а увеличить его можно подпиской в профиле.")
         return
 
-    # Основная логика общения с AI (ваша существующая логика)
-    await message.answer("⚡ Чат с ИИ пока заглушка, добавь сюда логику общения.")
+    reply = LiveReply(bot, chat_id)
+
+    async def show_queue_position(position: int):
+        await reply.status(f"⏳ Сейчас много запросов, ваше место в очереди: {position}")
+
+    usage = {}
+    # Все, что идет после резервирования, - внутри try: отмена или ошибка отправки не оставят резерв висеть
+    try:
+        await reply.start()
+        # Слот генерации выдается с учетом подписки; место в очереди показывается в сообщении ответа
+        async with llm_scheduler.slot(user_id, await tier_for(user_id), on_wait=show_queue_position):
+            # aclosing: при отмене новым сообщением запрос к модели закрывается сразу
+            async with aclosing(model_router.stream(messages, max_tokens=reservation.max_tokens,
+                                                    usage=usage)) as stream:
+                async for delta in stream:
+                    await reply.append(delta)
+    except LLMError as e:
+        chat_coalescer.mark_answered(chat_id)
+        if reply.text:
+            # Модель оборвалась на середине: показанная часть списывается, остаток резерва возвращается
+            quota.commit(reservation, estimate_tokens(reply.text))
+        else:
+            quota.release(reservation)
+        if isinstance(e, LLMBusy):
+            # Запрос не отправлялся - ошибкой это не считаем, отвечаем заготовкой
+            fallback = LLM_BUSY_REPLY
+        else:
+            from async_database import log_error
+            await log_error("LLMError", str(e), None, user_id)
+            fallback = "⚠️ Модель сейчас недоступна, попробуйте еще раз чуть позже."
+        chat_histories.append(user_id, "user", text)
+        await log_message(user_id, "user", text)
+        await reply.finish(fallback=fallback)
+        return
+    except asyncio.CancelledError:
+        # Пришло новое сообщение: вопрос будет задан заново вместе с ним, в журнал его не пишем
+        quota.commit(reservation, estimate_tokens(reply.text))
+        await reply.abort("\n\n⏹ Ответ прерван новым сообщением")
+        raise
+    except BaseException:
+        # Прерванный ответ: списываем то, что модель успела сгенерировать
+        quota.commit(reservation, estimate_tokens(reply.text))
+        raise
+
+    # Ответ получен целиком - новое сообщение его уже не отменит.
+    # Расход списывается до первого await, а итог показывается и пишется в журнал в finally
+    chat_coalescer.mark_answered(chat_id)
+    quota.commit(reservation,
+                 usage.get('completion_tokens') or estimate_tokens(reply.text),
+                 usage.get('prompt_tokens'))
+    chat_histories.append(user_id, "user", text)
+    try:
+        await log_message(user_id, "user", text)
+    finally:
+        await reply.finish(fallback="🤔 Модель вернула пустой ответ, попробуйте переформулировать вопрос.")
+        if reply.text:
+            chat_histories.append(user_id, "assistant", reply.text)
+            await log_message(user_id, "assistant", reply.text)
+    # Обрезанный по max_tokens ответ не кэшируем
+    if reply.text and cache_key and usage.get('finish_reason') == "stop":
+        await llm_response_cache.put(cache_key, reply.text)
 
 # === Регистрация хендлеров ===
 
@@ -248,6 +359,7 @@ async def handle_message(message: Message):
 def register_handlers():
     dp.message.register(handle_start, Command("start"))
     dp.message.register(handle_message, F.text & ~F.text.startswith("/"))
+    chat_coalescer.handler = handle_chat_turn
 
     dp.callback_query.register(handle_modes, F.data == "modes")
     dp.callback_query.register(handle_set_mode, F.data.startswith("mode_"))
@@ -278,7 +390,31 @@ async def main():
     init_db()
     register_handlers()
     register_admin_handlers()
-    await dp.start_polling(bot)
+    set_main_loop(asyncio.get_running_loop())
+    for shard in get_storage().shards:
+        start_retention(shard)
+    quota.start()
+    llm_response_cache.purge_expired()
+    await deletion_scheduler.start()
+    await broadcast_engine.resume_all()
+    try:
+        if BOT_RUN_MODE == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            # Вебхук, оставшийся от запуска в режиме webhook, не дал бы получать обновления опросом
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await broadcast_engine.stop()
+        await deletion_scheduler.stop()
+        stop_retention()
+        await context_compactor.stop()
+        await quota.stop()
+        await close_llm_session()
+        shutdown_db_executors()
+        shutdown_storage()
+        shutdown_write_queues()
+        close_all_connections()
 
 
 if __name__ == "__main__":
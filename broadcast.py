@@ -0,0 +1,245 @@
+"""
+Рассылки всем пользователям из /console.
+
+Задание рассылки хранится в broadcast_jobs вместе с курсором обхода: номер
+шарда и последний user_id, до которого рассылка дошла. Получатели читаются
+страницами по BROADCAST_PAGE_SIZE по первичному ключу (WHERE user_id > ?), без
+загрузки всех id в память. Страница отправляется параллельно, но не больше
+BROADCAST_CONCURRENCY сообщений одновременно; темп и лимиты Telegram держит
+очередь отправки (send_queue.py), рассылка в ней идет с приоритетом BULK и
+уступает ответам пользователям.
+
+Итог по каждому получателю пишется в broadcast_recipients: отправлено, ошибка
+или бот заблокирован. Заблокировавшие бота (403 или «chat not found») получают
+users.is_blocked = 1 и в следующие рассылки не попадают, пока снова не нажмут
+/start. Курсор сдвигается после страницы, поэтому после перезапуска бота
+рассылка продолжается со следующей страницы, а уже обработанные получатели
+незаконченной страницы пропускаются.
+
+Ход рассылки показывается одним сообщением администратору, которое
+редактируется не чаще раза в BROADCAST_PROGRESS_INTERVAL секунд.
+"""
+import asyncio
+import time
+from typing import Dict, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from async_database import (
+    count_broadcast_recipients,
+    create_broadcast_job,
+    flush_broadcast_writes,
+    get_broadcast_job,
+    get_broadcast_jobs,
+    get_broadcast_page,
+    get_broadcast_recipients_done,
+    save_broadcast_progress,
+    save_broadcast_recipient,
+    set_broadcast_progress_message,
+    set_broadcast_status,
+    set_user_blocked
+)
+from config import BROADCAST_CONCURRENCY, BROADCAST_PAGE_SIZE, BROADCAST_PROGRESS_INTERVAL
+from database import get_storage
+from records import BroadcastJob
+from send_queue import send_priority, BULK, NORMAL
+from shared import bot
+
+STATUS_NAMES = {
+    'running': "▶️ идет",
+    'paused': "⏸ на паузе",
+    'cancelled': "⛔ отменена",
+    'done': "✅ завершена"
+}
+# Сколько секунд ждать отправок в полете при остановке бота
+STOP_TIMEOUT = 10
+
+
+def progress_text(job_id: int, status: str, total: int, sent: int, failed: int, blocked: int) -> str:
+    processed = sent + failed + blocked
+    percent = processed * 100 // total if total else 100
+    return (
+        f"📢 <b>Рассылка #{job_id}</b>: {STATUS_NAMES.get(status, status)}\n\n"
+        f"📊 Обработано: {processed} из {total} ({min(percent, 100)}%)\n"
+        f"✅ Отправлено: {sent}\n"
+        f"🚫 Заблокировали бота: {blocked}\n"
+        f"❌ Ошибок: {failed}"
+    )
+
+
+class BroadcastEngine:
+    def __init__(self, concurrency: int = BROADCAST_CONCURRENCY,
+                 page_size: int = BROADCAST_PAGE_SIZE,
+                 progress_interval: float = BROADCAST_PROGRESS_INTERVAL):
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.progress_interval = progress_interval
+        self._tasks: Dict[int, asyncio.Task] = {}
+        # Почему задание должно остановиться: paused, cancelled или stopped (остановка бота)
+        self._interrupts: Dict[int, str] = {}
+
+    async def start(self, text: str, created_by: int, chat_id: int) -> int:
+        """Создает рассылку, отправляет сообщение с прогрессом в chat_id и запускает ее"""
+        total = await count_broadcast_recipients()
+        job_id = await create_broadcast_job(text, created_by, total)
+        with send_priority(NORMAL):
+            message = await bot.send_message(chat_id, progress_text(job_id, 'running', total, 0, 0, 0))
+        await set_broadcast_progress_message(job_id, chat_id, message.message_id)
+        self._launch(job_id)
+        return job_id
+
+    async def resume_all(self) -> int:
+        """Продолжает рассылки, прерванные остановкой бота"""
+        jobs = await get_broadcast_jobs(('running',))
+        for job in jobs:
+            self._launch(job.id)
+        return len(jobs)
+
+    async def pause(self, job_id: int) -> bool:
+        job = await get_broadcast_job(job_id)
+        if job is None or job.status != 'running':
+            return False
+        await set_broadcast_status(job_id, 'paused')
+        self._interrupt(job_id, 'paused')
+        return True
+
+    async def resume(self, job_id: int) -> bool:
+        job = await get_broadcast_job(job_id)
+        if job is None or job.status != 'paused':
+            return False
+        # Пауза могла прийти, пока отправлялась страница: ждем, пока прежний запуск допишет итоги
+        await self._wait(job_id)
+        await set_broadcast_status(job_id, 'running')
+        self._launch(job_id)
+        return True
+
+    async def cancel(self, job_id: int) -> bool:
+        job = await get_broadcast_job(job_id)
+        if job is None or job.status not in ('running', 'paused'):
+            return False
+        await set_broadcast_status(job_id, 'cancelled')
+        if job_id in self._tasks:
+            self._interrupt(job_id, 'cancelled')
+        else:
+            # Рассылка на паузе: задачи нет, прогресс обновляем сами
+            await self._report(job, 'cancelled', job.sent, job.failed, job.blocked)
+        return True
+
+    async def stop(self):
+        """Останавливает рассылки при остановке бота; в БД они остаются running"""
+        for job_id in list(self._tasks):
+            self._interrupt(job_id, 'stopped')
+        tasks = list(self._tasks.values())
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=STOP_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def active(self) -> int:
+        return len(self._tasks)
+
+    def _launch(self, job_id: int):
+        task = self._tasks.get(job_id)
+        if task is not None and not task.done():
+            return
+        self._interrupts.pop(job_id, None)
+        task = asyncio.get_running_loop().create_task(self._run(job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    def _interrupt(self, job_id: int, reason: str):
+        if job_id in self._tasks:
+            self._interrupts[job_id] = reason
+
+    async def _wait(self, job_id: int):
+        task = self._tasks.get(job_id)
+        if task is not None:
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _run(self, job_id: int):
+        job = await get_broadcast_job(job_id)
+        if job is None:
+            return
+        counts = {'sent': job.sent, 'failed': job.failed, 'blocked': job.blocked}
+        shard, last_user_id = job.shard, job.last_user_id
+        shard_count = len(get_storage().shards)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        reported_at = time.monotonic()
+
+        with send_priority(BULK):
+            while shard < shard_count and job_id not in self._interrupts:
+                page = await get_broadcast_page(shard, last_user_id, self.page_size)
+                done = await get_broadcast_recipients_done(job_id, page[0], page[-1]) if page else set()
+                if page is None or done is None:
+                    # Ошибка БД уже записана в журнал: ставим на паузу, продолжить можно из /console
+                    await set_broadcast_status(job_id, 'paused')
+                    self._interrupts[job_id] = 'paused'
+                    break
+                if not page:
+                    shard, last_user_id = shard + 1, 0
+                    await self._checkpoint(job_id, shard, last_user_id, counts)
+                    continue
+
+                await asyncio.gather(*(self._deliver(job, user_id, counts, semaphore)
+                                       for user_id in page if user_id not in done))
+                # Прерванная страница будет дослана целиком: курсор остается на месте,
+                # а получатели с итогом пропускаются
+                if job_id not in self._interrupts:
+                    last_user_id = page[-1]
+                await self._checkpoint(job_id, shard, last_user_id, counts)
+
+                if time.monotonic() - reported_at >= self.progress_interval:
+                    reported_at = time.monotonic()
+                    await self._report(job, 'running', **counts)
+
+        reason = self._interrupts.pop(job_id, None)
+        if reason is None:
+            await set_broadcast_status(job_id, 'done')
+            await self._report(job, 'done', **counts)
+        elif reason != 'stopped':
+            await self._report(job, reason, **counts)
+
+    async def _checkpoint(self, job_id: int, shard: int, last_user_id: int, counts: Dict[str, int]):
+        # Сначала итоги по получателям страницы - вне потока записи, он нужен остальным;
+        # сам курсор может подождать сброса: после перезапуска записанные итоги пропустятся
+        await flush_broadcast_writes()
+        await save_broadcast_progress(job_id, shard, last_user_id, **counts)
+
+    async def _deliver(self, job: BroadcastJob, user_id: int, counts: Dict[str, int],
+                       semaphore: asyncio.Semaphore):
+        async with semaphore:
+            if job.id in self._interrupts:
+                return
+            error: Optional[str] = None
+            try:
+                await bot.send_message(chat_id=user_id, text=job.text)
+                status = 'sent'
+            except TelegramForbiddenError as e:
+                status, error = 'blocked', e.message
+            except TelegramBadRequest as e:
+                status, error = ('blocked' if "chat not found" in e.message.lower() else 'failed'), e.message
+            except Exception as e:
+                status, error = 'failed', str(e)
+
+            counts[status] += 1
+            await save_broadcast_recipient(job.id, user_id, status, error and error[:200])
+            if status == 'blocked':
+                await set_user_blocked(user_id, True)
+
+    async def _report(self, job: BroadcastJob, status: str, sent: int, failed: int, blocked: int):
+        """Обновляет сообщение с прогрессом рассылки"""
+        if not job.progress_chat_id:
+            return
+        text = progress_text(job.id, status, job.total, sent, failed, blocked)
+        try:
+            with send_priority(NORMAL):
+                await bot.edit_message_text(text=text, chat_id=job.progress_chat_id,
+                                            message_id=job.progress_message_id)
+        except TelegramBadRequest:
+            # Текст не изменился или сообщение удалено - рассылка продолжается
+            pass
+
+
+broadcast_engine = BroadcastEngine()
@@ -0,0 +1,121 @@
+"""
+Склейка сообщений, которые пользователь отправляет очередью.
+
+Мысль часто приходит в чат тремя-пятью короткими сообщениями подряд. Вместо
+отдельного запроса к модели и отдельной записи в журнал на каждое сообщение
+они копятся, пока пользователь пишет: запрос уходит, когда в течение
+CHAT_COALESCE_WINDOW секунд не пришло нового сообщения, и все накопленное
+становится одним вопросом.
+
+Если новое сообщение приходит, пока модель еще отвечает на предыдущие, ответ
+уже неактуален: генерация отменяется, а ее сообщения присоединяются к новым.
+Отменить можно только до тех пор, пока обработчик не отметил ответ
+отправленным (mark_answered) - после этого новое сообщение просто ждет своей очереди.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from aiogram.types import Message
+
+from config import CHAT_COALESCE_WINDOW
+
+Handler = Callable[[List[Message]], Awaitable[None]]
+
+
+class _ChatState:
+    __slots__ = ("pending", "in_flight", "timer", "task", "waits", "answered")
+
+    def __init__(self):
+        self.pending: List[Message] = []
+        self.in_flight: List[Message] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.task: Optional[asyncio.Task] = None
+        self.waits: Set[asyncio.Task] = set()   # Предыдущие ходы, которых ждет текущий
+        self.answered = False
+
+
+class ChatCoalescer:
+    def __init__(self, handler: Optional[Handler] = None, window: float = CHAT_COALESCE_WINDOW):
+        self.handler = handler
+        self.window = window
+        self._chats: Dict[int, _ChatState] = {}
+
+        self.received = 0
+        self.turns = 0
+        self.merged = 0
+        self.cancelled = 0
+
+    def submit(self, message: Message):
+        """Принимает сообщение чата; ответ будет запущен после паузы в переписке"""
+        chat_id = message.chat.id
+        state = self._chats.get(chat_id)
+        if state is None:
+            state = self._chats[chat_id] = _ChatState()
+        state.pending.append(message)
+        self.received += 1
+
+        if state.task is not None and not state.task.done() and not state.answered:
+            # Ответ на предыдущие сообщения еще не готов - отвечаем на все сразу
+            state.task.cancel()
+            self.merged -= max(len(state.in_flight) - 1, 0)
+            state.pending[:0] = state.in_flight
+            state.in_flight = []
+            self.cancelled += 1
+
+        if state.timer is not None:
+            state.timer.cancel()
+        state.timer = asyncio.get_running_loop().call_later(
+            self.window, self._start_turn, chat_id)
+
+    def mark_answered(self, chat_id: int):
+        """Ответ отправлен целиком: дальше текущий запрос не отменяется"""
+        state = self._chats.get(chat_id)
+        if state is not None:
+            state.answered = True
+
+    def _start_turn(self, chat_id: int):
+        state = self._chats.get(chat_id)
+        if state is None:
+            return
+        state.timer = None
+        if not state.pending:
+            return
+        batch, state.pending = state.pending, []
+        # Ход, отмененный, пока ждал предыдущего, уже завершен - ждать надо и тех, кого ждал он
+        previous = {task for task in state.waits | {state.task} if task is not None and not task.done()}
+        state.waits = previous
+        state.in_flight = batch
+        state.answered = False
+        state.task = asyncio.get_running_loop().create_task(
+            self._run(chat_id, batch, previous))
+        self.turns += 1
+        self.merged += len(batch) - 1
+
+    async def _run(self, chat_id: int, batch: List[Message], previous: Set[asyncio.Task]):
+        try:
+            # Ответы одного чата идут по порядку: ждем, пока завершатся (или отменятся) предыдущие.
+            # asyncio.wait, а не gather: отмена этого хода не должна отменять уже отвеченный предыдущий
+            if previous:
+                await asyncio.wait(previous)
+            await self.handler(batch)
+        finally:
+            state = self._chats.get(chat_id)
+            if state is not None and state.task is asyncio.current_task():
+                # waits не сбрасываем: ход, отмененный во время ожидания, передает их следующему
+                state.task = None
+                state.in_flight = []
+                if not state.pending and state.timer is None:
+                    del self._chats[chat_id]
+
+    def stats(self) -> Dict:
+        return {
+            'chats': len(self._chats),
+            'received': self.received,
+            'turns': self.turns,
+            'merged': self.merged,
+            'cancelled': self.cancelled
+        }
+
+
+# Обработчик (bot.handle_chat_turn) назначается при регистрации хендлеров
+chat_coalescer = ChatCoalescer()
@@ -9,3 +9,150 @@ YOOKASSA_SHOP_ID = "1146264"  # Замените на ваш Shop ID
 # Замените на ваш секретный ключ
 YOOKASSA_SECRET_KEY = "test_1UuSfN3Lz4rZ2ceWXhq6q0m8YBbXYg1EQZLE5Ydddhc"
 YOOKASSA_RETURN_URL = "https://t.me/zenith_ii_bot"  # URL возврата после оплаты
+
+# Отложенная запись частых INSERT/UPDATE (журнал сообщений, счетчики токенов, журнал ошибок)
+DB_WRITE_FLUSH_INTERVAL_MS = 50   # Как часто сбрасывать буфер в БД
+DB_WRITE_BATCH_ROWS = 500         # Сбрасывать раньше, если набралось столько строк
+DB_WRITE_QUEUE_SIZE = 10000       # Максимум строк в буфере, дальше писатели ждут
+DB_WRITE_DURABILITY = "buffered"  # "buffered" | "group" | "immediate"
+
+# Шардирование данных пользователей (storage.py)
+DB_SHARDS = 1  # Число файлов-шардов; 1 - все данные в одном users.db
+
+# Кэш записей пользователей (database.get_user)
+USER_CACHE_SIZE = 10000  # Максимум пользователей в кэше
+USER_CACHE_TTL = 300     # Время жизни записи, секунд
+
+# Хранение журнала сообщений (retention.py)
+MESSAGE_HOT_TURNS = 200          # Сколько последних сообщений пользователя держать в message_logs
+MESSAGE_HOT_DAYS = 30            # Сообщения старше стольких дней уходят в архив (0 - только по количеству)
+MESSAGE_ARCHIVE_INTERVAL = 600   # Как часто переносить старые сообщения в архив, секунд
+MESSAGE_ARCHIVE_CHUNK_ROWS = 500  # Сообщений в одном сжатом блоке архива
+MESSAGE_ARCHIVE_PURGE_DAYS = 0   # Удалять архивные блоки старше стольких дней (0 - хранить всегда)
+
+# Потоковые ответы модели (llm.py, live_reply.py)
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+LLM_REQUEST_TIMEOUT = 120       # Максимальное время генерации ответа, секунд
+LLM_CONNECT_TIMEOUT = 10        # Таймаут соединения с OpenRouter, секунд
+LLM_MAX_CONNECTIONS = 100       # Одновременных соединений с OpenRouter
+STREAM_EDIT_INTERVAL = 1.0      # Не чаще одного редактирования сообщения за столько секунд
+TELEGRAM_MESSAGE_LIMIT = 4096   # Максимальная длина сообщения Telegram
+
+# Контекст диалога в памяти (context_buffer.py)
+MAX_HISTORY_LENGTH = 21                     # Сколько последних реплик передавать модели
+CONTEXT_MEMORY_BUDGET = 64 * 1024 * 1024    # Общий объем буферов контекста, байт
+
+# Дневные лимиты токенов по подпискам (quota.py)
+DAILY_TOKEN_LIMITS = {
+    'free': 20,
+    'tier1': 20000,
+    'tier2': 40000,
+    'tier3': 100000
+}
+QUOTA_CHARGE_PROMPT_TOKENS = False  # Списывать ли с лимита токены запроса (по умолчанию - только ответа)
+QUOTA_MIN_COMPLETION_TOKENS = 10    # Меньше такого остатка на ответ - запрос отклоняется сразу
+LLM_MAX_COMPLETION_TOKENS = 2048    # Потолок max_tokens для одного ответа
+QUOTA_FLUSH_INTERVAL = 5            # Как часто сбрасывать счетчики токенов в БД, секунд
+
+# Кэш ответов модели на одинаковые вопросы (response_cache.py)
+LLM_RESPONSE_CACHE_ENABLED = False                # Включить кэш ответов
+LLM_RESPONSE_CACHE_TTL = 6 * 60 * 60              # Время жизни ответа, секунд
+LLM_RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024   # Объем кэша в памяти, байт
+LLM_RESPONSE_CACHE_MAX_PROMPT_CHARS = 500         # Кэшируются только короткие вопросы
+LLM_RESPONSE_CACHE_DATABASE = None                # Файл SQLite для постоянного уровня, например "response_cache.db"
+
+# Кэш системного промпта на стороне провайдера (prompts.py)
+LLM_PROMPT_CACHE_ENABLED = True                               # Помечать промпт режима cache_control
+LLM_PROMPT_CACHE_MODEL_PREFIXES = ("anthropic/", "google/")   # Модели, которым нужна явная пометка
+LLM_PROMPT_CACHE_MIN_TOKENS = 1024                            # Более короткий промпт провайдеры не кэшируют
+
+# Склейка быстрых сообщений подряд в один запрос к модели (coalescer.py)
+CHAT_COALESCE_WINDOW = 0.8  # Сколько ждать следующего сообщения пользователя, секунд (0 - не ждать)
+
+# Очередь запросов к модели (scheduler.py)
+LLM_MAX_CONCURRENCY = 50        # Одновременных генераций на весь бот
+LLM_PER_USER_INFLIGHT = 1       # Одновременных генераций на одного пользователя
+LLM_TIER_WEIGHTS = {            # Доля слотов, которую получает подписка при очереди
+    'free': 1,
+    'tier1': 2,
+    'tier2': 4,
+    'tier3': 8
+}
+LLM_QUEUE_NOTICE_DELAY = 1.0    # Через сколько секунд ожидания показать место в очереди
+LLM_QUEUE_NOTICE_INTERVAL = 3.0 # Как часто обновлять место в очереди, секунд
+
+# Сводка старой части диалога (context_summary.py)
+CONTEXT_SUMMARY_ENABLED = True
+CONTEXT_RECENT_TOKENS = 1500         # Сколько токенов последних реплик идет в запрос дословно
+CONTEXT_SUMMARY_MAX_TOKENS = 400     # Максимальная длина сводки, токенов
+CONTEXT_SUMMARY_FOLD_TOKENS = 4000   # Сколько токенов реплик сворачивается за один запрос к модели
+CONTEXT_SUMMARY_MIN_NEW_TURNS = 6    # Обновлять сводку не чаще, чем раз в столько реплик
+CONTEXT_SUMMARY_CONCURRENCY = 2      # Одновременных обновлений сводки
+CONTEXT_SUMMARY_CACHE_SIZE = 10000   # Сводок в памяти
+
+# Несколько моделей: переключение при сбоях и дублирующие запросы (providers.py)
+LLM_MODELS = [                  # По порядку предпочтения; url, api_key, rpm и burst - необязательны
+    {"model": AI_NAME},
+    {"model": "meta-llama/llama-3.3-70b-instruct:free"},
+    {"model": "qwen/qwen-2.5-72b-instruct:free"},
+]
+LLM_HEDGE_ENABLED = True        # Запускать запасную модель, если основная долго молчит
+LLM_HEDGE_MAX_PARALLEL = 2      # Сколько моделей может генерировать один ответ одновременно
+LLM_HEDGE_DEFAULT_DELAY = 4.0   # Задержка до запасного запроса, пока нет статистики, секунд
+LLM_HEDGE_MIN_DELAY = 0.5       # Запасной запрос не раньше стольких секунд
+LLM_TTFT_WINDOW = 200           # По скольким последним ответам считать p95 времени до первого токена
+LLM_TTFT_MIN_SAMPLES = 20       # Меньше замеров - используется LLM_HEDGE_DEFAULT_DELAY
+LLM_MODEL_FAILURE_THRESHOLD = 3  # Столько ошибок подряд - модель уходит на паузу
+LLM_MODEL_COOLDOWN = 30         # Первая пауза модели, секунд (дальше удваивается)
+LLM_MODEL_MAX_COOLDOWN = 600    # Максимальная пауза модели, секунд
+
+# Ограничение частоты запросов к моделям и аварийный выключатель (ratelimit.py)
+LLM_RATE_LIMIT_RPM = 20          # Запросов в минуту к одной модели, пока провайдер не сообщил свой лимит
+LLM_RATE_LIMIT_BURST = 5         # Сколько запросов можно отправить подряд без ожидания
+LLM_RATE_LIMIT_MAX_WAIT = 3.0    # Дольше ждать очереди к модели не стоит - берем следующую, секунд
+LLM_RATE_LIMIT_BACKOFF = 10.0    # Пауза после 429 без Retry-After, секунд
+LLM_BREAKER_FAILURES = 5         # Столько запросов подряд без ответа ни от одной модели - выключатель срабатывает
+LLM_BREAKER_OPEN_SECONDS = 30    # Сколько секунд сразу отвечать «заняты», потом пробный запрос
+LLM_BUSY_REPLY = "⏳ Сейчас модели перегружены, ответить не получается. Попробуйте, пожалуйста, через минуту."
+
+# Очередь отправки в Telegram (send_queue.py)
+TELEGRAM_GLOBAL_RATE = 30        # Сообщений в секунду на весь бот
+TELEGRAM_GLOBAL_BURST = 30       # Сколько можно отправить разом после паузы
+TELEGRAM_CHAT_RATE = 1.0         # Сообщений в секунду в один личный чат
+TELEGRAM_CHAT_BURST = 3          # Сообщений подряд в один чат без ожидания
+TELEGRAM_GROUP_RATE = 20 / 60    # Сообщений в секунду в группу или канал
+TELEGRAM_RETRY_MAX_ATTEMPTS = 3  # Сколько раз отправлять запрос, получивший 429
+TELEGRAM_RETRY_MAX_WAIT = 60     # Дольше ждать по Retry-After не стоит - ошибка уходит вызывающему, секунд
+TELEGRAM_CHAT_BUCKETS = 10000    # Сколько чатов держать в памяти, прежде чем забывать простаивающие
+
+# Рассылки (broadcast.py)
+BROADCAST_CONCURRENCY = 20           # Сообщений рассылки в полете одновременно (темп держит очередь отправки)
+BROADCAST_PAGE_SIZE = 500            # Получателей, читаемых из БД за один запрос
+BROADCAST_PROGRESS_INTERVAL = 5      # Как часто обновлять сообщение с прогрессом, секунд
+
+# Режим работы: опрос Telegram или вебхуки (webhook.py)
+BOT_RUN_MODE = "polling"             # "polling" | "webhook"
+WEBHOOK_HOST = "0.0.0.0"             # Где слушает встроенный aiohttp-сервер
+WEBHOOK_PORT = 8080
+WEBHOOK_PATH = "/telegram/webhook"   # Путь для обновлений Telegram
+WEBHOOK_BASE_URL = ""                # Публичный https-адрес сервера; пусто - setWebhook не вызывается (локальная проверка)
+WEBHOOK_SECRET = ""                  # Заголовок X-Telegram-Bot-Api-Secret-Token; пусто - не проверяется
+WEBHOOK_MAX_CONNECTIONS = 40         # Сколько соединений с обновлениями Telegram может держать одновременно
+WEBHOOK_BEHIND_PROXY = False         # Адрес клиента брать из последней записи X-Forwarded-For (сервер за одним прокси: nginx и т.п.)
+WEBHOOK_SHUTDOWN_TIMEOUT = 10        # Сколько ждать обработки принятых обновлений при остановке, секунд
+YOOKASSA_WEBHOOK_PATH = "/yookassa/webhook"   # Путь для уведомлений ЮKassa
+YOOKASSA_WEBHOOK_NETWORKS = [        # Уведомления ЮKassa принимаются только с этих адресов; пусто - с любых
+    "185.71.76.0/27",
+    "185.71.77.0/27",
+    "77.75.153.0/25",
+    "77.75.156.11/32",
+    "77.75.156.35/32",
+    "77.75.154.128/25",
+    "2a02:5180::/32",
+]
+
+# Отложенное удаление сообщений (message_cleanup.py)
+DELETE_WHEEL_TICK = 1.0          # Точность срабатывания, секунд
+DELETE_WHEEL_SLOTS = 600         # Ячеек колеса: более долгие задержки ждут нескольких оборотов
+DELETE_BATCH_SIZE = 100          # Сообщений в одном deleteMessages (предел Telegram)
+DELETE_MAX_AGE = 48 * 3600       # Более старые сообщения Telegram не дает удалить боту, секунд
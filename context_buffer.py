@@ -0,0 +1,135 @@
+"""
+Последние реплики диалога в памяти.
+
+Для каждого пользователя держится кольцевой буфер из MAX_HISTORY_LENGTH реплик.
+Буфер один раз загружается из message_logs при первом обращении, дальше
+новые реплики дописываются в него по мере записи в журнал, так что сборка
+запроса к модели в обычном режиме не делает ни одного SQL-запроса.
+
+Буферы целиком вытесняются по LRU, когда их общий объем превышает
+CONTEXT_MEMORY_BUDGET; вытесненный буфер при следующем обращении снова
+загрузится из базы.
+
+Ключ буфера - user_id: в личном чате он совпадает с chat_id, а журнал
+сообщений ведется по пользователю. Реплики одного пользователя обрабатываются
+последовательно, поэтому буфер нужно получить (get) до того, как в него
+дописывается новая реплика; реплики пользователя без буфера не сохраняются -
+они будут прочитаны из журнала при загрузке.
+"""
+import asyncio
+import sys
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Tuple
+
+from config import MAX_HISTORY_LENGTH, CONTEXT_MEMORY_BUDGET
+from async_database import get_last_messages
+
+Turn = Tuple[str, str]  # (role, message)
+
+# Примерные накладные расходы на реплику: кортеж, строка роли, ячейка deque
+TURN_OVERHEAD = 120
+
+
+def _turn_size(turn: Turn) -> int:
+    return sys.getsizeof(turn[1]) + TURN_OVERHEAD
+
+
+class ContextBuffer:
+    def __init__(self, max_turns: int = MAX_HISTORY_LENGTH,
+                 memory_budget: int = CONTEXT_MEMORY_BUDGET):
+        self.max_turns = max_turns
+        self.memory_budget = memory_budget
+        self._buffers: "OrderedDict[int, Deque[Turn]]" = OrderedDict()
+        self._sizes: Dict[int, int] = {}
+        self._loading: Dict[int, asyncio.Future] = {}
+        self.bytes = 0
+
+        self.hits = 0
+        self.hydrations = 0
+        self.evictions = 0
+
+    async def get(self, user_id: int) -> List[Dict]:
+        """Последние реплики пользователя в формате get_last_messages"""
+        buffer = self._buffers.get(user_id)
+        if buffer is not None:
+            self._buffers.move_to_end(user_id)
+            self.hits += 1
+        else:
+            buffer = await self._hydrate(user_id)
+        return [{'role': role, 'message': message} for role, message in buffer]
+
+    def append(self, user_id: int, role: str, message: str):
+        """Дописывает реплику в буфер пользователя (если он загружен)"""
+        buffer = self._buffers.get(user_id)
+        if buffer is None:
+            return
+        delta = 0
+        if len(buffer) == buffer.maxlen:
+            delta -= _turn_size(buffer[0])
+        turn = (role, message)
+        buffer.append(turn)
+        delta += _turn_size(turn)
+        self._sizes[user_id] += delta
+        self.bytes += delta
+        self._buffers.move_to_end(user_id)
+        self._evict()
+
+    def drop(self, user_id: int):
+        buffer = self._buffers.pop(user_id, None)
+        if buffer is not None:
+            self.bytes -= self._sizes.pop(user_id)
+
+    async def _hydrate(self, user_id: int) -> Deque[Turn]:
+        # Одновременные обращения к еще не загруженному буферу ждут один запрос к БД
+        loading = self._loading.get(user_id)
+        if loading is None:
+            loading = asyncio.ensure_future(get_last_messages(user_id, self.max_turns))
+            self._loading[user_id] = loading
+            try:
+                rows = await loading
+            finally:
+                self._loading.pop(user_id, None)
+            buffer = deque(((row['role'], row['message']) for row in rows or ()),
+                           maxlen=self.max_turns)
+            # None - ошибка чтения: не кэшируем, в следующий раз попробуем снова
+            if rows is not None:
+                self._store(user_id, buffer)
+                self.hydrations += 1
+            return buffer
+
+        rows = await loading
+        buffer = self._buffers.get(user_id)
+        if buffer is None:
+            buffer = deque(((row['role'], row['message']) for row in rows or ()),
+                           maxlen=self.max_turns)
+        return buffer
+
+    def _store(self, user_id: int, buffer: Deque[Turn]):
+        self.drop(user_id)
+        size = sum(_turn_size(turn) for turn in buffer)
+        self._buffers[user_id] = buffer
+        self._sizes[user_id] = size
+        self.bytes += size
+        self._evict()
+
+    def _evict(self):
+        # Самый свежий буфер не вытесняем, даже если он один больше бюджета
+        while self.bytes > self.memory_budget and len(self._buffers) > 1:
+            user_id, _ = self._buffers.popitem(last=False)
+            self.bytes -= self._sizes.pop(user_id)
+            self.evictions += 1
+
+    def stats(self) -> Dict:
+        turns = sum(len(buffer) for buffer in self._buffers.values())
+        return {
+            'buffers': len(self._buffers),
+            'turns': turns,
+            'bytes': self.bytes,
+            'memory_budget': self.memory_budget,
+            'hits': self.hits,
+            'hydrations': self.hydrations,
+            'evictions': self.evictions
+        }
+
+
+chat_histories = ContextBuffer()
@@ -0,0 +1,234 @@
+"""
+Сводка старой части диалога.
+
+В запрос к модели дословно идут только последние реплики, которые помещаются в
+CONTEXT_RECENT_TOKENS токенов. Все, что старше, заменяется краткой сводкой,
+поэтому размер запроса перестает расти вместе с длиной разговора.
+
+Сводка хранится по пользователю в conversation_summaries вместе с id последней
+свернутой реплики из message_logs и обновляется инкрементально в фоне:
+модель получает прежнюю сводку и только новые реплики. Сворачивается все, кроме
+последней половины окна, - так сводка немного перекрывает дословные реплики, а не
+отстает от них, пока идет следующее обновление. Запросы сводки идут через общую
+очередь генераций (scheduler.py) как фоновые: вне лимита пользователя и после
+ожидающих ответов. Обновление, в том числе неудачное, повторяется не чаще раза
+в CONTEXT_SUMMARY_MIN_NEW_TURNS реплик.
+
+Пока разговор помещается в окно, сводка не читается и не строится.
+"""
+import asyncio
+from collections import OrderedDict
+from contextlib import aclosing
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from config import (
+    CONTEXT_SUMMARY_ENABLED,
+    CONTEXT_RECENT_TOKENS,
+    CONTEXT_SUMMARY_MAX_TOKENS,
+    CONTEXT_SUMMARY_FOLD_TOKENS,
+    CONTEXT_SUMMARY_MIN_NEW_TURNS,
+    CONTEXT_SUMMARY_CONCURRENCY,
+    CONTEXT_SUMMARY_CACHE_SIZE
+)
+from async_database import get_messages_after, get_conversation_summary, save_conversation_summary
+from quota import estimate_tokens, MESSAGE_OVERHEAD_TOKENS
+from scheduler import llm_scheduler
+
+SUMMARY_PROMPT = (
+    "Ты ведешь краткий конспект разговора пользователя с ассистентом. "
+    "Дополни конспект новыми репликами: сохрани факты о пользователе, его просьбы, "
+    "принятые решения и открытые вопросы, убери повторы. "
+    "Пиши по-русски, сжато, без вступлений."
+)
+SUMMARY_HEADER = "Краткое содержание предыдущей части разговора:\n"
+ROLE_NAMES = {"user": "Пользователь", "assistant": "Ассистент"}
+
+# Сколько реплик читать из журнала за одно обновление
+FETCH_LIMIT = 1000
+
+Turn = Tuple[str, str]  # (role, message)
+Summarize = Callable[[str, List[Turn], int], Awaitable[str]]
+
+
+async def summarize_with_model(summary: str, turns: List[Turn], max_tokens: int) -> str:
+    """Дополняет сводку репликами turns с помощью модели"""
+    from providers import model_router
+
+    dialogue = "\n".join(f"{ROLE_NAMES.get(role, role)}: {message}" for role, message in turns)
+    messages = [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": f"Текущий конспект:\n{summary or '(пока пусто)'}\n\n"
+                                    f"Новые реплики:\n{dialogue}"}
+    ]
+    parts = []
+    # aclosing: при отмене поток ответа закрывается сразу, а не когда его соберет сборщик мусора
+    async with aclosing(model_router.stream(messages, max_tokens=max_tokens)) as stream:
+        async for delta in stream:
+            parts.append(delta)
+    return "".join(parts).strip()
+
+
+def split_recent(messages: Sequence[str], budget: int) -> int:
+    """Индекс, начиная с которого последние реплики помещаются в budget токенов (последняя - всегда)"""
+    start = len(messages)
+    used = 0
+    while start > 0:
+        cost = estimate_tokens(messages[start - 1]) + MESSAGE_OVERHEAD_TOKENS
+        if used + cost > budget and start < len(messages):
+            break
+        used += cost
+        start -= 1
+    return start
+
+
+class _Summary:
+    __slots__ = ("text", "last_id", "tokens", "turns_since")
+
+    def __init__(self, text: str = "", last_id: int = 0, tokens: int = 0):
+        self.text = text
+        self.last_id = last_id      # Последняя реплика message_logs, вошедшая в сводку
+        self.tokens = tokens
+        self.turns_since = 0        # Запросов с момента последнего обновления
+
+
+class ContextCompactor:
+    def __init__(self, enabled: bool = CONTEXT_SUMMARY_ENABLED,
+                 recent_tokens: int = CONTEXT_RECENT_TOKENS,
+                 summary_max_tokens: int = CONTEXT_SUMMARY_MAX_TOKENS,
+                 fold_tokens: int = CONTEXT_SUMMARY_FOLD_TOKENS,
+                 min_new_turns: int = CONTEXT_SUMMARY_MIN_NEW_TURNS,
+                 concurrency: int = CONTEXT_SUMMARY_CONCURRENCY,
+                 cache_size: int = CONTEXT_SUMMARY_CACHE_SIZE,
+                 summarize: Optional[Summarize] = None):
+        self.enabled = enabled
+        self.recent_tokens = recent_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.fold_tokens = fold_tokens
+        self.min_new_turns = min_new_turns
+        self.concurrency = concurrency
+        self.cache_size = cache_size
+        self.summarize = summarize or summarize_with_model
+
+        self._summaries: "OrderedDict[int, _Summary]" = OrderedDict()
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        self.compacted = 0
+        self.refreshes = 0
+        self.folded_turns = 0
+        self.failures = 0
+
+    async def build(self, user_id: int, history: List[Dict]) -> Tuple[Optional[str], List[Dict]]:
+        """Сводка (или None) и последние реплики history, которые помещаются в окно"""
+        if not self.enabled:
+            return None, history
+        start = split_recent([item['message'] for item in history], self.recent_tokens)
+        if start == 0:
+            return None, history
+
+        # Старшие реплики в окно не помещаются - вместо них идет сводка
+        summary = await self._get(user_id)
+        summary.turns_since += 1
+        # Неудачное или пустое обновление тоже сбрасывает turns_since - повтор не раньше чем через min_new_turns
+        if summary.turns_since >= self.min_new_turns:
+            self._schedule(user_id)
+        self.compacted += 1
+        return summary.text or None, history[start:]
+
+    async def _get(self, user_id: int) -> _Summary:
+        summary = self._summaries.get(user_id)
+        if summary is not None:
+            self._summaries.move_to_end(user_id)
+            return summary
+        row = await get_conversation_summary(user_id)
+        summary = self._summaries.get(user_id)
+        if summary is None:
+            summary = _Summary(row['summary'], row['last_message_id'], row['tokens']) if row else _Summary()
+            if not summary.last_id:
+                # Сводки еще нет - первую строим сразу, не дожидаясь min_new_turns
+                summary.turns_since = self.min_new_turns
+            self._remember(user_id, summary)
+        return summary
+
+    def _remember(self, user_id: int, summary: _Summary):
+        self._summaries[user_id] = summary
+        self._summaries.move_to_end(user_id)
+        while len(self._summaries) > self.cache_size:
+            self._summaries.popitem(last=False)
+
+    def _schedule(self, user_id: int):
+        if user_id in self._tasks:
+            return
+        self._tasks[user_id] = asyncio.get_running_loop().create_task(self._refresh_task(user_id))
+
+    async def _refresh_task(self, user_id: int):
+        try:
+            await self.refresh(user_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failures += 1
+            print(f"Ошибка обновления сводки диалога {user_id}: {e}")
+        finally:
+            self._tasks.pop(user_id, None)
+
+    async def refresh(self, user_id: int) -> int:
+        """Сворачивает в сводку новые реплики старше половины окна; возвращает их число"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            summary = await self._get(user_id)
+            summary.turns_since = 0
+            rows = await get_messages_after(user_id, summary.last_id, FETCH_LIMIT) or []
+            keep_from = split_recent([row['message'] for row in rows], self.recent_tokens // 2)
+            pending = rows[:keep_from]
+
+            folded = 0
+            while pending:
+                # Одним запросом к модели сворачиваем не больше fold_tokens токенов реплик
+                size = 0
+                count = 0
+                for row in pending:
+                    size += estimate_tokens(row['message']) + MESSAGE_OVERHEAD_TOKENS
+                    if size > self.fold_tokens and count:
+                        break
+                    count += 1
+                chunk, pending = pending[:count], pending[count:]
+
+                # Сводка - фоновая генерация: не занимает слот пользователя и уступает его запросам
+                async with llm_scheduler.background_slot():
+                    text = await self.summarize(summary.text, [(row['role'], row['message']) for row in chunk],
+                                                self.summary_max_tokens)
+                if not text:
+                    break
+                summary.text = text
+                summary.last_id = chunk[-1]['id']
+                summary.tokens = estimate_tokens(text)
+                await save_conversation_summary(user_id, text, summary.last_id, summary.tokens)
+                folded += len(chunk)
+
+            self._remember(user_id, summary)
+            self.refreshes += 1
+            self.folded_turns += folded
+            return folded
+
+    async def stop(self):
+        """Прерывает обновления, которые еще идут (их реплики свернутся после перезапуска)"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'summaries': len(self._summaries),
+            'running': len(self._tasks),
+            'compacted': self.compacted,
+            'refreshes': self.refreshes,
+            'folded_turns': self.folded_turns,
+            'failures': self.failures
+        }
+
+
+context_compactor = ContextCompactor()
@@ -1,156 +1,115 @@
-import sqlite3
 import os
 from typing import Dict, Optional, List
 from datetime import datetime, timedelta
-from config import ROOT_ADMIN_ID
+from config import ROOT_ADMIN_ID, DB_SHARDS
+from db_pool import get_connection
+from storage import ShardedStorage
+from write_queue import enqueue_write, flush_writes
+from migrations import run_migrations
+from user_cache import user_cache
+from records import (
+    User, Admin, Referral, ReferralPayment, DiscountCode, UserDiscount,
+    MessageLog, ConversationSummary, BroadcastJob
+)
 from error_handler import error_handler, sync_error_handler
 
 DATABASE_NAME = "users.db"
 
+_storage = None
+
+# Администраторы из таблицы admins (без root), загружаются при init_db
+_admin_ids = None
+
 
-@sync_error_handler
 def dict_factory(cursor, row):
     return {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
 
 
-@sync_error_handler
-def init_db():
-    """Инициализирует базу данных и создает все необходимые таблицы"""
-    with sqlite3.connect(DATABASE_NAME) as conn:
-        cursor = conn.cursor()
+def get_storage() -> ShardedStorage:
+    """Раскладка данных по файлам: каталог DATABASE_NAME и шарды пользователей"""
+    global _storage
+    if _storage is None or _storage.catalog != DATABASE_NAME:
+        _storage = ShardedStorage(DATABASE_NAME, DB_SHARDS)
+    return _storage
 
-        # Проверяем существование таблицы users
-        cursor.execute("""
-            SELECT name FROM sqlite_master 
-            WHERE type='table' AND name='users'
-        """)
-        users_table_exists = cursor.fetchone() is not None
 
-        # Создаем таблицу users со всеми необходимыми колонками
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                full_name TEXT,
-                balance INTEGER DEFAULT 0,
-                referral_balance INTEGER DEFAULT 0,
-                mode TEXT DEFAULT 'chat',
-                subscription_type TEXT DEFAULT 'free',
-                subscription_expires DATETIME,
-                tokens_used_today INTEGER DEFAULT 0,
-                last_token_reset DATE DEFAULT CURRENT_DATE
-            )
-        """)
+def _catalog_db() -> str:
+    return get_storage().catalog
+
+
+def _user_db(user_id: int) -> str:
+    return get_storage().shard_for(user_id)
 
-        # Если таблица уже существовала, проверяем наличие колонок
-        if users_table_exists:
-            # Проверяем наличие колонки referral_balance
-            cursor.execute("PRAGMA table_info(users)")
-            columns = [column[1] for column in cursor.fetchall()]
-
-            if 'referral_balance' not in columns:
-                try:
-                    cursor.execute(
-                        "ALTER TABLE users ADD COLUMN referral_balance INTEGER DEFAULT 0")
-                except sqlite3.OperationalError:
-                    pass  # Колонка уже существует
-
-        # Создаем остальные таблицы
-        tables = {
-            'message_logs': """
-                CREATE TABLE IF NOT EXISTS message_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    role TEXT,
-                    message TEXT,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            """,
-            'admins': """
-                CREATE TABLE IF NOT EXISTS admins (
-                    user_id INTEGER PRIMARY KEY,
-                    added_by INTEGER,
-                    added_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            """,
-            'discount_codes': """
-                CREATE TABLE IF NOT EXISTS discount_codes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    code TEXT UNIQUE NOT NULL,
-                    discount_percent INTEGER NOT NULL,
-                    max_uses INTEGER NOT NULL,
-                    used_count INTEGER DEFAULT 0,
-                    created_by INTEGER NOT NULL,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    is_active BOOLEAN DEFAULT 1
-                )
-            """,
-            'user_discounts': """
-                CREATE TABLE IF NOT EXISTS user_discounts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    discount_code TEXT NOT NULL,
-                    applied_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    used BOOLEAN DEFAULT 0,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            """,
-            'referrals': """
-                CREATE TABLE IF NOT EXISTS referrals (
-                    user_id INTEGER PRIMARY KEY,
-                    referrer_id INTEGER,
-                    registration_date DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id),
-                    FOREIGN KEY (referrer_id) REFERENCES users (user_id)
-                )
-            """,
-            'referral_payments': """
-                CREATE TABLE IF NOT EXISTS referral_payments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    referrer_id INTEGER NOT NULL,
-                    amount REAL NOT NULL,
-                    level INTEGER NOT NULL,
-                    payment_date DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    subscription_type TEXT,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id),
-                    FOREIGN KEY (referrer_id) REFERENCES users (user_id)
-                )
-            """
-        }
 
-        for table_name, create_sql in tables.items():
-            cursor.execute(create_sql)
+def _get_users_by_ids(user_ids: List[int]) -> Dict[int, User]:
+    """Читает пользователей из их шардов параллельно: {user_id: User}"""
+    storage = get_storage()
+    groups = storage.group_by_shard(user_ids)
 
-        # Добавляем root админа, если база только что создана
-        if not users_table_exists and ROOT_ADMIN_ID:
-            try:
-                cursor.execute(
+    def fetch(path):
+        ids = groups[path]
+        found = {}
+        conn = get_connection(path)
+        # Не больше 500 параметров в одном запросе (лимит SQLite на переменные)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            cursor = conn.execute(
+                f"SELECT * FROM users WHERE user_id IN ({','.join('?' * len(chunk))})", chunk)
+            for user in User.fetch_all(cursor):
+                found[user['user_id']] = user
+        return found
+
+    users = {}
+    for found in storage.fan_out(fetch, groups.keys()):
+        users.update(found)
+    return users
+
+
+@sync_error_handler
+def init_db():
+    """Инициализирует базу данных: применяет миграции схемы в каталоге и во всех шардах"""
+    storage = get_storage()
+    conn = get_connection(storage.catalog)
+
+    # Проверяем существование таблицы users до миграций
+    users_table_exists = conn.execute("""
+        SELECT name FROM sqlite_master 
+        WHERE type='table' AND name='users'
+    """).fetchone() is not None
+
+    # Схема у каталога и шардов общая: в каждом файле заполнены только свои таблицы
+    for path in storage.databases():
+        run_migrations(get_connection(path))
+
+    # Добавляем root админа, если база только что создана
+    if not users_table_exists and ROOT_ADMIN_ID:
+        try:
+            with conn:
+                conn.execute(
                     "INSERT OR IGNORE INTO admins (user_id, added_by) VALUES (?, ?)",
                     (ROOT_ADMIN_ID, ROOT_ADMIN_ID)
                 )
-            except Exception as e:
-                print(f"Ошибка при добавлении root админа: {e}")
+        except Exception as e:
+            print(f"Ошибка при добавлении root админа: {e}")
 
-        conn.commit()
+    load_admins()
 
 
 @sync_error_handler
 def log_message(user_id: int, role: str, message: str):
-    with sqlite3.connect(DATABASE_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO message_logs (user_id, role, message)
-            VALUES (?, ?, ?)
-        """, (user_id, role, message))
-        conn.commit()
+    enqueue_write(_user_db(user_id), """
+        INSERT INTO message_logs (user_id, role, message)
+        VALUES (?, ?, ?)
+    """, (user_id, role, message), key=user_id)
 
 
 @sync_error_handler
 def get_last_messages(user_id: int, limit: int = 10) -> List[Dict]:
-    with sqlite3.connect(DATABASE_NAME) as conn:
-        conn.row_factory = dict_factory
+    # Сообщения пользователя могут еще лежать в буфере отложенной записи
+    flush_writes(_user_db(user_id), user_id)
+    with get_connection(_user_db(user_id)) as conn:
         cursor = conn.cursor()
+        cursor.row_factory = dict_factory
         cursor.execute("""
             SELECT role, message FROM message_logs
             WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?
@@ -159,75 +118,119 @@ def get_last_messages(user_id: int, limit: int = 10) -> List[Dict]:
 
 
 @sync_error_handler
-def get_user(user_id: int) -> Optional[Dict]:
-    with sqlite3.connect(DATABASE_NAME) as conn:
-        conn.row_factory = dict_factory
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-        return cursor.fetchone()
+def get_messages_after(user_id: int, after_id: int, limit: int = 1000) -> List[MessageLog]:
+    """Реплики пользователя после сообщения after_id в хронологическом порядке"""
+    flush_writes(_user_db(user_id), user_id)
+    cursor = get_connection(_user_db(user_id)).execute("""
+        SELECT id, role, message FROM message_logs
+        WHERE user_id = ? AND id > ? ORDER BY timestamp, id LIMIT ?
+    """, (user_id, after_id, limit))
+    return MessageLog.fetch_all(cursor)
+
+
+@sync_error_handler
+def get_conversation_summary(user_id: int) -> Optional[ConversationSummary]:
+    cursor = get_connection(_user_db(user_id)).execute(
+        "SELECT * FROM conversation_summaries WHERE user_id = ?", (user_id,))
+    return ConversationSummary.fetch_one(cursor)
+
+
+@sync_error_handler
+def save_conversation_summary(user_id: int, summary: str, last_message_id: int, tokens: int):
+    enqueue_write(_user_db(user_id), """
+        INSERT INTO conversation_summaries (user_id, summary, last_message_id, tokens, updated_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(user_id) DO UPDATE SET
+            summary = excluded.summary,
+            last_message_id = excluded.last_message_id,
+            tokens = excluded.tokens,
+            updated_at = excluded.updated_at
+    """, (user_id, summary, last_message_id, tokens), key=user_id)
+
+@sync_error_handler
+def get_user(user_id: int) -> Optional[User]:
+    # Записи неизменяемы, поэтому из кэша отдаются без копирования
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+
+    # Счетчики токенов пользователя могут еще лежать в буфере отложенной записи
+    flush_writes(_user_db(user_id), user_id)
+    version = user_cache.begin_read(user_id)
+    with get_connection(_user_db(user_id)) as conn:
+        cursor = conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+        user = User.fetch_one(cursor)
+    if user:
+        user_cache.put(user_id, user, version)
+    return user
 
 
 @sync_error_handler
 def create_user(user_id: int, username: str, full_name: str):
-    with sqlite3.connect(DATABASE_NAME) as conn:
+    with get_connection(_user_db(user_id)) as conn:
         cursor = conn.cursor()
         cursor.execute("""INSERT OR IGNORE INTO users (
             user_id, username, full_name, subscription_type
         ) VALUES (?, ?, ?, ?)""", (user_id, username, full_name, 'free'))
         conn.commit()
+    user_cache.invalidate(user_id)
 
 
 @sync_error_handler
 def update_balance(user_id: int, amount: int):
-    with sqlite3.connect(DATABASE_NAME) as conn:
+    with get_connection(_user_db(user_id)) as conn:
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE users SET balance = balance + ? WHERE user_id = ?",
             (amount, user_id)
         )
         conn.commit()
+    user_cache.invalidate(user_id)
 
 
 @sync_error_handler
 def update_user_mode(user_id: int, mode: str):
-    with sqlite3.connect(DATABASE_NAME) as conn:
+    with get_connection(_user_db(user_id)) as conn:
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE users SET mode = ? WHERE user_id = ?",
             (mode, user_id)
         )
         conn.commit()
+    # Режим читается на каждом запросе к модели - запись в кэше обновляется, а не сбрасывается
+    user_cache.update(user_id, mode=mode)
 
 
 @sync_error_handler
 def update_subscription(user_id: int, sub_type: str, duration_days: int):
     expires = datetime.now() + timedelta(days=duration_days)
-    with sqlite3.connect(DATABASE_NAME) as conn:
+    with get_connection(_user_db(user_id)) as conn:
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE users SET subscription_type = ?, subscription_expires = ? WHERE user_id = ?",
             (sub_type, expires.isoformat(), user_id)
         )
         conn.commit()
+    user_cache.invalidate(user_id)
 
 
 @sync_error_handler
 def get_subscription_info(user_id: int) -> dict:
-    with sqlite3.connect(DATABASE_NAME) as conn:
-        conn.row_factory = dict_factory
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT subscription_type, subscription_expires, 
-                   tokens_used_today, last_token_reset
-            FROM users WHERE user_id = ?
-        """, (user_id,))
-        return cursor.fetchone()
+    user = get_user(user_id)
+    if not user:
+        return None
+    return {
+        'subscription_type': user.get('subscription_type'),
+        'subscription_expires': user.get('subscription_expires'),
+        'tokens_used_today': user.get('tokens_used_today'),
+        'last_token_reset': user.get('last_token_reset')
+    }
 
 
 @sync_error_handler
 def reset_daily_tokens_if_needed(user_id: int):
     today = datetime.now().date()
-    with sqlite3.connect(DATABASE_NAME) as conn:
+    with get_connection(_user_db(user_id)) as conn:
         cursor = conn.cursor()
         cursor.execute("""
             UPDATE users 
@@ -235,18 +238,31 @@ def reset_daily_tokens_if_needed(user_id: int):
             WHERE user_id = ? AND last_token_reset < ?
         """, (today.isoformat(), user_id, today.isoformat()))
         conn.commit()
+        if cursor.rowcount:
+            user_cache.invalidate(user_id)
 
 
 @sync_error_handler
 def increment_token_usage(user_id: int, tokens_used: int):
-    with sqlite3.connect(DATABASE_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE users 
-            SET tokens_used_today = tokens_used_today + ?
-            WHERE user_id = ?
-        """, (tokens_used, user_id))
-        conn.commit()
+    enqueue_write(_user_db(user_id), """
+        UPDATE users 
+        SET tokens_used_today = tokens_used_today + ?
+        WHERE user_id = ?
+    """, (tokens_used, user_id), key=user_id)
+    # Не прибавляем к кэшу: параллельный get_user мог уже прочитать строку с этим UPDATE
+    user_cache.invalidate(user_id)
+
+
+@sync_error_handler
+def add_token_usage(user_id: int, tokens: int, day: str):
+    """Прибавляет токены к дневному счетчику, обнуляя его при смене дня, - одним UPDATE"""
+    enqueue_write(_user_db(user_id), """
+        UPDATE users SET
+            tokens_used_today = CASE WHEN last_token_reset < ? THEN 0 ELSE tokens_used_today END + ?,
+            last_token_reset = ?
+        WHERE user_id = ?
+    """, (day, tokens, day, user_id), key=user_id)
+    user_cache.invalidate(user_id)
 
 
 @sync_error_handler
@@ -257,16 +273,13 @@ def get_active_subscription(user_id: int) -> dict:
         return None
 
     try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
-            conn.row_factory = dict_factory
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT subscription_type, subscription_expires FROM users WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
-            return {
-                'type': result[0] if result else 'free',
-                'expires': result[1] if result else None
-            } if result else None
+        user = get_user(user_id)
+        if not user:
+            return None
+        return {
+            'type': user.get('subscription_type') or 'free',
+            'expires': user.get('subscription_expires')
+        }
     except Exception:
         return None
 
@@ -298,34 +311,41 @@ def is_subscription_active(user_id: int) -> bool:
         return False
 
 
+@sync_error_handler
+def load_admins():
+    """Загружает множество администраторов из таблицы admins в память"""
+    global _admin_ids
+    with get_connection(_catalog_db()) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT user_id FROM admins")
+        _admin_ids = {row[0] for row in cursor.fetchall()}
+
+
 @sync_error_handler
 def is_user_admin(user_id: int) -> bool:
     # Root админ всегда имеет доступ
     if user_id == ROOT_ADMIN_ID:
         return True
 
-    try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT 1 FROM admins WHERE user_id = ?", (user_id,))
-            return cursor.fetchone() is not None
-    except Exception:
-        return False
+    if _admin_ids is None:
+        load_admins()
+    return _admin_ids is not None and user_id in _admin_ids
 
 
 @sync_error_handler
 def add_admin(user_id: int, added_by: int) -> bool:
     """Добавляет администратора"""
     try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        with get_connection(_catalog_db()) as conn:
             cursor = conn.cursor()
             cursor.execute(
                 "INSERT OR IGNORE INTO admins (user_id, added_by) VALUES (?, ?)",
                 (user_id, added_by)
             )
             conn.commit()
-            return True
+        if _admin_ids is not None:
+            _admin_ids.add(user_id)
+        return True
     except Exception:
         return False
 
@@ -334,11 +354,13 @@ def add_admin(user_id: int, added_by: int) -> bool:
 def remove_admin(user_id: int) -> bool:
     """Удаляет администратора"""
     try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        with get_connection(_catalog_db()) as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM admins WHERE user_id = ?", (user_id,))
             conn.commit()
-            return True
+        if _admin_ids is not None:
+            _admin_ids.discard(user_id)
+        return True
     except Exception:
         return False
 
@@ -347,11 +369,9 @@ def remove_admin(user_id: int) -> bool:
 def get_all_admins() -> List[Dict]:
     """Возвращает список всех администраторов"""
     try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
-            conn.row_factory = dict_factory
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM admins")
-            return cursor.fetchall()
+        with get_connection(_catalog_db()) as conn:
+            cursor = conn.execute("SELECT * FROM admins")
+            return Admin.fetch_all(cursor)
     except Exception:
         return []
 
@@ -359,57 +379,17 @@ def get_all_admins() -> List[Dict]:
 @sync_error_handler
 def get_user_info(user_id: int) -> Optional[Dict]:
     """Получает информацию о пользователе по ID"""
-    with sqlite3.connect(DATABASE_NAME) as conn:
-        conn.row_factory = dict_factory
-        cursor = conn.cursor()
-        cursor.execute(
+    with get_connection(_user_db(user_id)) as conn:
+        cursor = conn.execute(
             "SELECT user_id, username, full_name, balance, referral_balance, subscription_type FROM users WHERE user_id = ?", (user_id,))
-        return cursor.fetchone()
-
-
-@sync_error_handler
-def init_discounts_table():
-    """Создает таблицу для скидочных кодов"""
-    with sqlite3.connect(DATABASE_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS discount_codes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                code TEXT UNIQUE NOT NULL,
-                discount_percent INTEGER NOT NULL,
-                max_uses INTEGER NOT NULL,
-                used_count INTEGER DEFAULT 0,
-                created_by INTEGER NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                is_active BOOLEAN DEFAULT 1
-            )
-        """)
-        conn.commit()
-
-
-@sync_error_handler
-def init_user_discounts_table():
-    """Создает таблицу для хранения примененных скидок пользователей"""
-    with sqlite3.connect(DATABASE_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_discounts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                discount_code TEXT NOT NULL,
-                applied_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                used BOOLEAN DEFAULT 0,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        """)
-        conn.commit()
+        return User.fetch_one(cursor)
 
 
 @sync_error_handler
 def apply_discount_to_user(user_id: int, code: str) -> bool:
     """Применяет скидку к пользователю (сохраняет для последующего использования)"""
     try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        with get_connection(_user_db(user_id)) as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT INTO user_discounts (user_id, discount_code, used)
@@ -425,23 +405,30 @@ def apply_discount_to_user(user_id: int, code: str) -> bool:
 @sync_error_handler
 def get_user_active_discount(user_id: int) -> Optional[Dict]:
     """Получает активную (неиспользованную) скидку пользователя"""
-    with sqlite3.connect(DATABASE_NAME) as conn:
-        conn.row_factory = dict_factory
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT ud.*, dc.discount_percent 
-            FROM user_discounts ud
-            JOIN discount_codes dc ON ud.discount_code = dc.code
-            WHERE ud.user_id = ? AND ud.used = 0 AND dc.is_active = 1
+    # user_discounts лежит в шарде пользователя, discount_codes - в каталоге
+    with get_connection(_user_db(user_id)) as conn:
+        cursor = conn.execute("""
+            SELECT * FROM user_discounts WHERE user_id = ? AND used = 0
         """, (user_id,))
-        return cursor.fetchone()
+        discounts = UserDiscount.fetch_all(cursor)
+    if not discounts:
+        return None
+
+    with get_connection(_catalog_db()) as conn:
+        for discount in discounts:
+            row = conn.execute("""
+                SELECT discount_percent FROM discount_codes WHERE code = ? AND is_active = 1
+            """, (discount['discount_code'],)).fetchone()
+            if row:
+                return discount.replace(discount_percent=row[0])
+    return None
 
 
 @sync_error_handler
 def mark_discount_as_used(user_id: int, code: str) -> bool:
     """Отмечает скидку как использованную"""
     try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        with get_connection(_user_db(user_id)) as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 UPDATE user_discounts 
@@ -459,7 +446,7 @@ def mark_discount_as_used(user_id: int, code: str) -> bool:
 def create_discount_code(code: str, discount_percent: int, max_uses: int, created_by: int) -> bool:
     """Создает новый скидочный код"""
     try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        with get_connection(_catalog_db()) as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT INTO discount_codes (code, discount_percent, max_uses, created_by)
@@ -475,20 +462,18 @@ def create_discount_code(code: str, discount_percent: int, max_uses: int, create
 @sync_error_handler
 def get_discount_code(code: str) -> Optional[Dict]:
     """Получает информацию о скидочном коде"""
-    with sqlite3.connect(DATABASE_NAME) as conn:
-        conn.row_factory = dict_factory
-        cursor = conn.cursor()
-        cursor.execute("""
+    with get_connection(_catalog_db()) as conn:
+        cursor = conn.execute("""
             SELECT * FROM discount_codes WHERE code = ? AND is_active = 1
         """, (code,))
-        return cursor.fetchone()
+        return DiscountCode.fetch_one(cursor)
 
 
 @sync_error_handler
 def use_discount_code(code: str) -> bool:
     """Увеличивает счетчик использований скидочного кода"""
     try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        with get_connection(_catalog_db()) as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 UPDATE discount_codes 
@@ -505,20 +490,18 @@ def use_discount_code(code: str) -> bool:
 @sync_error_handler
 def get_all_discount_codes() -> List[Dict]:
     """Получает все скидочные коды"""
-    with sqlite3.connect(DATABASE_NAME) as conn:
-        conn.row_factory = dict_factory
-        cursor = conn.cursor()
-        cursor.execute("""
+    with get_connection(_catalog_db()) as conn:
+        cursor = conn.execute("""
             SELECT * FROM discount_codes ORDER BY created_at DESC
         """)
-        return cursor.fetchall()
+        return DiscountCode.fetch_all(cursor)
 
 
 @sync_error_handler
 def delete_discount_code(code: str) -> bool:
     """Удаляет скидочный код"""
     try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        with get_connection(_catalog_db()) as conn:
             cursor = conn.cursor()
             cursor.execute(
                 "DELETE FROM discount_codes WHERE code = ?", (code,))
@@ -533,7 +516,7 @@ def delete_discount_code(code: str) -> bool:
 def deactivate_discount_code(code: str) -> bool:
     """Деактивирует скидочный код"""
     try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        with get_connection(_catalog_db()) as conn:
             cursor = conn.cursor()
             cursor.execute(
                 "UPDATE discount_codes SET is_active = 0 WHERE code = ?", (code,))
@@ -547,49 +530,22 @@ def deactivate_discount_code(code: str) -> bool:
 @sync_error_handler
 def get_user_id_by_username(username: str) -> Optional[int]:
     """Получает ID пользователя по username"""
-    with sqlite3.connect(DATABASE_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT user_id FROM users WHERE username = ? COLLATE NOCASE", (username,))
-        result = cursor.fetchone()
-        return result[0] if result else None
+    def find(path):
+        row = get_connection(path).execute(
+            "SELECT user_id FROM users WHERE username = ? COLLATE NOCASE", (username,)).fetchone()
+        return row[0] if row else None
 
-
-@sync_error_handler
-def init_referral_tables():
-    """Создает таблицы для реферальной системы"""
-    with sqlite3.connect(DATABASE_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS referrals (
-                user_id INTEGER PRIMARY KEY,
-                referrer_id INTEGER,
-                registration_date DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id),
-                FOREIGN KEY (referrer_id) REFERENCES users (user_id)
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS referral_payments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                referrer_id INTEGER NOT NULL,
-                amount REAL NOT NULL,
-                level INTEGER NOT NULL,
-                payment_date DATETIME DEFAULT CURRENT_TIMESTAMP,
-                subscription_type TEXT,
-                FOREIGN KEY (user_id) REFERENCES users (user_id),
-                FOREIGN KEY (referrer_id) REFERENCES users (user_id)
-            )
-        """)
-        conn.commit()
+    for user_id in get_storage().fan_out(find):
+        if user_id is not None:
+            return user_id
+    return None
 
 
 @sync_error_handler
 def add_referral(user_id: int, referrer_id: int) -> bool:
     """Добавляет реферальную связь"""
     try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        with get_connection(_catalog_db()) as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT INTO referrals (user_id, referrer_id)
@@ -605,7 +561,7 @@ def add_referral(user_id: int, referrer_id: int) -> bool:
 @sync_error_handler
 def get_referrer_id(user_id: int) -> Optional[int]:
     """Получает ID реферера пользователя"""
-    with sqlite3.connect(DATABASE_NAME) as conn:
+    with get_connection(_catalog_db()) as conn:
         cursor = conn.cursor()
         cursor.execute(
             "SELECT referrer_id FROM referrals WHERE user_id = ?", (user_id,))
@@ -616,24 +572,28 @@ def get_referrer_id(user_id: int) -> Optional[int]:
 @sync_error_handler
 def get_referrals(user_id: int) -> List[Dict]:
     """Получает список рефералов пользователя"""
-    with sqlite3.connect(DATABASE_NAME) as conn:
-        conn.row_factory = dict_factory
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT u.user_id, u.username, u.full_name, r.registration_date
-            FROM referrals r
-            JOIN users u ON r.user_id = u.user_id
-            WHERE r.referrer_id = ?
-            ORDER BY r.registration_date DESC
-        """, (user_id,))
-        return cursor.fetchall()
+    with get_connection(_catalog_db()) as conn:
+        rows = conn.execute("""
+            SELECT user_id, registration_date FROM referrals
+            WHERE referrer_id = ?
+            ORDER BY registration_date DESC
+        """, (user_id,)).fetchall()
+
+    # Данные рефералов лежат в их шардах, соединяем в Python
+    users = _get_users_by_ids([row[0] for row in rows])
+    return [
+        Referral.from_row((referral_id, users[referral_id]['username'],
+                           users[referral_id]['full_name'], registration_date))
+        for referral_id, registration_date in rows
+        if referral_id in users
+    ]
 
 
 @sync_error_handler
 def add_referral_payment(user_id: int, referrer_id: int, amount: float, level: int, sub_type: str) -> bool:
     """Добавляет запись о реферальном платеже"""
     try:
-        with sqlite3.connect(DATABASE_NAME) as conn:
+        with get_connection(_catalog_db()) as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT INTO referral_payments (user_id, referrer_id, amount, level, subscription_type)
@@ -649,46 +609,48 @@ def add_referral_payment(user_id: int, referrer_id: int, amount: float, level: i
 @sync_error_handler
 def get_referral_stats(user_id: int) -> Dict:
     """Получает статистику по реферальной программе"""
-    with sqlite3.connect(DATABASE_NAME) as conn:
-        conn.row_factory = dict_factory
+    with get_connection(_catalog_db()) as conn:
         cursor = conn.cursor()
 
-        # Общее количество рефералов
+        # Рефералы пользователя
         cursor.execute(
-            "SELECT COUNT(*) as count FROM referrals WHERE referrer_id = ?", (user_id,))
-        total_referrals = cursor.fetchone()['count']
-
-        # Количество активных рефералов (с подпиской)
-        cursor.execute("""
-            SELECT COUNT(DISTINCT r.user_id) as count
-            FROM referrals r
-            JOIN users u ON r.user_id = u.user_id
-            WHERE r.referrer_id = ? AND u.subscription_type != 'free'
-        """, (user_id,))
-        active_referrals = cursor.fetchone()['count']
+            "SELECT user_id FROM referrals WHERE referrer_id = ?", (user_id,))
+        referral_ids = [row[0] for row in cursor.fetchall()]
 
         # Общий заработок
         cursor.execute(
             "SELECT SUM(amount) as total FROM referral_payments WHERE referrer_id = ?", (user_id,))
-        total_earned = cursor.fetchone()['total'] or 0
+        total_earned = cursor.fetchone()[0] or 0
 
         # Последние платежи
         cursor.execute("""
-            SELECT rp.*, u.username, u.full_name
-            FROM referral_payments rp
-            JOIN users u ON rp.user_id = u.user_id
-            WHERE rp.referrer_id = ?
-            ORDER BY rp.payment_date DESC
+            SELECT * FROM referral_payments
+            WHERE referrer_id = ?
+            ORDER BY payment_date DESC
             LIMIT 5
         """, (user_id,))
-        recent_payments = cursor.fetchall()
+        payments = ReferralPayment.fetch_all(cursor)
 
-        return {
-            'total_referrals': total_referrals,
-            'active_referrals': active_referrals,
-            'total_earned': total_earned,
-            'recent_payments': recent_payments
-        }
+    users = _get_users_by_ids(list(set(referral_ids) | {p['user_id'] for p in payments}))
+
+    # Количество активных рефералов (с подпиской)
+    active_referrals = sum(
+        1 for referral_id in referral_ids
+        if referral_id in users and users[referral_id]['subscription_type'] != 'free'
+    )
+    recent_payments = [
+        payment.replace(username=users[payment['user_id']]['username'],
+                        full_name=users[payment['user_id']]['full_name'])
+        for payment in payments
+        if payment['user_id'] in users
+    ]
+
+    return {
+        'total_referrals': len(referral_ids),
+        'active_referrals': active_referrals,
+        'total_earned': total_earned,
+        'recent_payments': recent_payments
+    }
 
 
 @sync_error_handler
@@ -696,13 +658,14 @@ def update_purchase_balance(user_id: int, amount: int):
     """Обновляет баланс для покупок"""
     print(
         f"ВЫЗОВ update_purchase_balance: пользователь {user_id}, сумма {amount}")
-    with sqlite3.connect(DATABASE_NAME) as conn:
+    with get_connection(_user_db(user_id)) as conn:
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE users SET balance = balance + ? WHERE user_id = ?",
             (amount, user_id)
         )
         conn.commit()
+        user_cache.invalidate(user_id)
         print(
             f"БАЛАНС ОБНОВЛЕН: пользователь {user_id}, новая сумма добавлена {amount}")
 
@@ -710,19 +673,20 @@ def update_purchase_balance(user_id: int, amount: int):
 @sync_error_handler
 def update_referral_balance(user_id: int, amount: int):
     """Обновляет реферальный баланс"""
-    with sqlite3.connect(DATABASE_NAME) as conn:
+    with get_connection(_user_db(user_id)) as conn:
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE users SET referral_balance = referral_balance + ? WHERE user_id = ?",
             (amount, user_id)
         )
         conn.commit()
+    user_cache.invalidate(user_id)
 
 
 @sync_error_handler
 def transfer_referral_to_purchase_balance(user_id: int, amount: int) -> bool:
     """Переводит средства с реферального баланса на баланс покупок"""
-    with sqlite3.connect(DATABASE_NAME) as conn:
+    with get_connection(_user_db(user_id)) as conn:
         cursor = conn.cursor()
         # Проверяем, достаточно ли средств на реферальном балансе
         cursor.execute(
@@ -737,13 +701,236 @@ def transfer_referral_to_purchase_balance(user_id: int, amount: int) -> bool:
             (amount, amount, user_id)
         )
         conn.commit()
-        return True
+    user_cache.invalidate(user_id)
+    return True
 
 
 @sync_error_handler
 def get_all_users_ids() -> List[int]:
     """Получает список всех ID пользователей"""
-    with sqlite3.connect(DATABASE_NAME) as conn:
+    def ids(path):
+        return [row[0] for row in get_connection(path).execute("SELECT user_id FROM users")]
+
+    return [user_id for shard_ids in get_storage().fan_out(ids) for user_id in shard_ids]
+
+
+@sync_error_handler
+def get_users_count() -> int:
+    """Возвращает количество пользователей"""
+    def count(path):
+        return get_connection(path).execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    return sum(get_storage().fan_out(count))
+
+
+@sync_error_handler
+def get_system_stats() -> Dict:
+    """Возвращает общую статистику системы для админ-панели"""
+    def totals(path):
+        return get_connection(path).execute(
+            "SELECT COUNT(*), SUM(balance) FROM users").fetchone()
+
+    shard_totals = get_storage().fan_out(totals)
+    total_users = sum(row[0] for row in shard_totals)
+    total_balance = sum(row[1] or 0 for row in shard_totals)
+
+    with get_connection(_catalog_db()) as conn:
+        total_admins = conn.execute(
+            "SELECT COUNT(*) FROM admins").fetchone()[0] + 1  # +1 для root админа
+
+    return {
+        'total_users': total_users,
+        'total_admins': total_admins,
+        'total_balance': total_balance
+    }
+
+
+@sync_error_handler
+def get_referral_system_stats() -> Dict:
+    """Возвращает статистику реферальной системы для админ-панели"""
+    with get_connection(_catalog_db()) as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT user_id FROM users")
-        return [row[0] for row in cursor.fetchall()]
+        cursor.row_factory = dict_factory
+
+        # Общая статистика
+        cursor.execute("SELECT COUNT(*) as count FROM referrals")
+        total_referrals = cursor.fetchone()['count']
+
+        cursor.execute("SELECT SUM(amount) as total FROM referral_payments")
+        total_payments = cursor.fetchone()['total'] or 0
+
+        cursor.execute("""
+            SELECT r.referrer_id as user_id, COUNT(*) as referrals_count,
+                   (SELECT SUM(rp.amount) FROM referral_payments rp
+                    WHERE rp.referrer_id = r.referrer_id) as earned_total
+            FROM referrals r
+            GROUP BY r.referrer_id
+            ORDER BY earned_total DESC
+            LIMIT 10
+        """)
+        top_referrers = cursor.fetchall()
+
+    # Имена рефереров лежат в их шардах
+    users = _get_users_by_ids([row['user_id'] for row in top_referrers])
+    for row in top_referrers:
+        user = users.get(row['user_id'])
+        row['username'] = user['username'] if user else None
+
+    return {
+        'total_referrals': total_referrals,
+        'total_payments': total_payments,
+        'top_referrers': top_referrers
+    }
+
+
+
+@sync_error_handler
+def set_user_blocked(user_id: int, blocked: bool):
+    """Отмечает, что пользователь заблокировал бота (или вернулся)"""
+    with get_connection(_user_db(user_id)) as conn:
+        conn.execute("UPDATE users SET is_blocked = ? WHERE user_id = ?",
+                     (int(blocked), user_id))
+        conn.commit()
+    user_cache.update(user_id, is_blocked=int(blocked))
+
+
+@sync_error_handler
+def count_broadcast_recipients() -> int:
+    """Пользователи, которым уходит рассылка: все, кроме заблокировавших бота"""
+    def count(path):
+        return get_connection(path).execute(
+            "SELECT COUNT(*) FROM users WHERE is_blocked = 0").fetchone()[0]
+
+    return sum(get_storage().fan_out(count))
+
+
+@sync_error_handler
+def get_broadcast_page(shard: int, after_user_id: int, limit: int) -> List[int]:
+    """Следующие limit получателей шарда с номером shard после after_user_id (по возрастанию)"""
+    path = get_storage().shards[shard]
+    cursor = get_connection(path).execute("""
+        SELECT user_id FROM users
+        WHERE user_id > ? AND is_blocked = 0 ORDER BY user_id LIMIT ?
+    """, (after_user_id, limit))
+    return [row[0] for row in cursor]
+
+
+@sync_error_handler
+def get_broadcast_recipients_done(job_id: int, first_user_id: int, last_user_id: int) -> set:
+    """Получатели из диапазона, по которым у рассылки уже есть итог"""
+    flush_writes(_catalog_db())
+    cursor = get_connection(_catalog_db()).execute("""
+        SELECT user_id FROM broadcast_recipients
+        WHERE job_id = ? AND user_id BETWEEN ? AND ?
+    """, (job_id, first_user_id, last_user_id))
+    return {row[0] for row in cursor}
+
+
+@sync_error_handler
+def create_broadcast_job(text: str, created_by: int, total: int) -> int:
+    with get_connection(_catalog_db()) as conn:
+        cursor = conn.execute(
+            "INSERT INTO broadcast_jobs (text, created_by, total) VALUES (?, ?, ?)",
+            (text, created_by, total)
+        )
+        conn.commit()
+        return cursor.lastrowid
+
+
+@sync_error_handler
+def get_broadcast_job(job_id: int) -> Optional[BroadcastJob]:
+    flush_writes(_catalog_db())
+    cursor = get_connection(_catalog_db()).execute(
+        "SELECT * FROM broadcast_jobs WHERE id = ?", (job_id,))
+    return BroadcastJob.fetch_one(cursor)
+
+
+@sync_error_handler
+def get_broadcast_jobs(statuses: tuple = ('running', 'paused')) -> List[BroadcastJob]:
+    flush_writes(_catalog_db())
+    placeholders = ", ".join("?" * len(statuses))
+    cursor = get_connection(_catalog_db()).execute(
+        f"SELECT * FROM broadcast_jobs WHERE status IN ({placeholders}) ORDER BY id", statuses)
+    return BroadcastJob.fetch_all(cursor)
+
+
+@sync_error_handler
+def get_recent_broadcast_jobs(limit: int = 10) -> List[BroadcastJob]:
+    flush_writes(_catalog_db())
+    cursor = get_connection(_catalog_db()).execute(
+        "SELECT * FROM broadcast_jobs ORDER BY id DESC LIMIT ?", (limit,))
+    return BroadcastJob.fetch_all(cursor)
+
+
+@sync_error_handler
+def set_broadcast_progress_message(job_id: int, chat_id: int, message_id: int):
+    with get_connection(_catalog_db()) as conn:
+        conn.execute(
+            "UPDATE broadcast_jobs SET progress_chat_id = ?, progress_message_id = ? WHERE id = ?",
+            (chat_id, message_id, job_id)
+        )
+        conn.commit()
+
+
+@sync_error_handler
+def set_broadcast_status(job_id: int, status: str):
+    finished = status in ('done', 'cancelled')
+    with get_connection(_catalog_db()) as conn:
+        conn.execute("""
+            UPDATE broadcast_jobs SET status = ?,
+                finished_at = CASE WHEN ? THEN CURRENT_TIMESTAMP ELSE NULL END
+            WHERE id = ?
+        """, (status, finished, job_id))
+        conn.commit()
+
+
+@sync_error_handler
+def save_broadcast_recipient(job_id: int, user_id: int, status: str, error: Optional[str] = None):
+    enqueue_write(_catalog_db(), """
+        INSERT OR REPLACE INTO broadcast_recipients (job_id, user_id, status, error)
+        VALUES (?, ?, ?, ?)
+    """, (job_id, user_id, status, error))
+
+
+@sync_error_handler
+def save_broadcast_progress(job_id: int, shard: int, last_user_id: int,
+                            sent: int, failed: int, blocked: int):
+    """Сдвигает курсор рассылки после страницы получателей (итоги страницы уже сброшены flush_broadcast_writes)"""
+    # Очередь записи одна на файл и пишет по порядку: курсор попадет в БД
+    # не раньше итогов по получателям страницы
+    enqueue_write(_catalog_db(), """
+        UPDATE broadcast_jobs SET shard = ?, last_user_id = ?, sent = ?, failed = ?, blocked = ?
+        WHERE id = ?
+    """, (shard, last_user_id, sent, failed, blocked, job_id))
+
+
+@sync_error_handler
+def flush_broadcast_writes():
+    """Дожидается записи в БД итогов по получателям, поставленных в очередь"""
+    flush_writes(_catalog_db())
+
+
+@sync_error_handler
+def save_scheduled_deletion(chat_id: int, message_id: int, due_at: float):
+    enqueue_write(_catalog_db(), """
+        INSERT OR REPLACE INTO scheduled_deletions (chat_id, message_id, due_at)
+        VALUES (?, ?, ?)
+    """, (chat_id, message_id, due_at))
+
+
+@sync_error_handler
+def remove_scheduled_deletions(messages: List[tuple]):
+    """Убирает выполненные удаления: messages - пары (chat_id, message_id)"""
+    for chat_id, message_id in messages:
+        enqueue_write(_catalog_db(), """
+            DELETE FROM scheduled_deletions WHERE chat_id = ? AND message_id = ?
+        """, (chat_id, message_id))
+
+
+@sync_error_handler
+def get_scheduled_deletions() -> List[tuple]:
+    """Все отложенные удаления (chat_id, message_id, due_at) - читаются при запуске"""
+    flush_writes(_catalog_db())
+    cursor = get_connection(_catalog_db()).execute(
+        "SELECT chat_id, message_id, due_at FROM scheduled_deletions")
+    return cursor.fetchall()
@@ -0,0 +1,88 @@
+import sqlite3
+import threading
+from typing import Dict
+
+# Настройки соединений SQLite
+BUSY_TIMEOUT_MS = 5000        # Сколько ждать блокировку записи, прежде чем вернуть SQLITE_BUSY
+SYNCHRONOUS = "NORMAL"        # В режиме WAL NORMAL безопасен и не делает fsync на каждый commit
+CACHED_STATEMENTS = 256       # Размер кэша подготовленных выражений на одно соединение
+
+
+class ConnectionManager:
+    """Держит долгоживущие соединения с одной базой (по одному на поток)"""
+
+    def __init__(self, database: str, busy_timeout_ms: int = BUSY_TIMEOUT_MS,
+                 synchronous: str = SYNCHRONOUS, cached_statements: int = CACHED_STATEMENTS):
+        self.database = database
+        self.busy_timeout_ms = busy_timeout_ms
+        self.synchronous = synchronous
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.database,
+            timeout=self.busy_timeout_ms / 1000,
+            cached_statements=self.cached_statements,
+            check_same_thread=False
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """Возвращает соединение текущего потока, создавая его при первом обращении"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close_all(self):
+        """Закрывает все открытые соединения (вызывается при остановке бота)"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+
+_managers: Dict[str, ConnectionManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_manager(database: str) -> ConnectionManager:
+    manager = _managers.get(database)
+    if manager is None:
+        with _managers_lock:
+            manager = _managers.get(database)
+            if manager is None:
+                manager = ConnectionManager(database)
+                _managers[database] = manager
+    return manager
+
+
+def get_connection(database: str) -> sqlite3.Connection:
+    """
+    Возвращает долгоживущее соединение с базой для текущего потока.
+    Используется как `with get_connection(DATABASE_NAME) as conn:` -
+    блок with коммитит транзакцию (или откатывает при ошибке), но не закрывает соединение.
+    Row factory задается на курсоре, а не на соединении, так как оно общее.
+    """
+    return get_manager(database).connection()
+
+
+def close_all_connections():
+    """Закрывает соединения всех баз"""
+    with _managers_lock:
+        managers = list(_managers.values())
+    for manager in managers:
+        manager.close_all()
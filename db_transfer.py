@@ -0,0 +1,224 @@
+"""
+Потоковая выгрузка и загрузка базы в NDJSON или CSV.
+
+    python db_transfer.py export <папка> [--format ndjson|csv] [--tables users,referrals]
+    python db_transfer.py import <папка> [--format ndjson|csv] [--tables ...] [--skip-existing]
+
+Каждая таблица пишется в отдельный файл <папка>/<таблица>.<формат>. Строки читаются
+из курсора порциями через fetchmany и пишутся в файл сразу, а при загрузке
+вставляются через executemany большими транзакциями, поэтому расход памяти
+не зависит от размера базы.
+
+Выгрузка и загрузка учитывают шардирование (storage.py): таблицы пользователей
+читаются из всех шардов, а при загрузке каждая строка попадает в шард своего
+user_id. Поэтому выгрузка и загрузка с другим DB_SHARDS перераскладывает базу.
+У message_logs id при загрузке назначается заново (в разных шардах id пересекаются),
+порядок сообщений пользователя сохраняется.
+
+Архив сообщений (message_archive) не переносится: в нем бинарные сжатые пачки.
+В CSV пустое поле загружается как NULL.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import database
+from db_pool import get_connection
+from user_cache import user_cache
+
+FETCH_ROWS = 5000      # Строк за один fetchmany
+INSERT_ROWS = 5000     # Строк в одном executemany
+COMMIT_ROWS = 200000   # Строк в одной транзакции при загрузке
+
+# Таблица: (где лежит, ключ шарда, назначать ли id заново при загрузке)
+TABLES: Dict[str, Tuple[str, Optional[str], bool]] = {
+    'users': ('shard', 'user_id', False),
+    'user_discounts': ('shard', 'user_id', True),
+    'message_logs': ('shard', 'user_id', True),
+    'admins': ('catalog', None, False),
+    'discount_codes': ('catalog', None, False),
+    'referrals': ('catalog', None, False),
+    'referral_payments': ('catalog', None, False),
+}
+FORMATS = ('ndjson', 'csv')
+
+
+def _table_columns(path: str, table: str) -> List[str]:
+    return [row[1] for row in get_connection(path).execute(f"PRAGMA table_info({table})")]
+
+
+def _source_databases(table: str) -> List[str]:
+    storage = database.get_storage()
+    return storage.shards if TABLES[table][0] == 'shard' else [storage.catalog]
+
+
+def iter_rows(table: str) -> Iterator[Tuple[List[str], List[tuple]]]:
+    """Отдает строки таблицы порциями (колонки, строки) из всех файлов, где она лежит"""
+    for path in _source_databases(table):
+        cursor = get_connection(path).cursor()
+        cursor.execute(f"SELECT * FROM {table} ORDER BY rowid")
+        columns = [col[0] for col in cursor.description]
+        while True:
+            rows = cursor.fetchmany(FETCH_ROWS)
+            if not rows:
+                break
+            yield columns, rows
+
+
+def export_table(table: str, directory: str, fmt: str) -> int:
+    path = os.path.join(directory, f"{table}.{fmt}")
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            header_written = False
+            for columns, rows in iter_rows(table):
+                if not header_written:
+                    writer.writerow(columns)
+                    header_written = True
+                writer.writerows(rows)
+                count += len(rows)
+            if not header_written:
+                writer.writerow(_table_columns(database.get_storage().catalog, table))
+        else:
+            dumps = json.dumps
+            for columns, rows in iter_rows(table):
+                f.writelines(
+                    dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows)
+                count += len(rows)
+    return count
+
+
+def _read_file(path: str, fmt: str) -> Iterator[Tuple[List[str], tuple]]:
+    with open(path, encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return
+            for row in reader:
+                yield header, tuple(value if value != "" else None for value in row)
+        else:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    yield list(item.keys()), tuple(item.values())
+
+
+class _ShardWriter:
+    """Копит строки для одного файла и вставляет их пачками, коммитя раз в COMMIT_ROWS"""
+
+    def __init__(self, path: str, sql: str):
+        self.conn = get_connection(path)
+        self.sql = sql
+        self.pending: List[tuple] = []
+        self.uncommitted = 0
+        self.conn.execute("BEGIN")
+
+    def add(self, row: tuple):
+        self.pending.append(row)
+        if len(self.pending) >= INSERT_ROWS:
+            self._insert()
+
+    def _insert(self):
+        if not self.pending:
+            return
+        self.conn.executemany(self.sql, self.pending)
+        self.uncommitted += len(self.pending)
+        self.pending = []
+        if self.uncommitted >= COMMIT_ROWS:
+            self.conn.commit()
+            self.conn.execute("BEGIN")
+            self.uncommitted = 0
+
+    def close(self):
+        self._insert()
+        self.conn.commit()
+
+
+def import_table(table: str, directory: str, fmt: str, skip_existing: bool = False) -> int:
+    path = os.path.join(directory, f"{table}.{fmt}")
+    if not os.path.exists(path):
+        return 0
+
+    location, shard_key, renumber = TABLES[table]
+    storage = database.get_storage()
+    known = set(_table_columns(storage.catalog, table))
+    verb = "INSERT OR IGNORE" if skip_existing else "INSERT OR REPLACE"
+
+    writers: Dict[str, _ShardWriter] = {}
+    picks = None
+    key_index = None
+    count = 0
+    try:
+        for columns, row in _read_file(path, fmt):
+            if picks is None:
+                # Колонки, которых нет в схеме, и id у перенумеруемых таблиц пропускаются
+                picks = [i for i, name in enumerate(columns)
+                         if name in known and not (renumber and name == 'id')]
+                names = [columns[i] for i in picks]
+                sql = (f"{verb} INTO {table} ({', '.join(names)}) "
+                       f"VALUES ({', '.join('?' * len(names))})")
+                if shard_key is not None:
+                    key_index = columns.index(shard_key)
+
+            if key_index is not None:
+                target = storage.shard_for(int(row[key_index]))
+            else:
+                target = storage.catalog
+            writer = writers.get(target)
+            if writer is None:
+                writer = writers[target] = _ShardWriter(target, sql)
+            writer.add(tuple(row[i] for i in picks))
+            count += 1
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    if table == 'users':
+        user_cache.clear()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Выгрузка и загрузка базы в NDJSON/CSV")
+    parser.add_argument("action", choices=("export", "import"))
+    parser.add_argument("directory")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--tables", default=",".join(TABLES),
+                        help="Список таблиц через запятую")
+    parser.add_argument("--database", default=database.DATABASE_NAME,
+                        help="Файл каталога (по умолчанию users.db)")
+    parser.add_argument("--skip-existing", action="store_true",
+                        help="При загрузке не перезаписывать существующие строки")
+    args = parser.parse_args(argv)
+
+    tables = [name.strip() for name in args.tables.split(",") if name.strip()]
+    unknown = [name for name in tables if name not in TABLES]
+    if unknown:
+        print(f"Неизвестные таблицы: {', '.join(unknown)}")
+        return 2
+
+    database.DATABASE_NAME = args.database
+    database.init_db()
+    os.makedirs(args.directory, exist_ok=True)
+
+    total_started = time.perf_counter()
+    for table in tables:
+        started = time.perf_counter()
+        if args.action == "export":
+            count = export_table(table, args.directory, args.format)
+        else:
+            count = import_table(table, args.directory, args.format, args.skip_existing)
+        elapsed = time.perf_counter() - started
+        print(f"{table:<20} {count:>10} строк  {elapsed:6.1f} с")
+    print(f"Готово за {time.perf_counter() - total_started:.1f} с")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,32 @@ from functools import wraps
 from error_logger import log_error
 from config import ROOT_ADMIN_ID
 from shared import bot
+from send_queue import send_priority, NORMAL
+
+# Основной event loop бота - для уведомлений из потоков пула БД
+_main_loop = None
+
+
+def set_main_loop(loop):
+    global _main_loop
+    _main_loop = loop
+
+
+def _schedule_notification(coro):
+    """Запускает корутину в текущем event loop или, из другого потока, в основном"""
+    try:
+        asyncio.get_running_loop().create_task(coro)
+    except RuntimeError:
+        if _main_loop is not None and _main_loop.is_running():
+            asyncio.run_coroutine_threadsafe(coro, _main_loop)
+        else:
+            coro.close()
+
+
+async def _notify_admin(text: str):
+    """Уведомление главному админу - служебное, уступает очередь ответам пользователям"""
+    with send_priority(NORMAL):
+        await bot.send_message(ROOT_ADMIN_ID, text)
 
 
 def error_handler(func):
@@ -36,7 +62,13 @@ def error_handler(func):
                     user_id = arg.from_user.id
                     break
 
-            log_error(error_type, error_message, tb, user_id)
+            # Запись в журнал может ждать очередь записи - не в event loop
+            from async_database import log_error as log_error_async
+            try:
+                await log_error_async(error_type, error_message, tb, user_id)
+            except RuntimeError:
+                # Пул записи уже остановлен (бот завершает работу)
+                log_error(error_type, error_message, tb, user_id)
 
             # Отправляем уведомление главному админу
             if ROOT_ADMIN_ID:
@@ -49,7 +81,7 @@ def error_handler(func):
                         f"📄 <b>Сообщение:</b> {error_message[:200]}...\n"
                         f"🔍 <b>Traceback:</b>\n<code>{tb[:500]}...</code>"
                     )
-                    await bot.send_message(ROOT_ADMIN_ID, admin_message)
+                    await _notify_admin(admin_message)
                 except Exception:
                     pass  # Игнорируем ошибки при отправке уведомления
 
@@ -107,9 +139,7 @@ def sync_error_handler(func):
                     f"📄 <b>Сообщение:</b> {error_message[:200]}...\n"
                     f"🔍 <b>Traceback:</b>\n<code>{tb[:500]}...</code>"
                 )
-                # Используем create_task вместо threading.Thread
-                asyncio.create_task(bot.send_message(
-                    ROOT_ADMIN_ID, admin_message))
+                _schedule_notification(_notify_admin(admin_message))
             except Exception:
                 pass  # Игнорируем ошибки при отправке уведомления
 
@@ -0,0 +1,174 @@
+"""
+Ответ модели, который появляется в Telegram по мере генерации.
+
+Первый фрагмент отправляется новым сообщением сразу, как только пришел,
+дальше то же сообщение редактируется не чаще раза в STREAM_EDIT_INTERVAL секунд
+(Telegram ограничивает частоту редактирования). Когда текст перерастает
+TELEGRAM_MESSAGE_LIMIT, текущее сообщение фиксируется на границе абзаца,
+строки или слова, и продолжение идет в следующем сообщении.
+
+Пока очередь отправки (send_queue.py) упирается в общий лимит Telegram,
+промежуточные правки и обновления служебного текста пропускаются: первые
+фрагменты и итоговый текст важнее.
+
+Ответ модели отправляется без parse_mode: в нем могут быть символы <, > и &,
+которые сломали бы HTML-разметку, включенную у бота по умолчанию.
+"""
+import asyncio
+import time
+from typing import List, Optional
+
+from aiogram import Bot
+from aiogram.enums import ChatAction
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+from config import STREAM_EDIT_INTERVAL, TELEGRAM_MESSAGE_LIMIT
+from send_queue import telegram_send_queue
+
+CURSOR = " ▍"
+
+
+def find_split(text: str, limit: int) -> int:
+    """Позиция, на которой удобно разрезать text, чтобы первая часть была не длиннее limit"""
+    if len(text) <= limit:
+        return len(text)
+    window = text[:limit]
+    for separator in ("\n\n", "\n", ". ", " "):
+        position = window.rfind(separator)
+        # Не режем слишком близко к началу - иначе сообщения получатся огрызками
+        if position >= limit // 2:
+            return position + len(separator)
+    return limit
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Делит готовый текст на части не длиннее limit"""
+    parts = []
+    while len(text) > limit:
+        cut = find_split(text, limit)
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        parts.append(text)
+    return parts
+
+
+class LiveReply:
+    def __init__(self, bot: Bot, chat_id: int, edit_interval: float = STREAM_EDIT_INTERVAL,
+                 limit: int = TELEGRAM_MESSAGE_LIMIT):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.edit_interval = edit_interval
+        self.limit = limit
+
+        self.text = ""
+        self.messages: List[Message] = []
+        self._offset = 0            # Начало текста текущего (последнего) сообщения
+        self._current: Optional[Message] = None
+        self._shown = ""            # Что сейчас показано в текущем сообщении
+        self._next_edit = 0.0
+
+        self.edits = 0
+        self.skipped_edits = 0
+        self.first_visible_at: Optional[float] = None
+        self.started_at = time.monotonic()
+
+    async def start(self):
+        """Показывает «печатает...», пока не пришел первый фрагмент"""
+        try:
+            await self.bot.send_chat_action(self.chat_id, ChatAction.TYPING)
+        except Exception:
+            pass
+
+    async def append(self, delta: str):
+        self.text += delta
+        if time.monotonic() < self._next_edit:
+            return
+        if self.first_visible_at is not None and telegram_send_queue.busy():
+            # Отправка в Telegram упирается в общий лимит: промежуточную правку пропускаем,
+            # чтобы не занимать очередь перед первыми фрагментами других ответов. Итог покажет finish
+            self._next_edit = time.monotonic() + self.edit_interval
+            self.skipped_edits += 1
+            return
+        await self._render(final=False)
+
+    async def finish(self, fallback: str = None) -> List[Message]:
+        """Показывает итоговый текст целиком (или fallback, если модель ничего не вернула)"""
+        if not self.text and fallback:
+            self.text = fallback
+        await self._render(final=True)
+        return self.messages
+
+    async def status(self, text: str):
+        """Служебный текст до начала ответа (например, место в очереди) - первый фрагмент ответа заменит его"""
+        if self.text:
+            return
+        if self._current is not None and telegram_send_queue.busy():
+            # Обновление служебного текста подождет, пока очередь отправки не разгрузится
+            self.skipped_edits += 1
+            return
+        await self._show(text)
+
+    async def abort(self, note: str):
+        """Оставляет показанную часть прерванного ответа с пометкой note"""
+        if not self.messages:
+            return
+        self.text = self.text.rstrip() + note
+        try:
+            await self._render(final=True)
+        except Exception:
+            pass
+
+    async def _render(self, final: bool):
+        room = self.limit if final else self.limit - len(CURSOR)
+
+        # Все, что не помещается в текущее сообщение, фиксируем и начинаем новое
+        while len(self.text) - self._offset > room:
+            tail = self.text[self._offset:]
+            cut = find_split(tail, self.limit)
+            await self._show(tail[:cut].rstrip(), required=True)
+            rest = tail[cut:]
+            self._offset += cut + (len(rest) - len(rest.lstrip()))
+            self._current = None
+            self._shown = ""
+
+        tail = self.text[self._offset:]
+        if tail.strip():
+            await self._show(tail if final else tail + CURSOR, required=final)
+
+    async def _show(self, text: str, required: bool = False):
+        if text == self._shown:
+            return
+        try:
+            if self._current is None:
+                self._current = await self.bot.send_message(
+                    self.chat_id, text, parse_mode=None)
+                self.messages.append(self._current)
+            else:
+                await self.bot.edit_message_text(
+                    text, chat_id=self.chat_id, message_id=self._current.message_id,
+                    parse_mode=None)
+                self.edits += 1
+            # Служебный текст (status) ответом не считается
+            if self.first_visible_at is None and self.text:
+                self.first_visible_at = time.monotonic()
+            self._shown = text
+            self._next_edit = time.monotonic() + self.edit_interval
+        except TelegramRetryAfter as e:
+            if required:
+                # Итоговый текст обязательно должен дойти до пользователя
+                await asyncio.sleep(e.retry_after)
+                await self._show(text, required)
+            else:
+                # Промежуточное состояние покажем следующим редактированием
+                self._next_edit = time.monotonic() + e.retry_after
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e).lower():
+                raise
+
+    @property
+    def time_to_first_visible(self) -> Optional[float]:
+        if self.first_visible_at is None:
+            return None
+        return self.first_visible_at - self.started_at
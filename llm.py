@@ -0,0 +1,134 @@
+"""
+Клиент OpenRouter с потоковой выдачей ответа (SSE).
+
+stream_chat отдает текст ответа кусками по мере генерации, поэтому первый
+фрагмент можно показать пользователю, не дожидаясь конца ответа.
+Все запросы идут через одну aiohttp-сессию: соединение с OpenRouter
+переиспользуется, и на каждый ответ не тратится TLS-рукопожатие.
+"""
+import json
+import time
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Callable, Dict, List, Mapping, Optional
+
+import aiohttp
+
+from config import (
+    OPENROUTER_API_KEY,
+    OPENROUTER_URL,
+    AI_NAME,
+    LLM_REQUEST_TIMEOUT,
+    LLM_CONNECT_TIMEOUT,
+    LLM_MAX_CONNECTIONS
+)
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+class LLMError(Exception):
+    """Ошибка OpenRouter: неуспешный HTTP-статус или ошибка внутри потока"""
+
+    def __init__(self, message: str, status: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After в секундах: заголовок бывает числом секунд или HTTP-датой"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(moment.timestamp() - time.time(), 0.0)
+
+
+def get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(
+                total=LLM_REQUEST_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            connector=aiohttp.TCPConnector(
+                limit=LLM_MAX_CONNECTIONS, keepalive_timeout=60),
+            headers={
+                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+                "X-Title": "Zenith"
+            }
+        )
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def stream_chat(messages: List[Dict], model: str = AI_NAME,
+                      max_tokens: Optional[int] = None,
+                      usage: Optional[Dict] = None,
+                      url: str = OPENROUTER_URL,
+                      api_key: Optional[str] = None,
+                      on_headers: Optional[Callable[[Mapping[str, str]], None]] = None
+                      ) -> AsyncIterator[str]:
+    """
+    Отдает фрагменты ответа модели по мере генерации.
+    Если передан словарь usage, по окончании в нем будет статистика токенов от OpenRouter
+    и finish_reason ("stop" - модель закончила сама, "length" - уперлась в max_tokens).
+    url и api_key позволяют обратиться к другому OpenAI-совместимому API,
+    on_headers получает заголовки ответа (в них лимиты запросов провайдера).
+    """
+    payload = {
+        "model": model,
+        "messages": messages,
+        "stream": True,
+        "usage": {"include": True}
+    }
+    if max_tokens:
+        payload["max_tokens"] = max_tokens
+
+    headers = {"Authorization": f"Bearer {api_key}"} if api_key else None
+    async with get_session().post(url, json=payload, headers=headers) as response:
+        if on_headers is not None:
+            on_headers(response.headers)
+        if response.status != 200:
+            body = await response.text()
+            raise LLMError(f"OpenRouter {response.status}: {body[:300]}", response.status,
+                           parse_retry_after(response.headers.get("Retry-After")))
+
+        # Поток SSE: строки "data: {...}", комментарии ": ..." и "data: [DONE]" в конце
+        async for raw_line in response.content:
+            line = raw_line.decode("utf-8", errors="ignore").strip()
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+
+            try:
+                chunk = json.loads(data)
+            except ValueError:
+                continue
+            if "error" in chunk:
+                error = chunk["error"]
+                if isinstance(error, dict):
+                    raise LLMError(f"OpenRouter: {error.get('message', error)}", error.get("code"))
+                raise LLMError(f"OpenRouter: {error}")
+            if usage is not None and chunk.get("usage"):
+                usage.update(chunk["usage"])
+
+            for choice in chunk.get("choices") or ():
+                if usage is not None and choice.get("finish_reason"):
+                    usage["finish_reason"] = choice["finish_reason"]
+                delta = (choice.get("delta") or {}).get("content")
+                if delta:
+                    yield delta
@@ -0,0 +1,163 @@
+"""
+Отложенное удаление сообщений бота.
+
+Обработчики не ждут в asyncio.sleep, чтобы потом удалить подсказку или
+сообщение об ошибке: они ставят задание «удалить (chat_id, message_id) через
+N секунд» и сразу возвращаются. Задания хранит одно колесо таймеров: массив
+из DELETE_WHEEL_SLOTS ячеек, по одной на DELETE_WHEEL_TICK секунд. Постановка
+задания - добавление в ячейку, раз в тик разбирается одна ячейка; задания с
+задержкой больше оборота колеса остаются в ячейке до своего оборота.
+
+Сообщения, срок которых наступил, группируются по чатам и удаляются одним
+deleteMessages на чат (до DELETE_BATCH_SIZE сообщений). Запросы идут через
+очередь отправки (send_queue.py) с приоритетом BULK.
+
+Задания пишутся в таблицу scheduled_deletions через очередь отложенной записи
+и загружаются при запуске бота, поэтому перезапуск не оставляет в чатах
+сообщений, которые должны были исчезнуть. Просроченные при загрузке задания
+выполняются сразу, а старше DELETE_MAX_AGE - отбрасываются: такие сообщения
+Telegram удалить уже не даст.
+"""
+import asyncio
+import math
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from async_database import get_scheduled_deletions, remove_scheduled_deletions, save_scheduled_deletion
+from config import DELETE_WHEEL_TICK, DELETE_WHEEL_SLOTS, DELETE_BATCH_SIZE, DELETE_MAX_AGE
+from send_queue import send_priority, BULK
+from shared import bot
+
+
+class DeletionScheduler:
+    def __init__(self, tick: float = DELETE_WHEEL_TICK, slots: int = DELETE_WHEEL_SLOTS,
+                 batch_size: int = DELETE_BATCH_SIZE):
+        self.tick = tick
+        self.batch_size = batch_size
+        # Ячейка: задания (номер тика, chat_id, message_id)
+        self._slots: List[List[Tuple[int, int, int]]] = [[] for _ in range(slots)]
+        self._origin = time.time()
+        self._current = 0      # последний разобранный тик
+        self._pending = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.scheduled = 0
+        self.deleted = 0
+        self.batches = 0
+        self.failed = 0
+
+    async def schedule(self, chat_id: int, message_id: int, delay: float):
+        """Удалит сообщение через delay секунд"""
+        due_at = time.time() + delay
+        self._add(chat_id, message_id, due_at)
+        await save_scheduled_deletion(chat_id, message_id, due_at)
+
+    async def start(self):
+        """Загружает задания, оставшиеся с прошлого запуска, и запускает колесо"""
+        if self._task is not None:
+            return
+        now = time.time()
+        expired = []
+        for chat_id, message_id, due_at in await get_scheduled_deletions() or []:
+            if due_at < now - DELETE_MAX_AGE:
+                expired.append((chat_id, message_id))
+            else:
+                self._add(chat_id, message_id, due_at)
+        if expired:
+            await remove_scheduled_deletions(expired)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Останавливает колесо; невыполненные задания остаются в БД до следующего запуска"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _tick_of(self, moment: float) -> int:
+        return math.floor((moment - self._origin) / self.tick)
+
+    def _add(self, chat_id: int, message_id: int, due_at: float):
+        # Задание не попадает в уже разобранный тик - в худшем случае сработает в следующем
+        due_tick = max(math.ceil((due_at - self._origin) / self.tick), self._current + 1)
+        self._slots[due_tick % len(self._slots)].append((due_tick, chat_id, message_id))
+        self._pending += 1
+        self.scheduled += 1
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            next_at = self._origin + (self._current + 1) * self.tick
+            await asyncio.sleep(max(next_at - time.time(), 0))
+            due = self._advance(self._tick_of(time.time()))
+            if due:
+                await self._delete(due)
+
+    def _advance(self, now_tick: int) -> Dict[int, Set[int]]:
+        """Разбирает ячейки тиков до now_tick включительно: {chat_id: сообщения к удалению}"""
+        due: Dict[int, Set[int]] = {}
+        # После долгой паузы (например, сна машины) достаточно одного оборота колеса
+        first = max(self._current + 1, now_tick - len(self._slots) + 1)
+        for tick in range(first, now_tick + 1):
+            slot = self._slots[tick % len(self._slots)]
+            if not slot:
+                continue
+            later = []
+            for job in slot:
+                if job[0] <= now_tick:
+                    due.setdefault(job[1], set()).add(job[2])
+                    self._pending -= 1
+                else:
+                    later.append(job)
+            slot[:] = later
+        self._current = max(self._current, now_tick)
+        return due
+
+    async def _delete(self, due: Dict[int, Set[int]]):
+        batches = []
+        for chat_id, message_ids in due.items():
+            ordered = sorted(message_ids)
+            for i in range(0, len(ordered), self.batch_size):
+                batches.append((chat_id, ordered[i:i + self.batch_size]))
+        with send_priority(BULK):
+            await asyncio.gather(*(self._delete_batch(chat_id, message_ids)
+                                   for chat_id, message_ids in batches))
+        await remove_scheduled_deletions([(chat_id, message_id) for chat_id, message_ids in batches
+                                          for message_id in message_ids])
+
+    async def _delete_batch(self, chat_id: int, message_ids: List[int]):
+        self.batches += 1
+        try:
+            if len(message_ids) == 1:
+                await bot.delete_message(chat_id, message_ids[0])
+            else:
+                # Сообщения, которых уже нет, Telegram пропускает
+                await bot.delete_messages(chat_id, message_ids)
+            self.deleted += len(message_ids)
+        except (TelegramBadRequest, TelegramForbiddenError):
+            # Сообщение уже удалено пользователем или бот заблокирован
+            self.failed += len(message_ids)
+        except Exception as e:
+            print(f"Ошибка отложенного удаления сообщений в чате {chat_id}: {e}")
+            self.failed += len(message_ids)
+
+    def stats(self) -> Dict:
+        return {
+            'pending': self._pending,
+            'scheduled': self.scheduled,
+            'deleted': self.deleted,
+            'batches': self.batches,
+            'failed': self.failed
+        }
+
+
+deletion_scheduler = DeletionScheduler()
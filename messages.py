@@ -1,8 +1,9 @@
-from database import is_subscription_active, is_user_admin, get_subscription_info
+from async_database import is_user_admin
 from error_handler import error_handler,sync_error_handler
+from records import Record
 
-@sync_error_handler
-def get_welcome_message(user_id=None):
+@error_handler
+async def get_welcome_message(user_id=None):
     # Если user_id не передан, возвращаем общее приветствие
     if user_id is None:
         return (
@@ -12,8 +13,8 @@ def get_welcome_message(user_id=None):
         )
     
     # Получаем информацию о пользователе
-    from database import get_user
-    user = get_user(user_id)
+    from async_database import get_user
+    user = await get_user(user_id)
     
     if not user:
         return (
@@ -41,7 +42,7 @@ def get_welcome_message(user_id=None):
     sub_limit = sub_limits.get(sub_type, '20 токенов/день')
     
     # Проверяем, является ли пользователь админом
-    is_admin = is_user_admin(user_id)
+    is_admin = await is_user_admin(user_id)
     admin_text = "\n👑 У вас права администратора" if is_admin else ""
     
     return (
@@ -54,7 +55,7 @@ def get_welcome_message(user_id=None):
 def get_profile_text(user: dict) -> str:
     try:
         # Проверяем обязательные поля
-        if not isinstance(user, dict):
+        if not isinstance(user, (dict, Record)):
             return "❌ Ошибка данных профиля"
             
         # Устанавливаем значения по умолчанию
@@ -93,7 +94,7 @@ def get_mode_changed_message(mode_type: str):
 @sync_error_handler
 def get_subscription_info_text(user: dict) -> str:
     try:
-        if not user or not isinstance(user, dict):
+        if not user or not isinstance(user, (dict, Record)):
             return "🔔 Подписка: данные не загружены"
         
         # Получаем user_id безопасным способом
@@ -112,15 +113,10 @@ def get_subscription_info_text(user: dict) -> str:
             'tier3': 'Zenith Eclipse'
         }
         
-        sub_limits = {
-            'free': 20,          # 20 токенов
-            'tier1': 20000,      # 20k токенов
-            'tier2': 40000,      # 40k токенов
-            'tier3': 100000      # 100k токенов
-        }
-        
+        from config import DAILY_TOKEN_LIMITS
+
         sub_name = sub_names.get(sub_type, 'Zenith Spark')
-        limit = sub_limits.get(sub_type, 20)
+        limit = DAILY_TOKEN_LIMITS.get(sub_type, DAILY_TOKEN_LIMITS['free'])
         
         # Форматируем значения
         @sync_error_handler
@@ -161,23 +157,23 @@ def get_subscription_info_text(user: dict) -> str:
         print(f"Критическая ошибка в get_subscription_info_text: {str(e)}")
         return "🔔 Подписка: ошибка загрузки"
 
-@sync_error_handler    
-def get_subscription_menu_text(user_id: int = None) -> str:
-    from database import get_user, is_subscription_active, get_user_active_discount
+@error_handler
+async def get_subscription_menu_text(user_id: int = None) -> str:
+    from async_database import get_user, is_subscription_active, get_user_active_discount
     from datetime import datetime
     
     # Проверяем наличие скидки у пользователя
     discount_info = ""
     if user_id:
-        discount = get_user_active_discount(user_id)
+        discount = await get_user_active_discount(user_id)
         if discount:
             discount_info = f"\n🎁 Активная скидка: {discount['discount_percent']}%"
 
     if user_id:
-        user = get_user(user_id)
+        user = await get_user(user_id)
         if user:
             current_sub = user.get('subscription_type', 'free')
-            active = is_subscription_active(user_id)
+            active = await is_subscription_active(user_id)
             
             # Если это максимальная подписка (Eclipse)
             if current_sub == 'tier3':
@@ -265,13 +261,13 @@ def get_return_to_main_message():
         "Используйте команду /start или кнопку ниже"
     )
 
-@sync_error_handler
-def get_referral_message(user_id: int) -> str:
+@error_handler
+async def get_referral_message(user_id: int) -> str:
     """Возвращает сообщение с реферальной ссылкой и статистикой"""
-    from database import get_referral_stats, get_user
+    from async_database import get_referral_stats, get_user
     
-    stats = get_referral_stats(user_id)
-    user = get_user(user_id)
+    stats = await get_referral_stats(user_id)
+    user = await get_user(user_id)
     referral_balance = user.get('referral_balance', 0) if user else 0
     
     withdraw_button = ""
@@ -0,0 +1,333 @@
+"""
+Версионные миграции схемы базы данных.
+
+Каждая миграция применяется один раз в отдельной транзакции, номер примененной
+версии записывается в таблицу schema_version. Новые таблицы, колонки и индексы
+добавляются только новой миграцией в конец списка MIGRATIONS.
+
+Проверка планов горячих запросов:
+    python migrations.py --check [путь к базе]
+Без пути проверка выполняется на пустой базе в памяти, созданной миграциями.
+"""
+import sqlite3
+import sys
+from typing import Callable, List, Tuple, Union
+
+Step = Union[str, Callable[[sqlite3.Connection], None]]
+
+
+def _add_referral_balance_column(conn: sqlite3.Connection):
+    # Старые базы создавались без реферального баланса
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(users)")]
+    if 'referral_balance' not in columns:
+        conn.execute(
+            "ALTER TABLE users ADD COLUMN referral_balance INTEGER DEFAULT 0")
+
+
+def _add_is_blocked_column(conn: sqlite3.Connection):
+    # Пользователь заблокировал бота: рассылки его пропускают
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(users)")]
+    if 'is_blocked' not in columns:
+        conn.execute(
+            "ALTER TABLE users ADD COLUMN is_blocked INTEGER DEFAULT 0")
+
+
+MIGRATIONS: List[Tuple[int, str, List[Step]]] = [
+    (1, "Базовая схема", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            full_name TEXT,
+            balance INTEGER DEFAULT 0,
+            referral_balance INTEGER DEFAULT 0,
+            mode TEXT DEFAULT 'chat',
+            subscription_type TEXT DEFAULT 'free',
+            subscription_expires DATETIME,
+            tokens_used_today INTEGER DEFAULT 0,
+            last_token_reset DATE DEFAULT CURRENT_DATE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS message_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            role TEXT,
+            message TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS admins (
+            user_id INTEGER PRIMARY KEY,
+            added_by INTEGER,
+            added_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS discount_codes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT UNIQUE NOT NULL,
+            discount_percent INTEGER NOT NULL,
+            max_uses INTEGER NOT NULL,
+            used_count INTEGER DEFAULT 0,
+            created_by INTEGER NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT 1
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_discounts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            discount_code TEXT NOT NULL,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            used BOOLEAN DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS referrals (
+            user_id INTEGER PRIMARY KEY,
+            referrer_id INTEGER,
+            registration_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (referrer_id) REFERENCES users (user_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS referral_payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            referrer_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            level INTEGER NOT NULL,
+            payment_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+            subscription_type TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (referrer_id) REFERENCES users (user_id)
+        )
+        """
+    ]),
+    (2, "Реферальный баланс у старых баз", [
+        _add_referral_balance_column
+    ]),
+    (3, "Индексы горячих запросов", [
+        # get_last_messages
+        "CREATE INDEX IF NOT EXISTS idx_message_logs_user_ts ON message_logs (user_id, timestamp)",
+        # get_referrals, get_referral_stats
+        "CREATE INDEX IF NOT EXISTS idx_referrals_referrer ON referrals (referrer_id)",
+        "CREATE INDEX IF NOT EXISTS idx_referral_payments_referrer_date ON referral_payments (referrer_id, payment_date)",
+        # get_user_active_discount
+        "CREATE INDEX IF NOT EXISTS idx_user_discounts_user_used ON user_discounts (user_id, used)",
+        # get_user_id_by_username
+        "CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users (username COLLATE NOCASE)"
+    ]),
+    (4, "Архив журнала сообщений", [
+        # Старые сообщения переносятся сюда из message_logs сжатыми пачками (retention.py)
+        """
+        CREATE TABLE IF NOT EXISTS message_archive (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            first_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL,
+            first_timestamp DATETIME,
+            last_timestamp DATETIME,
+            row_count INTEGER NOT NULL,
+            payload BLOB NOT NULL,
+            archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_message_archive_user ON message_archive (user_id, last_id)",
+        "CREATE INDEX IF NOT EXISTS idx_message_archive_last_ts ON message_archive (last_timestamp)"
+    ]),
+    (5, "Сводка старой части диалога", [
+        # Краткое содержание реплик до last_message_id включительно (context_summary.py)
+        """
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            user_id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            tokens INTEGER NOT NULL DEFAULT 0,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    ]),
+    (6, "Рассылки", [
+        _add_is_blocked_column,
+        # Задание рассылки и курсор обхода пользователей: шард и последний user_id (broadcast.py)
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            created_by INTEGER,
+            status TEXT NOT NULL DEFAULT 'running',
+            shard INTEGER NOT NULL DEFAULT 0,
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            progress_chat_id INTEGER,
+            progress_message_id INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs (status)",
+        # Итог по каждому получателю: после перезапуска отправленным повторно не пишем
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            job_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            sent_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (job_id, user_id)
+        )
+        """
+    ]),
+    (7, "Отложенное удаление сообщений", [
+        # Сообщения, которые нужно удалить в момент due_at (message_cleanup.py)
+        """
+        CREATE TABLE IF NOT EXISTS scheduled_deletions (
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            due_at REAL NOT NULL,
+            PRIMARY KEY (chat_id, message_id)
+        ) WITHOUT ROWID
+        """
+    ]),
+]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def run_migrations(conn: sqlite3.Connection) -> int:
+    """Применяет недостающие миграции и возвращает итоговую версию схемы"""
+    current = get_schema_version(conn)
+    for version, description, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            # IMMEDIATE - чтобы два процесса не применили одну миграцию одновременно
+            conn.execute("BEGIN IMMEDIATE")
+            applied = conn.execute(
+                "SELECT 1 FROM schema_version WHERE version = ?", (version,)).fetchone()
+            if not applied:
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                    (version, description)
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        current = version
+    return current
+
+
+# Горячие запросы: ни один не должен читать таблицу целиком
+HOT_QUERIES = [
+    ("get_user",
+     "SELECT * FROM users WHERE user_id = ?", (1,)),
+    ("get_last_messages", """
+        SELECT role, message FROM message_logs
+        WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?
+     """, (1, 10)),
+    ("get_messages_after", """
+        SELECT id, role, message FROM message_logs
+        WHERE user_id = ? AND id > ? ORDER BY timestamp, id LIMIT ?
+     """, (1, 0, 10)),
+    ("get_conversation_summary",
+     "SELECT * FROM conversation_summaries WHERE user_id = ?", (1,)),
+    ("get_referrals", """
+        SELECT user_id, registration_date FROM referrals
+        WHERE referrer_id = ?
+        ORDER BY registration_date DESC
+     """, (1,)),
+    ("get_referral_stats: referrals",
+     "SELECT user_id FROM referrals WHERE referrer_id = ?", (1,)),
+    ("get_referral_stats: total_earned",
+     "SELECT SUM(amount) as total FROM referral_payments WHERE referrer_id = ?", (1,)),
+    ("get_referral_stats: recent_payments", """
+        SELECT * FROM referral_payments
+        WHERE referrer_id = ?
+        ORDER BY payment_date DESC
+        LIMIT 5
+     """, (1,)),
+    ("_get_users_by_ids",
+     "SELECT * FROM users WHERE user_id IN (?, ?, ?)", (1, 2, 3)),
+    ("get_user_active_discount", """
+        SELECT * FROM user_discounts WHERE user_id = ? AND used = 0
+     """, (1,)),
+    ("get_user_active_discount: code", """
+        SELECT discount_percent FROM discount_codes WHERE code = ? AND is_active = 1
+     """, ("CODE",)),
+    ("get_user_id_by_username",
+     "SELECT user_id FROM users WHERE username = ? COLLATE NOCASE", ("name",)),
+    ("get_broadcast_page", """
+        SELECT user_id FROM users
+        WHERE user_id > ? AND is_blocked = 0 ORDER BY user_id LIMIT ?
+     """, (0, 500)),
+    ("get_broadcast_recipients_done", """
+        SELECT user_id FROM broadcast_recipients
+        WHERE job_id = ? AND user_id BETWEEN ? AND ?
+     """, (1, 1, 500)),
+    ("get_broadcast_jobs",
+     "SELECT * FROM broadcast_jobs WHERE status IN (?, ?) ORDER BY id", ("running", "paused")),
+    ("remove_scheduled_deletion",
+     "DELETE FROM scheduled_deletions WHERE chat_id = ? AND message_id = ?", (1, 1)),
+]
+
+
+def find_full_scans(conn: sqlite3.Connection, queries=None) -> List[str]:
+    """Возвращает описания горячих запросов, план которых содержит полное сканирование"""
+    problems = []
+    for name, sql, params in (queries or HOT_QUERIES):
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        for row in plan:
+            detail = row[-1]
+            if detail.startswith("SCAN"):
+                problems.append(f"{name}: {detail}")
+    return problems
+
+
+def check_hot_query_plans(conn: sqlite3.Connection, queries=None):
+    """Падает с RuntimeError, если какой-либо горячий запрос делает полное сканирование"""
+    problems = find_full_scans(conn, queries)
+    if problems:
+        raise RuntimeError(
+            "Полное сканирование в горячих запросах:\n" + "\n".join(problems))
+
+
+if __name__ == "__main__":
+    database = sys.argv[2] if len(sys.argv) > 2 else ":memory:"
+    if len(sys.argv) < 2 or sys.argv[1] != "--check":
+        print("Использование: python migrations.py --check [путь к базе]")
+        sys.exit(2)
+
+    conn = sqlite3.connect(database)
+    version = run_migrations(conn)
+    print(f"Версия схемы: {version}")
+    try:
+        check_hot_query_plans(conn)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print(f"✅ Все {len(HOT_QUERIES)} горячих запросов используют индексы")
@@ -1,11 +1,12 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Message
 from aiogram import F
-from database import update_purchase_balance, update_referral_balance, transfer_referral_to_purchase_balance, get_user
+from async_database import update_purchase_balance, get_user
 from shared import bot, dp
 from messages import get_profile_text, get_subscription_info_text
 from datetime import datetime
 from config import ROOT_ADMIN_ID, TIMEZONE
 from error_handler import error_handler, sync_error_handler
+from message_cleanup import deletion_scheduler
 import re
 import asyncio
 
@@ -39,10 +40,10 @@ def get_profile_keyboard(user_id: int) -> InlineKeyboardMarkup:
 @error_handler
 async def show_referral_program(callback: CallbackQuery):
     from messages import get_referral_message
-    from database import get_user
+    from async_database import get_user
 
     try:
-        user = get_user(callback.from_user.id)
+        user = await get_user(callback.from_user.id)
         if not user:
             await callback.answer("Пользователь не найден", show_alert=True)
             return
@@ -64,7 +65,7 @@ async def show_referral_program(callback: CallbackQuery):
             text="🔙 Назад", callback_data="back_to_profile")])
 
         msg = await callback.message.edit_text(
-            text=get_referral_message(callback.from_user.id),
+            text=await get_referral_message(callback.from_user.id),
             reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
         )
 
@@ -80,7 +81,7 @@ async def show_referral_program(callback: CallbackQuery):
 @error_handler
 async def handle_exchange_referral_balance(callback: CallbackQuery):
     """Обработчик обмена реферального баланса на баланс покупок"""
-    from database import get_user, transfer_referral_to_purchase_balance
+    from async_database import get_user, transfer_referral_to_purchase_balance
     from messages import get_referral_message
 
     user_id = callback.from_user.id
@@ -96,7 +97,7 @@ async def handle_exchange_referral_balance(callback: CallbackQuery):
         return
 
     try:
-        user = get_user(user_id)
+        user = await get_user(user_id)
         if not user:
             await callback.answer("Пользователь не найден", show_alert=True)
             return
@@ -108,11 +109,11 @@ async def handle_exchange_referral_balance(callback: CallbackQuery):
             return
 
         # Переводим все средства с реферального баланса на баланс покупок
-        if transfer_referral_to_purchase_balance(user_id, referral_balance):
+        if await transfer_referral_to_purchase_balance(user_id, referral_balance):
             await callback.answer(f"✅ Успешно переведено {referral_balance} руб. с реферального баланса на баланс покупок!", show_alert=True)
 
             # Обновляем сообщение реферальной программы
-            user = get_user(user_id)  # Получаем обновленные данные
+            user = await get_user(user_id)  # Получаем обновленные данные
             keyboard_buttons = []
             if referral_balance > 0:
                 keyboard_buttons.append([InlineKeyboardButton(
@@ -123,7 +124,7 @@ async def handle_exchange_referral_balance(callback: CallbackQuery):
                 text="🔙 Назад", callback_data="back_to_profile")])
 
             msg = await callback.message.edit_text(
-                text=get_referral_message(user_id),
+                text=await get_referral_message(user_id),
                 reply_markup=InlineKeyboardMarkup(
                     inline_keyboard=keyboard_buttons)
             )
@@ -151,7 +152,7 @@ async def show_clean_profile_menu(callback: CallbackQuery):
         await callback.answer("Пожалуйста, используйте актуальное меню. Повторите действие.", show_alert=True)
         return
 
-    user = get_user(callback.from_user.id)
+    user = await get_user(callback.from_user.id)
     if not user:
         try:
             msg = await callback.message.edit_text(
@@ -336,11 +337,7 @@ async def process_deposit_amount(message: Message):
             )
             user_states[user_id] = "waiting_for_amount"  # Возвращаем состояние
             # Удаляем сообщение об ошибке через 3 секунды
-            await asyncio.sleep(3)
-            try:
-                await error_msg.delete()
-            except:
-                pass
+            await deletion_scheduler.schedule(error_msg.chat.id, error_msg.message_id, 3)
             return
 
         amount = int(amount_match.group())
@@ -353,11 +350,7 @@ async def process_deposit_amount(message: Message):
             )
             user_states[user_id] = "waiting_for_amount"  # Возвращаем состояние
             # Удаляем сообщение об ошибке через 3 секунды
-            await asyncio.sleep(3)
-            try:
-                await error_msg.delete()
-            except:
-                pass
+            await deletion_scheduler.schedule(error_msg.chat.id, error_msg.message_id, 3)
             return
 
         if amount > 15000:
@@ -367,11 +360,7 @@ async def process_deposit_amount(message: Message):
             )
             user_states[user_id] = "waiting_for_amount"  # Возвращаем состояние
             # Удаляем сообщение об ошибке через 3 секунды
-            await asyncio.sleep(3)
-            try:
-                await error_msg.delete()
-            except:
-                pass
+            await deletion_scheduler.schedule(error_msg.chat.id, error_msg.message_id, 3)
             return
 
         # Создаем платеж через ЮKassa
@@ -436,11 +425,7 @@ async def process_deposit_amount(message: Message):
         )
         user_states[user_id] = "waiting_for_amount"  # Возвращаем состояние
         # Удаляем сообщение об ошибке через 3 секунды
-        await asyncio.sleep(3)
-        try:
-            await error_msg.delete()
-        except:
-            pass
+        await deletion_scheduler.schedule(error_msg.chat.id, error_msg.message_id, 3)
     except Exception as e:
         print(f"Ошибка при обработке суммы пополнения: {e}")
         error_msg = await message.answer(
@@ -548,7 +533,7 @@ async def handle_successful_payment(payment_info: dict, payment_id: str):
         amount = payment_info['amount']
 
         # Обновляем баланс пользователя
-        update_purchase_balance(user_id, amount)
+        await update_purchase_balance(user_id, amount)
 
         # 1. Удаляем сообщение о платеже (если знаем его ID)
         if payment_message_id:
@@ -570,7 +555,7 @@ async def handle_successful_payment(payment_info: dict, payment_id: str):
 
         # 3. Сразу показываем профиль
         try:
-            user = get_user(user_id)
+            user = await get_user(user_id)
             if user:
                 from messages import get_profile_text, get_subscription_info_text
                 profile_text = get_profile_text(user)
@@ -594,12 +579,7 @@ async def handle_successful_payment(payment_info: dict, payment_id: str):
 
         # 4. Удаляем уведомление об успехе через 3 секунды (если оно было отправлено)
         if success_msg:
-            await asyncio.sleep(3)
-            try:
-                await success_msg.delete()
-                print("Уведомление об успехе удалено")
-            except Exception as e:
-                print(f"Не удалось удалить уведомление об успехе: {e}")
+            await deletion_scheduler.schedule(chat_id, success_msg.message_id, 3)
 
         # Удаляем информацию о платеже
         if payment_id in payment_checks:
@@ -634,9 +614,7 @@ async def handle_canceled_payment(payment_info: dict, payment_id: str):
             pass
 
         # Удаляем информацию о платеже через 30 секунд
-        await asyncio.sleep(30)
-        if payment_id in payment_checks:
-            del payment_checks[payment_id]
+        asyncio.get_running_loop().call_later(30, payment_checks.pop, payment_id, None)
 
     except Exception as e:
         print(f"Ошибка при обработке отмененного платежа: {e}")
@@ -645,7 +623,7 @@ async def handle_canceled_payment(payment_info: dict, payment_id: str):
 @error_handler
 async def handle_referral_withdrawal_request(callback: CallbackQuery):
     """Обработчик запроса на вывод реферальных средств"""
-    from database import get_user
+    from async_database import get_user
 
     # Проверяем, является ли это сообщение активным
     if callback.from_user.id in active_user_messages and active_user_messages[callback.from_user.id] != callback.message.message_id:
@@ -658,7 +636,7 @@ async def handle_referral_withdrawal_request(callback: CallbackQuery):
         return
 
     user_id = callback.from_user.id
-    user = get_user(user_id)
+    user = await get_user(user_id)
 
     if not user:
         await callback.answer("Пользователь не найден", show_alert=True)
@@ -728,18 +706,14 @@ async def process_referral_withdrawal_amount(message: Message):
             )
             user_states[user_id] = 'waiting_for_withdrawal_amount'
             # Удаляем сообщение об ошибке через 3 секунды
-            await asyncio.sleep(3)
-            try:
-                await error_msg.delete()
-            except:
-                pass
+            await deletion_scheduler.schedule(error_msg.chat.id, error_msg.message_id, 3)
             return
 
         amount = int(amount_match.group())
 
         # Получаем баланс пользователя
-        from database import get_user
-        user = get_user(user_id)
+        from async_database import get_user
+        user = await get_user(user_id)
         if not user:
             error_msg = await message.answer("Пользователь не найден")
             # Сохраняем ID активного сообщения
@@ -756,11 +730,7 @@ async def process_referral_withdrawal_amount(message: Message):
             )
             user_states[user_id] = 'waiting_for_withdrawal_amount'
             # Удаляем сообщение об ошибке через 3 секунды
-            await asyncio.sleep(3)
-            try:
-                await error_msg.delete()
-            except:
-                pass
+            await deletion_scheduler.schedule(error_msg.chat.id, error_msg.message_id, 3)
             return
 
         # Проверяем, достаточно ли средств
@@ -772,17 +742,13 @@ async def process_referral_withdrawal_amount(message: Message):
             )
             user_states[user_id] = 'waiting_for_withdrawal_amount'
             # Удаляем сообщение об ошибке через 3 секунды
-            await asyncio.sleep(3)
-            try:
-                await error_msg.delete()
-            except:
-                pass
+            await deletion_scheduler.schedule(error_msg.chat.id, error_msg.message_id, 3)
             return
 
         # Здесь должна быть логика вывода средств
         # Пока просто вычтем сумму из реферального баланса
-        from database import update_referral_balance
-        update_referral_balance(user_id, -amount)
+        from async_database import update_referral_balance
+        await update_referral_balance(user_id, -amount)
 
         # Отправляем уведомление администратору (здесь должна быть реальная логика вывода)
         try:
@@ -819,11 +785,7 @@ async def process_referral_withdrawal_amount(message: Message):
         )
         user_states[user_id] = 'waiting_for_withdrawal_amount'
         # Удаляем сообщение об ошибке через 3 секунды
-        await asyncio.sleep(3)
-        try:
-            await error_msg.delete()
-        except:
-            pass
+        await deletion_scheduler.schedule(error_msg.chat.id, error_msg.message_id, 3)
     except Exception as e:
         print(f"Ошибка при обработке суммы вывода: {e}")
         error_msg = await message.answer(
@@ -841,7 +803,7 @@ async def process_referral_withdrawal_amount(message: Message):
 async def show_clean_profile_menu_from_message(message: Message):
     """Показать чистое меню профиля из текстового сообщения"""
     from messages import get_profile_text, get_subscription_info_text
-    user = get_user(message.from_user.id)
+    user = await get_user(message.from_user.id)
     if not user:
         error_msg = await message.answer("Сначала запустите бота командой /start")
         # Сохраняем ID активного сообщения
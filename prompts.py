@@ -0,0 +1,99 @@
+"""
+Системные промпты режимов и сборка запроса к модели.
+
+Промпт каждого режима (BASE_SYSTEM_PROMPT + MODEL_PROMPTS[mode]) собирается
+один раз при импорте вместе с оценкой числа токенов и хэшем для ключа кэша
+ответов, поэтому на запрос не тратятся ни склейка строк, ни подсчет токенов.
+Режим пользователя берется из записи users, которая читается через кэш
+(database.get_user), а смена режима обновляет запись в кэше, не сбрасывая ее.
+
+Системный промпт - стабильное начало каждого запроса в режиме. Модели Anthropic
+и Google кэшируют начало запроса на стороне провайдера, только если оно
+помечено cache_control (OpenAI и DeepSeek кэшируют сами, без пометок). Для
+таких моделей (LLM_PROMPT_CACHE_MODEL_PREFIXES) providers.py заменяет
+системный промпт заранее собранной версией с пометкой - если промпт не короче
+LLM_PROMPT_CACHE_MIN_TOKENS: более короткое начало провайдеры не кэшируют.
+"""
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+from config import (
+    LLM_PROMPT_CACHE_ENABLED,
+    LLM_PROMPT_CACHE_MODEL_PREFIXES,
+    LLM_PROMPT_CACHE_MIN_TOKENS
+)
+from context_summary import SUMMARY_HEADER
+from quota import estimate_tokens, MESSAGE_OVERHEAD_TOKENS
+
+BASE_SYSTEM_PROMPT = "Ты умный, дружелюбный ассистент. Отвечай кратко, на русском языке."
+
+MODEL_PROMPTS = {
+    "teacher": "Ты опытный учитель с 20-летним стажем...",
+    "content_manager": "Ты профессиональный контент-менеджер...",
+    "editor": "Ты профессиональный редактор текстов...",
+    "chat": "Ты дружелюбный собеседник..."
+}
+DEFAULT_MODE = "chat"
+
+
+class PromptTemplate:
+    __slots__ = ("mode", "text", "tokens", "hash", "message", "cached_message")
+
+    def __init__(self, mode: str, text: str):
+        self.mode = mode
+        self.text = text
+        self.tokens = estimate_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+        self.hash = hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+        self.message = {"role": "system", "content": text}
+        # То же сообщение в виде частей с пометкой для кэша провайдера
+        self.cached_message = {"role": "system", "content": [
+            {"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}
+        ]}
+
+
+def compile_prompts(base: str = BASE_SYSTEM_PROMPT,
+                    prompts: Dict[str, str] = None) -> Dict[str, PromptTemplate]:
+    return {mode: PromptTemplate(mode, f"{base}\n\n{text}")
+            for mode, text in (prompts or MODEL_PROMPTS).items()}
+
+
+TEMPLATES = compile_prompts()
+# Системный промпт по тексту - чтобы узнать его в уже собранном запросе
+_BY_TEXT = {template.text: template for template in TEMPLATES.values()}
+
+
+def is_known_mode(mode: str) -> bool:
+    return mode in TEMPLATES
+
+
+def template_for(mode: Optional[str]) -> PromptTemplate:
+    return TEMPLATES.get(mode) or TEMPLATES[DEFAULT_MODE]
+
+
+def build_messages(template: PromptTemplate, summary: Optional[str], history: List[Dict],
+                   text: str) -> Tuple[List[Dict], int]:
+    """Запрос к модели и оценка его размера в токенах (промпт режима посчитан заранее)"""
+    messages = [template.message]
+    tokens = template.tokens
+    if summary:
+        messages.append({"role": "system", "content": SUMMARY_HEADER + summary})
+    messages += [{"role": item['role'], "content": item['message']} for item in history]
+    messages.append({"role": "user", "content": text})
+    for message in messages[1:]:
+        tokens += estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+    return messages, tokens
+
+
+def supports_cache_control(model: str) -> bool:
+    return LLM_PROMPT_CACHE_ENABLED and model.startswith(LLM_PROMPT_CACHE_MODEL_PREFIXES)
+
+
+def mark_cache_prefix(messages: List[Dict], model: str) -> List[Dict]:
+    """Помечает системный промпт режима для кэша провайдера, если модель это поддерживает"""
+    if not messages or not supports_cache_control(model):
+        return messages
+    content = messages[0].get("content")
+    template = _BY_TEXT.get(content) if isinstance(content, str) else None
+    if template is None or template.tokens < LLM_PROMPT_CACHE_MIN_TOKENS:
+        return messages
+    return [template.cached_message] + messages[1:]
@@ -0,0 +1,323 @@
+"""
+Несколько моделей за одним интерфейсом: переключение при сбоях и дублирующие запросы.
+
+Модели из LLM_MODELS перебираются по порядку. У каждой свое состояние:
+скользящее окно времени до первого токена (TTFT) и счетчик ошибок подряд.
+После LLM_MODEL_FAILURE_THRESHOLD ошибок модель уходит на паузу
+(LLM_MODEL_COOLDOWN, дальше удваивается), ответ 429 ставит ее на паузу сразу.
+На паузе модель пробуется только тогда, когда здоровых не осталось.
+
+Если модель не прислала первый токен за свой p95 TTFT, запускается дублирующий
+запрос к следующей модели. Ответ берется у той, что заговорит первой,
+остальные запросы отменяются. Если модель упала до первого токена, запрос
+молча уходит к следующей. После первого токена текст уже показан пользователю,
+и ошибка пробрасывается как LLMError.
+
+Запросы к каждой модели проходят через ее TokenBucket (ratelimit.py), а весь
+маршрутизатор - через CircuitBreaker: если ни одна модель не отвечает,
+запросы на время перестают отправляться.
+
+Каждая попытка идет в своей задаче и передает фрагменты через очередь: так
+таймауты aiohttp остаются привязаны к задаче, которая владеет соединением.
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional
+
+from config import (
+    OPENROUTER_URL,
+    LLM_MODELS,
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_MAX_PARALLEL,
+    LLM_HEDGE_DEFAULT_DELAY,
+    LLM_HEDGE_MIN_DELAY,
+    LLM_TTFT_WINDOW,
+    LLM_TTFT_MIN_SAMPLES,
+    LLM_MODEL_FAILURE_THRESHOLD,
+    LLM_MODEL_COOLDOWN,
+    LLM_MODEL_MAX_COOLDOWN,
+    LLM_RATE_LIMIT_RPM,
+    LLM_RATE_LIMIT_BURST,
+    LLM_RATE_LIMIT_MAX_WAIT,
+    LLM_RATE_LIMIT_BACKOFF
+)
+from llm import stream_chat, LLMError
+from prompts import mark_cache_prefix
+from ratelimit import TokenBucket, CircuitBreaker, LLMBusy
+
+_DONE = object()
+
+
+class ModelEndpoint:
+    """Модель у конкретного API и ее здоровье"""
+
+    def __init__(self, model: str, url: str = OPENROUTER_URL, api_key: Optional[str] = None,
+                 rpm: float = LLM_RATE_LIMIT_RPM, burst: int = LLM_RATE_LIMIT_BURST,
+                 window: int = LLM_TTFT_WINDOW):
+        self.model = model
+        self.url = url
+        self.api_key = api_key
+        self.ttft: Deque[float] = deque(maxlen=window)
+        self.limiter = TokenBucket(rpm, burst)
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.hedged = 0         # Запущена как дублирующая
+        self.hedge_wins = 0     # Дублирующий запрос ответил первым
+        self.last_error: Optional[str] = None
+
+    def available(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+    def ttft_quantile(self, q: float) -> Optional[float]:
+        if not self.ttft:
+            return None
+        ordered = sorted(self.ttft)
+        return ordered[min(math.ceil(q * len(ordered)) - 1, len(ordered) - 1)]
+
+    def hedge_delay(self, min_samples: int = LLM_TTFT_MIN_SAMPLES) -> float:
+        if len(self.ttft) < min_samples:
+            return LLM_HEDGE_DEFAULT_DELAY
+        return max(self.ttft_quantile(0.95), LLM_HEDGE_MIN_DELAY)
+
+    def record_success(self, ttft: float):
+        self.ttft.append(ttft)
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    def record_failure(self, error: Exception):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = str(error)[:200]
+        if isinstance(error, LLMError) and error.status == 429:
+            # Провайдер сам сказал, сколько ждать: столько модель и отдыхает
+            self.limiter.block(error.retry_after)
+            retry_after = LLM_RATE_LIMIT_BACKOFF if error.retry_after is None else error.retry_after
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + retry_after)
+        elif self.consecutive_failures >= LLM_MODEL_FAILURE_THRESHOLD:
+            # Пауза растет вдвое с каждой ошибкой сверх порога
+            extra = max(self.consecutive_failures - LLM_MODEL_FAILURE_THRESHOLD, 0)
+            cooldown = min(LLM_MODEL_COOLDOWN * 2 ** extra, LLM_MODEL_MAX_COOLDOWN)
+            self.cooldown_until = time.monotonic() + cooldown
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        return {
+            'model': self.model,
+            'available': self.available(now),
+            'cooldown_left': round(max(self.cooldown_until - now, 0), 1),
+            'requests': self.requests,
+            'successes': self.successes,
+            'failures': self.failures,
+            'hedged': self.hedged,
+            'hedge_wins': self.hedge_wins,
+            'ttft_p50': self.ttft_quantile(0.5),
+            'ttft_p95': self.ttft_quantile(0.95),
+            'last_error': self.last_error,
+            'limiter': self.limiter.stats()
+        }
+
+
+class _Attempt:
+    """Один запрос к одной модели; фрагменты ответа складываются в очередь"""
+
+    def __init__(self, endpoint: ModelEndpoint, messages: List[Dict], max_tokens: Optional[int],
+                 hedge: bool):
+        self.endpoint = endpoint
+        self.hedge = hedge
+        self.usage: Dict = {}
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.head = None                # Первый элемент очереди: фрагмент, _DONE или исключение
+        self.started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        self.first = loop.create_future()
+        self.task = loop.create_task(self._run(messages, max_tokens))
+        endpoint.requests += 1
+        if hedge:
+            endpoint.hedged += 1
+
+    def _put(self, item):
+        if not self.first.done():
+            self.first.set_result(time.monotonic() - self.started)
+        self.queue.put_nowait(item)
+
+    async def _run(self, messages: List[Dict], max_tokens: Optional[int]):
+        try:
+            # Пометка для кэша провайдера зависит от модели, поэтому ставится на каждую попытку
+            messages = mark_cache_prefix(messages, self.endpoint.model)
+            async for delta in stream_chat(messages, model=self.endpoint.model, max_tokens=max_tokens,
+                                           usage=self.usage, url=self.endpoint.url,
+                                           api_key=self.endpoint.api_key,
+                                           on_headers=self.endpoint.limiter.observe):
+                self._put(delta)
+            self._put(_DONE)
+        except asyncio.CancelledError:
+            raise
+        except LLMError as e:
+            self._put(e)
+        except Exception as e:
+            # Сетевые ошибки и таймауты - тоже сбой модели, снаружи они выглядят как LLMError
+            self._put(LLMError(f"{self.endpoint.model}: {type(e).__name__}: {e}"))
+
+    def cancel(self):
+        if not self.task.done():
+            self.task.cancel()
+
+
+class ModelRouter:
+    def __init__(self, models: List[Dict] = None, hedge: bool = LLM_HEDGE_ENABLED,
+                 max_parallel: int = LLM_HEDGE_MAX_PARALLEL,
+                 max_wait: float = LLM_RATE_LIMIT_MAX_WAIT):
+        self.endpoints = [ModelEndpoint(item["model"], item.get("url") or OPENROUTER_URL,
+                                        item.get("api_key"),
+                                        item.get("rpm", LLM_RATE_LIMIT_RPM),
+                                        item.get("burst", LLM_RATE_LIMIT_BURST))
+                          for item in (models or LLM_MODELS)]
+        self.hedge = hedge
+        self.max_parallel = max_parallel
+        self.max_wait = max_wait
+        self.breaker = CircuitBreaker()
+
+        self.requests = 0
+        self.failovers = 0
+        self.hedges = 0
+        self.exhausted = 0
+        self.throttled = 0
+
+    def candidates(self) -> List[ModelEndpoint]:
+        """Здоровые модели по порядку, за ними - стоящие на паузе (ближайшая к концу паузы первой)"""
+        now = time.monotonic()
+        healthy = [endpoint for endpoint in self.endpoints if endpoint.available(now)]
+        resting = sorted((endpoint for endpoint in self.endpoints if not endpoint.available(now)),
+                         key=lambda endpoint: endpoint.cooldown_until)
+        return healthy + resting
+
+    async def stream(self, messages: List[Dict], max_tokens: Optional[int] = None,
+                     usage: Optional[Dict] = None) -> AsyncIterator[str]:
+        """
+        Как llm.stream_chat, но с переключением моделей; в usage['model'] - модель, давшая ответ.
+        LLMBusy - запрос не отправлялся: сработал выключатель или исчерпаны лимиты всех моделей.
+        """
+        self.requests += 1
+        if not self.breaker.allow():
+            raise LLMBusy("Модели недоступны, запросы временно не отправляются")
+
+        pool: List[ModelEndpoint] = self.candidates()
+        running: List[_Attempt] = []
+        winner: Optional[_Attempt] = None
+        last_error: Optional[Exception] = None
+        can_hedge = self.hedge
+        settled = False
+
+        async def launch(hedge: bool) -> bool:
+            # Сначала модель, у которой токен есть прямо сейчас, - так лимит одной модели
+            # превращается в переключение на следующую, а не в ожидание
+            for endpoint in pool:
+                if endpoint.limiter.delay() == 0:
+                    pool.remove(endpoint)
+                    await endpoint.limiter.acquire(0)
+                    running.append(_Attempt(endpoint, messages, max_tokens, hedge))
+                    return True
+            if hedge or not pool:
+                return False
+            endpoint = min(pool, key=lambda item: item.limiter.delay())
+            pool.remove(endpoint)
+            if not await endpoint.limiter.acquire(self.max_wait):
+                self.throttled += 1
+                return False
+            running.append(_Attempt(endpoint, messages, max_tokens, hedge))
+            return True
+
+        try:
+            while winner is None:
+                if not running:
+                    if last_error is not None:
+                        self.failovers += 1
+                    if not await launch(hedge=False):
+                        if last_error is None:
+                            raise LLMBusy("Лимит запросов ко всем моделям исчерпан")
+                        self.exhausted += 1
+                        settled = True
+                        self.breaker.record_failure()
+                        raise last_error
+
+                # Дублирующий запрос - когда самая ранняя попытка дольше своего p95 TTFT
+                timeout = None
+                if can_hedge and len(running) < self.max_parallel:
+                    primary = running[0]
+                    timeout = max(primary.endpoint.hedge_delay() - (time.monotonic() - primary.started), 0)
+
+                done, _ = await asyncio.wait([attempt.first for attempt in running], timeout=timeout,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if await launch(hedge=True):
+                        self.hedges += 1
+                    else:
+                        # Моделей больше нет: просто ждем тех, что уже работают
+                        can_hedge = False
+                    continue
+
+                for attempt in list(running):
+                    if not attempt.first.done():
+                        continue
+                    attempt.head = attempt.queue.get_nowait()
+                    if isinstance(attempt.head, Exception):
+                        attempt.endpoint.record_failure(attempt.head)
+                        running.remove(attempt)
+                        last_error = attempt.head
+                        continue
+                    winner = attempt
+                    break
+
+            # Отвечает первая заговорившая модель; остальные попытки отменяются
+            winner_ttft = winner.first.result()
+            for attempt in running:
+                if attempt is not winner:
+                    attempt.cancel()
+                    # Попытка, ждавшая дольше победителя, дает нижнюю оценку своего TTFT - без нее
+                    # p95 занижался бы. Поздно запущенный дубль о своей модели ничего не говорит
+                    elapsed = time.monotonic() - attempt.started
+                    if elapsed > winner_ttft:
+                        attempt.endpoint.ttft.append(elapsed)
+            winner.endpoint.record_success(winner_ttft)
+            settled = True
+            self.breaker.record_success()
+            if winner.hedge:
+                winner.endpoint.hedge_wins += 1
+
+            item = winner.head
+            while item is not _DONE:
+                if isinstance(item, Exception):
+                    winner.endpoint.record_failure(item)
+                    raise item
+                yield item
+                item = await winner.queue.get()
+
+            if usage is not None:
+                usage.update(winner.usage)
+                usage['model'] = winner.endpoint.model
+        finally:
+            for attempt in running:
+                attempt.cancel()
+            if not settled:
+                self.breaker.record_cancelled()
+
+    def stats(self) -> Dict:
+        return {
+            'requests': self.requests,
+            'failovers': self.failovers,
+            'hedges': self.hedges,
+            'exhausted': self.exhausted,
+            'throttled': self.throttled,
+            'breaker': self.breaker.stats(),
+            'models': [endpoint.stats() for endpoint in self.endpoints]
+        }
+
+
+model_router = ModelRouter()
@@ -0,0 +1,233 @@
+"""
+Учет токенов и дневные лимиты подписок.
+
+Перед запросом к модели quota.reserve оценивает размер запроса, проверяет
+остаток дневного лимита и резервирует под ответ max_tokens, вычисленный из
+этого остатка. Если места не осталось, QuotaExceeded выбрасывается до любого
+сетевого вызова. После ответа commit списывает фактически потраченные токены
+и возвращает неиспользованную часть резерва, release - возвращает резерв целиком.
+
+Счетчики держатся в памяти: резервирование и списание - это операции над словарем
+в event loop, без обращений к БД. Раз в QUOTA_FLUSH_INTERVAL секунд накопленный
+расход каждого пользователя пишется в users одним UPDATE, который заодно
+обнуляет счетчик при смене дня (database.add_token_usage).
+
+По умолчанию в лимит входят только токены ответа (QUOTA_CHARGE_PROMPT_TOKENS):
+так лимиты совпадают с тем, что видит пользователь, - у Zenith Spark 20 токенов
+в день иначе не хватило бы даже на вопрос.
+"""
+import asyncio
+import math
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from config import (
+    DAILY_TOKEN_LIMITS,
+    QUOTA_CHARGE_PROMPT_TOKENS,
+    QUOTA_MIN_COMPLETION_TOKENS,
+    LLM_MAX_COMPLETION_TOKENS,
+    QUOTA_FLUSH_INTERVAL
+)
+from async_database import get_user, is_subscription_active, add_token_usage
+
+# Служебные токены, которые модель добавляет к каждому сообщению запроса
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Быстрая оценка числа токенов: ~4 символа латиницы или ~2.5 символа кириллицы на токен"""
+    if not text:
+        return 0
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    other_chars = len(text) - ascii_chars
+    return math.ceil(ascii_chars / 4 + other_chars / 2.5)
+
+
+def estimate_prompt_tokens(messages: List[Dict]) -> int:
+    return sum(estimate_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+               for message in messages)
+
+
+async def tier_for(user_id: int) -> str:
+    """Действующая подписка пользователя: истекшая считается бесплатной"""
+    user = await get_user(user_id)
+    sub_type = (user.get('subscription_type') if user else None) or 'free'
+    if sub_type != 'free' and not await is_subscription_active(user_id):
+        sub_type = 'free'
+    return sub_type
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, user_id: int, limit: int, used: int):
+        super().__init__(f"Дневной лимит токенов исчерпан: {used}/{limit}")
+        self.user_id = user_id
+        self.limit = limit
+        self.used = used
+
+
+class Reservation:
+    __slots__ = ("user_id", "day", "tokens", "max_tokens", "prompt_tokens")
+
+    def __init__(self, user_id: int, day: str, tokens: int, max_tokens: int, prompt_tokens: int):
+        self.user_id = user_id
+        self.day = day
+        self.tokens = tokens
+        self.max_tokens = max_tokens
+        self.prompt_tokens = prompt_tokens
+
+
+class _Counter:
+    __slots__ = ("day", "used", "reserved", "unflushed")
+
+    def __init__(self, day: str, used: int):
+        self.day = day
+        self.used = used        # Списано за день (включая еще не записанное в БД)
+        self.reserved = 0       # Зарезервировано под идущие сейчас ответы
+        self.unflushed = 0      # Списано, но еще не записано в БД
+
+
+def _today() -> str:
+    return datetime.now().date().isoformat()
+
+
+class QuotaEngine:
+    def __init__(self, limits: Dict[str, int] = None, charge_prompt: bool = QUOTA_CHARGE_PROMPT_TOKENS,
+                 min_completion: int = QUOTA_MIN_COMPLETION_TOKENS,
+                 max_completion: int = LLM_MAX_COMPLETION_TOKENS,
+                 flush_interval: float = QUOTA_FLUSH_INTERVAL):
+        self.limits = limits or DAILY_TOKEN_LIMITS
+        self.charge_prompt = charge_prompt
+        self.min_completion = min_completion
+        self.max_completion = max_completion
+        self.flush_interval = flush_interval
+
+        self._counters: Dict[int, _Counter] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+        self.reservations = 0
+        self.rejections = 0
+        self.flushes = 0
+
+    async def _counter(self, user_id: int) -> _Counter:
+        today = _today()
+        counter = self._counters.get(user_id)
+        if counter is None:
+            user = await get_user(user_id)
+            used = 0
+            if user and user.get('last_token_reset') == today:
+                used = user.get('tokens_used_today') or 0
+            # Пока шел запрос к БД, счетчик мог создать параллельный вызов
+            counter = self._counters.setdefault(user_id, _Counter(today, used))
+        if counter.day != today:
+            # Новый день. Счетчик переводится до записи в БД: параллельный вызов
+            # не запишет вчерашний расход второй раз, а commit во время записи не потеряется.
+            # Резервы вчерашних ответов обнуляются - их commit/release счетчик уже не тронут
+            day, tokens = counter.day, counter.unflushed
+            counter.day = today
+            counter.used = 0
+            counter.reserved = 0
+            counter.unflushed = 0
+            if tokens:
+                await add_token_usage(user_id, tokens, day)
+        return counter
+
+    async def limit_for(self, user_id: int) -> int:
+        return self.limits.get(await tier_for(user_id), self.limits['free'])
+
+    async def remaining(self, user_id: int) -> int:
+        counter = await self._counter(user_id)
+        return max(await self.limit_for(user_id) - counter.used - counter.reserved, 0)
+
+    async def reserve(self, user_id: int, messages: List[Dict],
+                      prompt_tokens: Optional[int] = None) -> Reservation:
+        """Резервирует токены под ответ или выбрасывает QuotaExceeded; prompt_tokens - готовая оценка запроса"""
+        limit = await self.limit_for(user_id)
+        counter = await self._counter(user_id)
+        if prompt_tokens is None:
+            prompt_tokens = estimate_prompt_tokens(messages)
+
+        available = limit - counter.used - counter.reserved
+        if self.charge_prompt:
+            available -= prompt_tokens
+        max_tokens = min(available, self.max_completion)
+        if max_tokens < self.min_completion:
+            self.rejections += 1
+            raise QuotaExceeded(user_id, limit, counter.used)
+
+        tokens = max_tokens + (prompt_tokens if self.charge_prompt else 0)
+        counter.reserved += tokens
+        self.reservations += 1
+        return Reservation(user_id, counter.day, tokens, max_tokens, prompt_tokens)
+
+    def commit(self, reservation: Reservation, completion_tokens: int,
+               prompt_tokens: Optional[int] = None):
+        """Списывает фактический расход и освобождает резерв"""
+        spent = completion_tokens
+        if self.charge_prompt:
+            spent += prompt_tokens if prompt_tokens is not None else reservation.prompt_tokens
+        counter = self._counters.get(reservation.user_id)
+        if counter is None:
+            return
+        self._unreserve(counter, reservation)
+        if counter.day == reservation.day:
+            counter.used += spent
+            counter.unflushed += spent
+
+    def release(self, reservation: Reservation):
+        """Освобождает резерв целиком (ответа не было)"""
+        counter = self._counters.get(reservation.user_id)
+        if counter is not None:
+            self._unreserve(counter, reservation)
+
+    def _unreserve(self, counter: _Counter, reservation: Reservation):
+        # Резерв прошлого дня уже обнулен при смене дня - вычитать нечего
+        if counter.day == reservation.day:
+            counter.reserved = max(counter.reserved - reservation.tokens, 0)
+
+    async def flush(self):
+        """Пишет накопленный расход в БД и забывает неактивных пользователей прошлых дней"""
+        today = _today()
+        for user_id, counter in list(self._counters.items()):
+            if counter.unflushed:
+                tokens, counter.unflushed = counter.unflushed, 0
+                await add_token_usage(user_id, tokens, counter.day)
+            # Незавершенные ответы прошлого дня на сегодняшний лимит не влияют, их резерв не держит счетчик.
+            # Расход, списанный во время записи, дождется следующего сброса
+            if counter.day != today and not counter.unflushed and self._counters.get(user_id) is counter:
+                del self._counters[user_id]
+        self.flushes += 1
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Ошибка сброса счетчиков токенов: {e}")
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    def stats(self) -> Dict:
+        return {
+            'users': len(self._counters),
+            'reserved': sum(counter.reserved for counter in self._counters.values()),
+            'unflushed': sum(counter.unflushed for counter in self._counters.values()),
+            'reservations': self.reservations,
+            'rejections': self.rejections,
+            'flushes': self.flushes
+        }
+
+
+quota = QuotaEngine()
@@ -0,0 +1,183 @@
+"""
+Ограничение частоты запросов к моделям и аварийный выключатель.
+
+TokenBucket - корзина токенов на одну модель: LLM_RATE_LIMIT_BURST запросов
+можно отправить сразу, дальше - LLM_RATE_LIMIT_RPM в минуту. Как только
+провайдер присылает заголовки X-RateLimit-*, корзина подстраивается под
+фактический лимит, а при исчерпании ждет его сброса. Ответ 429 с Retry-After
+закрывает корзину на указанное время (без заголовка - на LLM_RATE_LIMIT_BACKOFF).
+Ожидание токена - это резерв: запросы уходят в порядке очереди, а отмененный
+запрос возвращает свой токен.
+
+CircuitBreaker срабатывает после LLM_BREAKER_FAILURES запросов подряд, на которые
+не ответила ни одна модель. Следующие LLM_BREAKER_OPEN_SECONDS секунд запросы
+сразу получают LLMBusy - бот отвечает заготовленным LLM_BUSY_REPLY, не
+нагружая API повторами. Затем пропускается один пробный запрос: успех
+выключатель закрывает, неудача открывает снова.
+"""
+import asyncio
+import time
+from typing import Dict, Mapping, Optional
+
+from config import (
+    LLM_RATE_LIMIT_RPM,
+    LLM_RATE_LIMIT_BURST,
+    LLM_RATE_LIMIT_BACKOFF,
+    LLM_BREAKER_FAILURES,
+    LLM_BREAKER_OPEN_SECONDS
+)
+from llm import LLMError
+
+
+class LLMBusy(LLMError):
+    """Запрос не отправлялся: лимиты исчерпаны или сработал выключатель"""
+
+
+class TokenBucket:
+    def __init__(self, rpm: float = LLM_RATE_LIMIT_RPM, burst: int = LLM_RATE_LIMIT_BURST):
+        self.rate = rpm / 60
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+        self.acquired = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.throttled = 0
+        self.retry_after_events = 0
+        self.provider_limit: Optional[int] = None
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Через сколько секунд освободится токен (0 - прямо сейчас)"""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(self.blocked_until - now, 0.0)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    async def acquire(self, max_wait: float) -> bool:
+        """Берет токен, подождав не дольше max_wait; False - ждать пришлось бы дольше"""
+        wait = self.delay()
+        if wait > max_wait:
+            self.throttled += 1
+            return False
+        # Токен резервируется сразу: следующие запросы встанут в очередь за этим
+        self.tokens -= 1
+        if wait > 0:
+            self.waits += 1
+            self.wait_time += wait
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self.tokens += 1
+                raise
+        self.acquired += 1
+        return True
+
+    def block(self, seconds: Optional[float]):
+        """Провайдер попросил подождать (429): до конца паузы токенов нет"""
+        self.retry_after_events += 1
+        seconds = LLM_RATE_LIMIT_BACKOFF if seconds is None else seconds
+        now = time.monotonic()
+        self._refill(now)
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = min(self.tokens, 0.0)
+
+    def observe(self, headers: Mapping[str, str]):
+        """Подстраивается под заголовки X-RateLimit-* из ответа провайдера"""
+        try:
+            limit = int(headers.get("X-RateLimit-Limit") or 0)
+            remaining = headers.get("X-RateLimit-Remaining")
+            reset = headers.get("X-RateLimit-Reset")
+        except ValueError:
+            return
+        if limit > 0 and limit != self.provider_limit:
+            # Лимит провайдера - запросов в минуту; пачкой отправляем не больше его
+            self.provider_limit = limit
+            self.rate = limit / 60
+            self.capacity = min(self.capacity, limit)
+        if remaining is not None and reset:
+            try:
+                remaining = int(remaining)
+                reset_in = int(reset) / 1000 - time.time()  # OpenRouter отдает время сброса в мс
+            except ValueError:
+                return
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, remaining)
+            if remaining <= 0 and reset_in > 0:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + reset_in)
+
+    def stats(self) -> Dict:
+        return {
+            'tokens': round(self.tokens, 2),
+            'rpm': round(self.rate * 60, 1),
+            'provider_limit': self.provider_limit,
+            'blocked_for': round(max(self.blocked_until - time.monotonic(), 0), 1),
+            'acquired': self.acquired,
+            'waits': self.waits,
+            'avg_wait': round(self.wait_time / self.waits, 3) if self.waits else 0.0,
+            'throttled': self.throttled,
+            'retry_after_events': self.retry_after_events
+        }
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES,
+                 open_seconds: float = LLM_BREAKER_OPEN_SECONDS):
+        self.threshold = failures
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+        self.opens = 0
+        self.short_circuits = 0
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос; в полуоткрытом состоянии - только один пробный"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        self.short_circuits += 1
+        return False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.threshold:
+            if self.state != self.OPEN:
+                self.opens += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def record_cancelled(self):
+        """Запрос отменен до результата: пробный слот освобождается"""
+        self._probe_in_flight = False
+
+    def stats(self) -> Dict:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'opens': self.opens,
+            'short_circuits': self.short_circuits
+        }
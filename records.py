@@ -0,0 +1,178 @@
+"""
+Компактные типизированные записи для результатов запросов.
+
+Запись - это кортеж (tuple-подкласс без __dict__), поэтому строка из SQLite
+материализуется одной аллокацией, без построения словаря на каждую строку.
+Для совместимости с кодом, который работает со словарями (messages.py, profile.py,
+admin.py), записи поддерживают record['field'], record.get('field', default),
+'field' in record, keys()/items() и доступ по индексу record[0].
+
+Колонки, которых не было в SELECT, считаются отсутствующими: get() вернет
+default, а record['field'] выбросит KeyError - как у словаря.
+"""
+import sqlite3
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+
+class _Missing:
+    __slots__ = ()
+
+    def __repr__(self):
+        return "<missing>"
+
+
+MISSING = _Missing()
+
+
+class Record(tuple):
+    __slots__ = ()
+    _fields: Tuple[str, ...] = ()
+    _index: Dict[str, int] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._index = {name: i for i, name in enumerate(cls._fields)}
+        # Позиции колонок по их именам для одного запроса: {описание колонок: раскладка}
+        cls._layouts = {}
+
+    @classmethod
+    def from_row(cls, row):
+        """Создает запись из строки, колонки которой идут ровно в порядке _fields"""
+        return tuple.__new__(cls, row)
+
+    @classmethod
+    def _layout(cls, columns: Tuple[str, ...]):
+        layout = cls._layouts.get(columns)
+        if layout is None:
+            if columns == cls._fields:
+                layout = None
+            else:
+                positions = {name: i for i, name in enumerate(columns)}
+                layout = tuple(positions.get(name, -1) for name in cls._fields)
+            cls._layouts[columns] = layout
+        return layout
+
+    @classmethod
+    def _builder(cls, cursor: sqlite3.Cursor):
+        columns = tuple(col[0] for col in cursor.description)
+        layout = cls._layout(columns)
+        if layout is None:
+            # Колонки совпадают с полями: запись строится без Python-кода на строку
+            return partial(tuple.__new__, cls)
+        return lambda row: tuple.__new__(cls, [row[i] if i >= 0 else MISSING for i in layout])
+
+    @classmethod
+    def fetch_one(cls, cursor: sqlite3.Cursor) -> Optional["Record"]:
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return cls._builder(cursor)(row)
+
+    @classmethod
+    def fetch_all(cls, cursor: sqlite3.Cursor) -> List["Record"]:
+        if cursor.description is None:
+            return []
+        # Строки читаются из курсора по одной, без промежуточного списка кортежей
+        return list(map(cls._builder(cursor), cursor))
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            value = tuple.__getitem__(self, self._index[key])
+            if value is MISSING:
+                raise KeyError(key)
+            return value
+        return tuple.__getitem__(self, key)
+
+    def __getattr__(self, name):
+        index = self._index.get(name)
+        if index is None:
+            raise AttributeError(name)
+        return tuple.__getitem__(self, index)
+
+    def get(self, key: str, default=None):
+        index = self._index.get(key)
+        if index is None:
+            return default
+        value = tuple.__getitem__(self, index)
+        return default if value is MISSING else value
+
+    def __contains__(self, key):
+        index = self._index.get(key)
+        return index is not None and tuple.__getitem__(self, index) is not MISSING
+
+    def keys(self):
+        return [name for name, value in zip(self._fields, tuple.__iter__(self)) if value is not MISSING]
+
+    def items(self):
+        return [(name, value) for name, value in zip(self._fields, tuple.__iter__(self)) if value is not MISSING]
+
+    def to_dict(self) -> Dict:
+        return dict(self.items())
+
+    def replace(self, **fields) -> "Record":
+        values = list(tuple.__iter__(self))
+        for name, value in fields.items():
+            values[self._index[name]] = value
+        return tuple.__new__(type(self), values)
+
+    def __repr__(self):
+        inner = ", ".join(f"{name}={value!r}" for name, value in self.items())
+        return f"{type(self).__name__}({inner})"
+
+
+class User(Record):
+    __slots__ = ()
+    _fields = ("user_id", "username", "full_name", "balance", "mode",
+               "subscription_type", "subscription_expires", "tokens_used_today",
+               "last_token_reset", "referral_balance", "is_blocked")
+
+
+class Admin(Record):
+    __slots__ = ()
+    _fields = ("user_id", "added_by", "added_at")
+
+
+class Referral(Record):
+    __slots__ = ()
+    _fields = ("user_id", "username", "full_name", "registration_date")
+
+
+class ReferralPayment(Record):
+    __slots__ = ()
+    _fields = ("id", "user_id", "referrer_id", "amount", "level", "payment_date",
+               "subscription_type", "username", "full_name")
+
+
+class DiscountCode(Record):
+    __slots__ = ()
+    _fields = ("id", "code", "discount_percent", "max_uses", "used_count",
+               "created_by", "created_at", "is_active")
+
+
+class UserDiscount(Record):
+    __slots__ = ()
+    _fields = ("id", "user_id", "discount_code", "applied_at", "used",
+               "discount_percent")
+
+
+class ErrorLog(Record):
+    __slots__ = ()
+    _fields = ("id", "error_type", "error_message", "traceback", "user_id", "timestamp")
+
+
+class MessageLog(Record):
+    __slots__ = ()
+    _fields = ("id", "user_id", "role", "message", "timestamp")
+
+
+class ConversationSummary(Record):
+    __slots__ = ()
+    _fields = ("user_id", "summary", "last_message_id", "tokens", "updated_at")
+
+
+class BroadcastJob(Record):
+    __slots__ = ()
+    _fields = ("id", "text", "created_by", "status", "shard", "last_user_id", "total",
+               "sent", "failed", "blocked", "progress_chat_id", "progress_message_id",
+               "created_at", "finished_at")
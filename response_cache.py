@@ -0,0 +1,176 @@
+"""
+Кэш ответов модели на одинаковые короткие вопросы.
+
+Ключ - (режим, хэш системного промпта, нормализованный вопрос). Кэшируются только
+запросы без контекста: системный промпт и один вопрос пользователя. Ответ на
+вопрос внутри диалога зависит от предыдущих реплик, и отдавать его другому
+пользователю нельзя.
+
+Уровень в памяти ограничен по объему (LRU) и по времени жизни записи (TTL).
+Если задан LLM_RESPONSE_CACHE_DATABASE, ответы дополнительно пишутся в SQLite
+(через очередь отложенной записи) и переживают перезапуск бота.
+
+Кэш выключен по умолчанию (LLM_RESPONSE_CACHE_ENABLED).
+"""
+import asyncio
+import hashlib
+import re
+import sys
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from config import (
+    LLM_RESPONSE_CACHE_ENABLED,
+    LLM_RESPONSE_CACHE_TTL,
+    LLM_RESPONSE_CACHE_MAX_BYTES,
+    LLM_RESPONSE_CACHE_MAX_PROMPT_CHARS,
+    LLM_RESPONSE_CACHE_DATABASE
+)
+from db_pool import get_connection
+from write_queue import enqueue_write
+
+_SPACES = re.compile(r"\s+")
+_TRAILING = " ?!.,;:…"
+
+
+def normalize_prompt(text: str) -> str:
+    """Приводит вопрос к виду, в котором одинаковые по смыслу формулировки совпадают"""
+    text = _SPACES.sub(" ", text.lower().replace("ё", "е")).strip()
+    return text.rstrip(_TRAILING)
+
+
+def is_cacheable(messages: List[Dict]) -> bool:
+    """Только запрос без контекста: системный промпт и один короткий вопрос"""
+    if len(messages) != 2 or messages[0]["role"] != "system" or messages[1]["role"] != "user":
+        return False
+    return len(messages[1]["content"]) <= LLM_RESPONSE_CACHE_MAX_PROMPT_CHARS
+
+
+def make_key(mode: str, system_prompt: str, prompt: str, prompt_hash: Optional[str] = None) -> str:
+    """prompt_hash - готовый хэш system_prompt (у шаблонов prompts.py он посчитан заранее)"""
+    if prompt_hash is None:
+        prompt_hash = hashlib.sha1(system_prompt.encode("utf-8")).hexdigest()[:16]
+    return f"{mode}:{prompt_hash}:{normalize_prompt(prompt)}"
+
+
+class ResponseCache:
+    def __init__(self, enabled: bool = LLM_RESPONSE_CACHE_ENABLED, ttl: float = LLM_RESPONSE_CACHE_TTL,
+                 max_bytes: int = LLM_RESPONSE_CACHE_MAX_BYTES,
+                 database: Optional[str] = LLM_RESPONSE_CACHE_DATABASE):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.database = database
+        self._entries = OrderedDict()  # {key: (expires_at, response, size)}
+        self.bytes = 0
+        self._table_ready = False
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry is not None:
+            expires_at, response, _ = entry
+            if expires_at >= now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return response
+            self._remove(key)
+
+        if self.database:
+            row = await asyncio.get_running_loop().run_in_executor(None, self._db_get, key, now)
+            if row is not None:
+                response, expires_at = row
+                self._remember(key, response, expires_at)
+                self.disk_hits += 1
+                return response
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, response: str):
+        expires_at = time.time() + self.ttl
+        self._remember(key, response, expires_at)
+        self.stores += 1
+        if self.database:
+            # Постановка в очередь записи может ждать сброса - делаем ее в потоке записи
+            from async_database import run_write
+            await run_write(self._db_put, key, response, expires_at)
+
+    def _remember(self, key: str, response: str, expires_at: float):
+        size = sys.getsizeof(key) + sys.getsizeof(response)
+        # Ответ больше всего кэша не сохраняем - он вытеснил бы все остальное
+        if size > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = (expires_at, response, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            old_key = next(iter(self._entries))
+            self._remove(old_key)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def _ensure_table(self):
+        if self._table_ready:
+            return
+        with get_connection(self.database) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+        self._table_ready = True
+
+    def _db_get(self, key: str, now: float):
+        self._ensure_table()
+        return get_connection(self.database).execute(
+            "SELECT response, expires_at FROM response_cache WHERE key = ? AND expires_at >= ?",
+            (key, now)).fetchone()
+
+    def _db_put(self, key: str, response: str, expires_at: float):
+        self._ensure_table()
+        enqueue_write(self.database, """
+            INSERT OR REPLACE INTO response_cache (key, response, expires_at)
+            VALUES (?, ?, ?)
+        """, (key, response, expires_at))
+
+    def purge_expired(self) -> int:
+        """Удаляет просроченные ответы из постоянного уровня"""
+        if not self.database:
+            return 0
+        self._ensure_table()
+        with get_connection(self.database) as conn:
+            cursor = conn.execute(
+                "DELETE FROM response_cache WHERE expires_at < ?", (time.time(),))
+        return cursor.rowcount
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            'stores': self.stores,
+            'evictions': self.evictions
+        }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,267 @@
+"""
+Хранение журнала сообщений по уровням.
+
+message_logs - горячий уровень: в нем остаются только последние MESSAGE_HOT_TURNS
+сообщений каждого пользователя, не старше MESSAGE_HOT_DAYS дней. Этого хватает
+get_last_messages, поэтому размер таблицы и глубина ее индекса не растут вместе
+с историей.
+
+Все остальное фоновый поток раз в MESSAGE_ARCHIVE_INTERVAL секунд переносит в
+message_archive: сообщения пользователя складываются пачками по
+MESSAGE_ARCHIVE_CHUNK_ROWS строк, пачка сжимается zlib и пишется одной строкой.
+Перенос пачки и удаление ее строк из message_logs идут в одной транзакции.
+
+Если задан MESSAGE_ARCHIVE_PURGE_DAYS, архивные пачки старше этого срока удаляются.
+
+Один проход вручную:
+    python retention.py --run [путь к базе]
+"""
+import json
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+
+from config import (
+    MESSAGE_HOT_TURNS,
+    MESSAGE_HOT_DAYS,
+    MESSAGE_ARCHIVE_INTERVAL,
+    MESSAGE_ARCHIVE_CHUNK_ROWS,
+    MESSAGE_ARCHIVE_PURGE_DAYS
+)
+from db_pool import get_connection
+
+COMPRESSION_LEVEL = 6
+
+
+def _pack(rows) -> bytes:
+    return zlib.compress(
+        json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+        COMPRESSION_LEVEL)
+
+
+def _unpack(payload: bytes) -> List:
+    return json.loads(zlib.decompress(payload).decode("utf-8"))
+
+
+def _days_ago(conn: sqlite3.Connection, days: int) -> str:
+    # Тот же формат, что у CURRENT_TIMESTAMP в message_logs
+    return conn.execute("SELECT datetime('now', ?)", (f"-{days} days",)).fetchone()[0]
+
+
+class RetentionWorker:
+    """Фоновый перенос старых сообщений одной базы в архив"""
+
+    def __init__(self, database: str, hot_turns: int = MESSAGE_HOT_TURNS,
+                 hot_days: int = MESSAGE_HOT_DAYS, interval: float = MESSAGE_ARCHIVE_INTERVAL,
+                 chunk_rows: int = MESSAGE_ARCHIVE_CHUNK_ROWS,
+                 purge_days: int = MESSAGE_ARCHIVE_PURGE_DAYS):
+        self.database = database
+        self.hot_turns = hot_turns
+        self.hot_days = hot_days
+        self.interval = interval
+        self.chunk_rows = chunk_rows
+        self.purge_days = purge_days
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Метрики
+        self.passes = 0
+        self.archived_rows = 0
+        self.archived_batches = 0
+        self.purged_batches = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.hot_rows = 0
+        self.last_run_ms = 0.0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=f"db-retention:{self.database}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Ошибка переноса сообщений в архив ({self.database}): {e}")
+
+    def run_once(self) -> Dict:
+        """Один проход: архивирует старые сообщения и чистит архив по сроку"""
+        started = time.perf_counter()
+        conn = get_connection(self.database)
+
+        archived = 0
+        for user_id in self._users_over_limit(conn):
+            if self._stop.is_set():
+                break
+            archived += self._archive_user(conn, user_id)
+
+        purged = self._purge(conn) if self.purge_days else 0
+        self.hot_rows = conn.execute("SELECT COUNT(*) FROM message_logs").fetchone()[0]
+
+        self.passes += 1
+        self.last_run_ms = (time.perf_counter() - started) * 1000
+        return {'archived_rows': archived, 'purged_batches': purged}
+
+    def _users_over_limit(self, conn: sqlite3.Connection) -> List[int]:
+        # Группировка идет по индексу (user_id, timestamp), таблицу не читает
+        if self.hot_days:
+            rows = conn.execute("""
+                SELECT user_id FROM message_logs
+                GROUP BY user_id
+                HAVING COUNT(*) > ? OR MIN(timestamp) < ?
+            """, (self.hot_turns, _days_ago(conn, self.hot_days))).fetchall()
+        else:
+            rows = conn.execute("""
+                SELECT user_id FROM message_logs
+                GROUP BY user_id
+                HAVING COUNT(*) > ?
+            """, (self.hot_turns,)).fetchall()
+        return [row[0] for row in rows]
+
+    def _archive_user(self, conn: sqlite3.Connection, user_id: int) -> int:
+        conditions = []
+        params = [user_id]
+
+        # Самое новое сообщение, которое уже не входит в последние hot_turns
+        boundary = conn.execute("""
+            SELECT timestamp, id FROM message_logs
+            WHERE user_id = ?
+            ORDER BY timestamp DESC, id DESC
+            LIMIT 1 OFFSET ?
+        """, (user_id, self.hot_turns)).fetchone()
+        if boundary is not None:
+            conditions.append("(timestamp, id) <= (?, ?)")
+            params.extend(boundary)
+        if self.hot_days:
+            conditions.append("timestamp < ?")
+            params.append(_days_ago(conn, self.hot_days))
+
+        sql = f"""
+            SELECT id, role, message, timestamp FROM message_logs
+            WHERE user_id = ? AND ({" OR ".join(conditions)})
+            ORDER BY timestamp, id
+            LIMIT ?
+        """
+        params.append(self.chunk_rows)
+
+        archived = 0
+        while not self._stop.is_set():
+            rows = conn.execute(sql, params).fetchall()
+            if not rows:
+                break
+            payload = _pack(rows)
+            with conn:
+                conn.execute("""
+                    INSERT INTO message_archive (
+                        user_id, first_id, last_id, first_timestamp, last_timestamp, row_count, payload
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (user_id, rows[0][0], rows[-1][0], rows[0][3], rows[-1][3], len(rows), payload))
+                conn.executemany(
+                    "DELETE FROM message_logs WHERE id = ?", [(row[0],) for row in rows])
+
+            archived += len(rows)
+            self.archived_rows += len(rows)
+            self.archived_batches += 1
+            self.raw_bytes += sum(len((row[2] or "").encode("utf-8")) for row in rows)
+            self.compressed_bytes += len(payload)
+            if len(rows) < self.chunk_rows:
+                break
+        return archived
+
+    def _purge(self, conn: sqlite3.Connection) -> int:
+        with conn:
+            cursor = conn.execute(
+                "DELETE FROM message_archive WHERE last_timestamp < ?",
+                (_days_ago(conn, self.purge_days),))
+        self.purged_batches += cursor.rowcount
+        return cursor.rowcount
+
+    def stats(self) -> Dict:
+        return {
+            'database': self.database,
+            'hot_turns': self.hot_turns,
+            'hot_days': self.hot_days,
+            'hot_rows': self.hot_rows,
+            'passes': self.passes,
+            'archived_rows': self.archived_rows,
+            'archived_batches': self.archived_batches,
+            'purged_batches': self.purged_batches,
+            'compression_ratio': round(self.raw_bytes / self.compressed_bytes, 2) if self.compressed_bytes else 0.0,
+            'last_run_ms': round(self.last_run_ms, 2)
+        }
+
+
+def get_archived_messages(database: str, user_id: int, limit: Optional[int] = None) -> List[Dict]:
+    """Возвращает архивные сообщения пользователя в хронологическом порядке (последние limit)"""
+    conn = get_connection(database)
+    messages = []
+    cursor = conn.execute("""
+        SELECT payload FROM message_archive
+        WHERE user_id = ?
+        ORDER BY last_id DESC
+    """, (user_id,))
+    # Пачки читаются с конца, пока не наберется limit сообщений
+    for (payload,) in cursor:
+        batch = [
+            {'id': row[0], 'role': row[1], 'message': row[2], 'timestamp': row[3]}
+            for row in _unpack(payload)
+        ]
+        messages[:0] = batch
+        if limit is not None and len(messages) >= limit:
+            break
+    return messages[-limit:] if limit is not None else messages
+
+
+_workers: Dict[str, RetentionWorker] = {}
+
+
+def start_retention(database: str) -> RetentionWorker:
+    worker = _workers.get(database)
+    if worker is None:
+        worker = RetentionWorker(database)
+        _workers[database] = worker
+    worker.start()
+    return worker
+
+
+def stop_retention():
+    """Останавливает фоновые потоки архивации (при остановке бота)"""
+    for worker in list(_workers.values()):
+        worker.stop()
+
+
+def get_retention_stats() -> List[Dict]:
+    return [worker.stats() for worker in _workers.values()]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "--run":
+        print("Использование: python retention.py --run [путь к базе]")
+        sys.exit(2)
+
+    from migrations import run_migrations
+
+    database = sys.argv[2] if len(sys.argv) > 2 else "users.db"
+    run_migrations(get_connection(database))
+    worker = RetentionWorker(database)
+    result = worker.run_once()
+    stats = worker.stats()
+    print(f"Перенесено в архив: {result['archived_rows']} сообщений "
+          f"({stats['archived_batches']} пачек, сжатие x{stats['compression_ratio']})")
+    print(f"Удалено архивных пачек: {result['purged_batches']}")
+    print(f"Осталось в message_logs: {stats['hot_rows']}")
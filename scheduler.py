@@ -0,0 +1,258 @@
+"""
+Очередь запросов к модели.
+
+Одновременно идет не больше LLM_MAX_CONCURRENCY генераций на весь бот и не
+больше LLM_PER_USER_INFLIGHT на одного пользователя. Остальные запросы ждут в
+очередях по подпискам, и освободившийся слот получает та подписка, у которой
+меньше всего «виртуального времени» (взвешенная справедливая очередь): подписка
+с весом 8 при наплыве получает в 8 раз больше слотов, чем бесплатная, но и
+бесплатные запросы не ждут бесконечно.
+
+Фоновые генерации (сводки диалогов) идут через background_slot: они не
+занимают слот пользователя (LLM_PER_USER_INFLIGHT) и получают свободный слот,
+только когда запросы пользователей не ждут, поэтому ответ пользователю никогда
+не стоит в очереди за его же фоновой задачей.
+
+Пока запрос ждет, on_wait получает его примерное место в очереди - бот
+показывает его пользователю. Время ожидания каждой подписки собирается в
+гистограмму (wait_histogram).
+"""
+import asyncio
+import math
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from config import (
+    LLM_MAX_CONCURRENCY,
+    LLM_PER_USER_INFLIGHT,
+    LLM_TIER_WEIGHTS,
+    LLM_QUEUE_NOTICE_DELAY,
+    LLM_QUEUE_NOTICE_INTERVAL
+)
+
+# Границы корзин гистограммы времени ожидания, секунд
+WAIT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+OnWait = Callable[[int], Awaitable[None]]
+
+# Очередь фоновых генераций: обслуживается после всех подписок
+BACKGROUND = "background"
+
+
+class _Waiter:
+    __slots__ = ("user_id", "tier", "future", "enqueued_at")
+
+    def __init__(self, user_id: Optional[int], tier: "_Tier", future: asyncio.Future):
+        self.user_id = user_id
+        self.tier = tier
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class _Tier:
+    __slots__ = ("name", "weight", "queue", "vtime", "granted", "wait_sum", "buckets")
+
+    def __init__(self, name: str, weight: float):
+        self.name = name
+        self.weight = weight
+        self.queue: Deque[_Waiter] = deque()
+        self.vtime = 0.0        # Виртуальное время следующей выдачи слота
+        self.granted = 0
+        self.wait_sum = 0.0
+        self.buckets = [0] * (len(WAIT_BUCKETS) + 1)  # Последняя корзина - больше WAIT_BUCKETS[-1]
+
+
+def _quantile(tier: _Tier, q: float) -> Optional[float]:
+    """Верхняя граница корзины, в которую попадает квантиль q (None - за пределами гистограммы)"""
+    if not tier.granted:
+        return 0.0
+    rank = q * tier.granted
+    seen = 0
+    for bound, count in zip(WAIT_BUCKETS, tier.buckets):
+        seen += count
+        if seen >= rank:
+            return bound
+    return None
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 per_user: int = LLM_PER_USER_INFLIGHT,
+                 weights: Dict[str, float] = None,
+                 notice_delay: float = LLM_QUEUE_NOTICE_DELAY,
+                 notice_interval: float = LLM_QUEUE_NOTICE_INTERVAL):
+        self.max_concurrency = max_concurrency
+        self.per_user = per_user
+        self.notice_delay = notice_delay
+        self.notice_interval = notice_interval
+        self._tiers = {name: _Tier(name, weight)
+                       for name, weight in (weights or LLM_TIER_WEIGHTS).items()}
+        self._background = _Tier(BACKGROUND, 1)
+        self._in_flight = 0
+        self._user_in_flight: Dict[int, int] = {}
+        self._vtime = 0.0
+
+    def _tier(self, name: str) -> _Tier:
+        # Неизвестная подписка обслуживается как бесплатная
+        return self._tiers.get(name) or self._tiers['free']
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, tier: str, on_wait: Optional[OnWait] = None):
+        """Держит слот генерации на время блока with"""
+        await self.acquire(user_id, tier, on_wait)
+        try:
+            yield
+        finally:
+            self.release(user_id)
+
+    @asynccontextmanager
+    async def background_slot(self):
+        """Слот фоновой генерации: вне лимита пользователя и после всех ожидающих запросов пользователей"""
+        await self.acquire(None, BACKGROUND)
+        try:
+            yield
+        finally:
+            self.release(None)
+
+    async def acquire(self, user_id: Optional[int], tier: str, on_wait: Optional[OnWait] = None):
+        tier = self._background if tier == BACKGROUND else self._tier(tier)
+        waiter = _Waiter(user_id, tier, asyncio.get_running_loop().create_future())
+        if not tier.queue:
+            # Подписка, которая простаивала, не копит права на внеочередные слоты
+            tier.vtime = max(tier.vtime, self._vtime)
+        tier.queue.append(waiter)
+        self._dispatch()
+        if waiter.future.done():
+            return
+
+        try:
+            await self._wait(waiter, on_wait)
+        except BaseException:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Слот выдали одновременно с отменой - возвращаем его
+                self.release(user_id)
+            else:
+                waiter.future.cancel()
+                tier.queue.remove(waiter)
+                self._dispatch()
+            raise
+
+    async def _wait(self, waiter: _Waiter, on_wait: Optional[OnWait]):
+        if on_wait is None:
+            await waiter.future
+            return
+        timeout = self.notice_delay
+        while True:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await on_wait(self.position(waiter))
+            except Exception as e:
+                print(f"Ошибка уведомления о месте в очереди: {e}")
+            timeout = self.notice_interval
+
+    def release(self, user_id: Optional[int]):
+        self._in_flight -= 1
+        if user_id is None:
+            self._dispatch()
+            return
+        count = self._user_in_flight.get(user_id, 0) - 1
+        if count > 0:
+            self._user_in_flight[user_id] = count
+        else:
+            self._user_in_flight.pop(user_id, None)
+        self._dispatch()
+
+    def _eligible(self, tier: _Tier) -> Optional[_Waiter]:
+        # Первый в очереди подписки, чей пользователь не упирается в свой лимит
+        for waiter in tier.queue:
+            if waiter.user_id is None or self._user_in_flight.get(waiter.user_id, 0) < self.per_user:
+                return waiter
+        return None
+
+    def _dispatch(self):
+        while self._in_flight < self.max_concurrency:
+            best = best_tier = None
+            for tier in self._tiers.values():
+                if not tier.queue or (best_tier is not None and tier.vtime >= best_tier.vtime):
+                    continue
+                waiter = self._eligible(tier)
+                if waiter is not None:
+                    best, best_tier = waiter, tier
+            if best is None:
+                # Фоновые генерации - только если ни один запрос пользователя не может получить слот
+                best = self._eligible(self._background) if self._background.queue else None
+                if best is None:
+                    return
+            self._grant(best)
+
+    def _grant(self, waiter: _Waiter):
+        tier = waiter.tier
+        tier.queue.remove(waiter)
+        if tier is not self._background:
+            self._vtime = tier.vtime
+            tier.vtime += 1 / tier.weight
+        self._in_flight += 1
+        if waiter.user_id is not None:
+            self._user_in_flight[waiter.user_id] = self._user_in_flight.get(waiter.user_id, 0) + 1
+
+        waited = time.monotonic() - waiter.enqueued_at
+        tier.granted += 1
+        tier.wait_sum += waited
+        tier.buckets[bisect_left(WAIT_BUCKETS, waited)] += 1
+        waiter.future.set_result(None)
+
+    def position(self, waiter: _Waiter) -> int:
+        """Сколько запросов получат слот раньше этого (включая его самого)"""
+        tier = waiter.tier
+        try:
+            index = tier.queue.index(waiter)
+        except ValueError:
+            return 0
+        served_at = tier.vtime + index / tier.weight
+        position = index + 1
+        for other in self._tiers.values():
+            if other is tier or not other.queue:
+                continue
+            ahead = math.ceil((served_at - other.vtime) * other.weight)
+            position += min(len(other.queue), max(ahead, 0))
+        return position
+
+    def wait_histogram(self) -> Dict[str, List[Tuple[str, int]]]:
+        """Накопительная гистограмма ожидания по подпискам: [(граница, число запросов), ...]"""
+        histogram = {}
+        for tier in (*self._tiers.values(), self._background):
+            total = 0
+            rows = []
+            for bound, count in zip(WAIT_BUCKETS + ("+Inf",), tier.buckets):
+                total += count
+                rows.append((str(bound), total))
+            histogram[tier.name] = rows
+        return histogram
+
+    def stats(self) -> Dict:
+        tiers = {}
+        for tier in (*self._tiers.values(), self._background):
+            tiers[tier.name] = {
+                'weight': tier.weight,
+                'queued': len(tier.queue),
+                'granted': tier.granted,
+                'avg_wait': round(tier.wait_sum / tier.granted, 3) if tier.granted else 0.0,
+                'p50_wait': _quantile(tier, 0.5),
+                'p95_wait': _quantile(tier, 0.95)
+            }
+        return {
+            'in_flight': self._in_flight,
+            'max_concurrency': self.max_concurrency,
+            'queued': sum(len(tier.queue) for tier in (*self._tiers.values(), self._background)),
+            'tiers': tiers
+        }
+
+
+llm_scheduler = LLMScheduler()
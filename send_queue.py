@@ -0,0 +1,250 @@
+"""
+Очередь исходящих запросов к Telegram.
+
+Telegram ограничивает отправку примерно 30 сообщениями в секунду на бота,
+одним сообщением в секунду в личный чат и 20 в минуту в группу. Очередь
+подключена к сессии shared.bot как middleware aiogram, поэтому через нее
+проходят все send_message, edit_message_text, delete_message и прочие
+отправки из любого модуля, а вызовы bot.* в коде остаются прежними.
+
+Запрос сначала ждет токен корзины своего чата (TokenBucket из ratelimit.py,
+в порядке поступления), затем - токен общей корзины. Общая очередь
+упорядочена по приоритету: ответы пользователю (INTERACTIVE, по умолчанию)
+идут раньше служебных уведомлений (NORMAL) и рассылок (BULK). Приоритет
+задается через send_priority() и наследуется задачами, созданными внутри.
+Удаление сообщений тратит только общий лимит.
+
+Ответ 429 (TelegramRetryAfter) на запрос в чат останавливает на retry_after
+только этот чат: флуд-лимит одного чата не должен задерживать остальные
+чаты и рассылки. Общая отправка останавливается, если 429 пришел на запрос
+без чата (удаление) или сразу в нескольких чатах - это уже общий лимит бота.
+После паузы запрос повторяется (до TELEGRAM_RETRY_MAX_ATTEMPTS раз). Если ждать пришлось бы
+дольше TELEGRAM_RETRY_MAX_WAIT, TelegramRetryAfter уходит вызывающему.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Tuple, Union
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    CopyMessage,
+    DeleteMessage,
+    DeleteMessages,
+    EditMessageCaption,
+    EditMessageMedia,
+    EditMessageReplyMarkup,
+    EditMessageText,
+    ForwardMessage,
+    SendAnimation,
+    SendAudio,
+    SendDocument,
+    SendMediaGroup,
+    SendMessage,
+    SendPhoto,
+    SendSticker,
+    SendVideo,
+    SendVoice
+)
+
+from config import (
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_GLOBAL_BURST,
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_GROUP_RATE,
+    TELEGRAM_RETRY_MAX_ATTEMPTS,
+    TELEGRAM_RETRY_MAX_WAIT,
+    TELEGRAM_CHAT_BUCKETS
+)
+from ratelimit import TokenBucket
+
+INTERACTIVE = 0
+NORMAL = 1
+BULK = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", NORMAL: "normal", BULK: "bulk"}
+
+# Сообщения в чат: тратят лимит чата и общий
+CHAT_METHODS = (
+    SendMessage, EditMessageText, EditMessageCaption, EditMessageMedia, EditMessageReplyMarkup,
+    SendPhoto, SendDocument, SendVideo, SendAnimation, SendAudio, SendVoice, SendSticker,
+    SendMediaGroup, CopyMessage, ForwardMessage
+)
+# Тратят только общий лимит
+GLOBAL_METHODS = (DeleteMessage, DeleteMessages)
+
+_priority: ContextVar[int] = ContextVar("telegram_send_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def send_priority(priority: int):
+    """Приоритет отправок внутри блока (и в задачах, созданных в нем)"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TelegramSendQueue(BaseRequestMiddleware):
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_RATE,
+                 global_burst: int = TELEGRAM_GLOBAL_BURST,
+                 chat_rate: float = TELEGRAM_CHAT_RATE,
+                 chat_burst: int = TELEGRAM_CHAT_BURST,
+                 group_rate: float = TELEGRAM_GROUP_RATE,
+                 max_attempts: int = TELEGRAM_RETRY_MAX_ATTEMPTS,
+                 max_retry_wait: float = TELEGRAM_RETRY_MAX_WAIT,
+                 max_chat_buckets: int = TELEGRAM_CHAT_BUCKETS):
+        self.global_bucket = TokenBucket(global_rate * 60, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_attempts = max_attempts
+        self.max_retry_wait = max_retry_wait
+        self.max_chat_buckets = max_chat_buckets
+
+        self._chats: Dict[Union[int, str], TokenBucket] = {}
+        self._flooded: Dict[Union[int, str], float] = {}    # чат -> до какого момента он на паузе после 429
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []   # куча (приоритет, номер, future)
+        self._seq = itertools.count()
+        self._dispatcher = None
+        self.waiting_chat = 0
+
+        self.sent = 0
+        self.retry_after_events = 0
+        self.retries = 0
+        self.gave_up = 0
+        self.wait_time = [0.0, 0.0, 0.0]
+        self.waited = [0, 0, 0]
+        self.max_wait = 0.0
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, CHAT_METHODS):
+            # У правки inline-сообщения (inline_message_id) чата нет - тратится только общий лимит
+            chat_id = method.chat_id
+        elif isinstance(method, GLOBAL_METHODS):
+            chat_id = None
+        else:
+            # getUpdates, answerCallbackQuery и прочее не ограничиваются
+            return await make_request(bot, method)
+
+        priority = _priority.get()
+        attempt = 1
+        while True:
+            await self._acquire(chat_id, priority)
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.retry_after_events += 1
+                self._pause(chat_id, e.retry_after)
+                if attempt >= self.max_attempts or e.retry_after > self.max_retry_wait:
+                    self.gave_up += 1
+                    raise
+                attempt += 1
+                self.retries += 1
+                continue
+            self.sent += 1
+            return result
+
+    async def _acquire(self, chat_id, priority: int):
+        started = time.monotonic()
+        if chat_id is not None:
+            bucket = self._chat_bucket(chat_id)
+            if bucket.delay() > 0:
+                self.waiting_chat += 1
+                try:
+                    await bucket.acquire(float("inf"))
+                finally:
+                    self.waiting_chat -= 1
+            else:
+                await bucket.acquire(0)
+
+        if not self._waiters and self.global_bucket.delay() == 0:
+            await self.global_bucket.acquire(0)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._seq), future))
+            if self._dispatcher is None or self._dispatcher.done():
+                self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+            await future
+
+        wait = time.monotonic() - started
+        if wait > 0.001:
+            self.waited[priority] += 1
+            self.wait_time[priority] += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    async def _dispatch(self):
+        """Выдает токены общей корзины ожидающим в порядке приоритета"""
+        while self._waiters:
+            delay = self.global_bucket.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                # Ожидавший запрос отменен
+                continue
+            await self.global_bucket.acquire(0)
+            future.set_result(None)
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chat_buckets:
+                self._prune()
+            # Отрицательный id или @username - группа или канал
+            group = isinstance(chat_id, str) or chat_id < 0
+            rate = self.group_rate if group else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate * 60, self.chat_burst)
+        return bucket
+
+    def _prune(self):
+        """Забывает чаты, корзины которых полны: для них новая корзина ничем не отличается"""
+        idle = [chat_id for chat_id, bucket in self._chats.items()
+                if bucket.delay() == 0 and bucket.tokens >= bucket.capacity]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+    def _pause(self, chat_id, seconds: float):
+        if chat_id is None:
+            self.global_bucket.block(seconds)
+            return
+        self._chat_bucket(chat_id).block(seconds)
+        now = time.monotonic()
+        self._flooded = {other: until for other, until in self._flooded.items() if until > now}
+        if any(other != chat_id for other in self._flooded):
+            # 429 сразу в нескольких чатах - упираемся в общий лимит бота
+            self.global_bucket.block(seconds)
+        self._flooded[chat_id] = now + seconds
+
+    def busy(self) -> bool:
+        """Общий лимит исчерпан: новый запрос встанет в очередь"""
+        return bool(self._waiters) or self.global_bucket.delay() > 0
+
+    def stats(self) -> Dict:
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                queued[PRIORITY_NAMES[priority]] += 1
+        return {
+            'queued': sum(queued.values()),
+            'queued_by_priority': queued,
+            'waiting_chat': self.waiting_chat,
+            'chats': len(self._chats),
+            'sent': self.sent,
+            'retry_after_events': self.retry_after_events,
+            'retries': self.retries,
+            'gave_up': self.gave_up,
+            'paused_for': self.global_bucket.stats()['blocked_for'],
+            'avg_wait': {PRIORITY_NAMES[priority]: round(self.wait_time[priority] / self.waited[priority], 3)
+                         if self.waited[priority] else 0.0 for priority in PRIORITY_NAMES},
+            'max_wait': round(self.max_wait, 3)
+        }
+
+
+telegram_send_queue = TelegramSendQueue()
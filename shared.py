@@ -3,15 +3,17 @@ from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from config import API_TOKEN
 from aiogram.enums import ParseMode
+from send_queue import telegram_send_queue
 
 bot = Bot(token=API_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+# Все отправки бота проходят через общую очередь с лимитами Telegram
+bot.session.middleware(telegram_send_queue)
 dp = Dispatcher()
 
 # Глобальные состояния
 user_modes = {}
 last_bot_messages = {}
 message_history = {}
-chat_histories = {}
 
 def get_bot():
     return bot
\ No newline at end of file
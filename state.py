@@ -1,5 +1,4 @@
 last_bot_messages = {}
 message_history = {}
-chat_histories = {}
 admin_states = {}
 user_states = {}
@@ -0,0 +1,67 @@
+"""
+Размещение данных по файлам SQLite (шардирование по пользователям).
+
+Каталог - файл DATABASE_NAME (users.db) - хранит глобальные таблицы: admins,
+discount_codes, referrals, referral_payments, error_logs, broadcast_jobs,
+broadcast_recipients, scheduled_deletions. Данные конкретного пользователя (users со счетчиками
+токенов, message_logs, message_archive, user_discounts) лежат в одном из
+DB_SHARDS файлов-шардов, который выбирается по хэшу user_id. У каждого шарда
+свое соединение, своя очередь отложенной записи и своя блокировка записи
+SQLite, поэтому записи разных пользователей не ждут друг друга.
+
+При DB_SHARDS = 1 единственный шард - это сам каталог, то есть прежний users.db.
+Число шардов нельзя менять на живой базе: данные пользователей останутся в старых
+шардах. Для перераскладки используется выгрузка/загрузка базы.
+"""
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List
+
+from config import DB_SHARDS
+
+_fanout_executor = ThreadPoolExecutor(
+    max_workers=max(DB_SHARDS, 1), thread_name_prefix="db-shard")
+
+
+def shard_path(catalog: str, index: int, shard_count: int) -> str:
+    if shard_count <= 1:
+        return catalog
+    root, ext = os.path.splitext(catalog)
+    return f"{root}.shard{index}{ext or '.db'}"
+
+
+class ShardedStorage:
+    def __init__(self, catalog: str, shard_count: int = DB_SHARDS):
+        self.catalog = catalog
+        self.shard_count = max(shard_count, 1)
+        self.shards = [shard_path(catalog, i, self.shard_count)
+                       for i in range(self.shard_count)]
+
+    def shard_for(self, user_id: int) -> str:
+        if self.shard_count == 1:
+            return self.shards[0]
+        # crc32 стабилен между запусками, в отличие от hash() для строк
+        key = int(user_id).to_bytes(8, "big", signed=True)
+        return self.shards[zlib.crc32(key) % self.shard_count]
+
+    def databases(self) -> List[str]:
+        """Все файлы хранилища: каталог и шарды (без повторов)"""
+        return list(dict.fromkeys([self.catalog, *self.shards]))
+
+    def group_by_shard(self, user_ids: Iterable[int]) -> Dict[str, List[int]]:
+        groups: Dict[str, List[int]] = {}
+        for user_id in user_ids:
+            groups.setdefault(self.shard_for(user_id), []).append(user_id)
+        return groups
+
+    def fan_out(self, func: Callable[[str], object], shards: Iterable[str] = None) -> List:
+        """Выполняет func(путь шарда) на всех (или указанных) шардах параллельно"""
+        shards = list(self.shards if shards is None else shards)
+        if len(shards) == 1:
+            return [func(shards[0])]
+        return list(_fanout_executor.map(func, shards))
+
+
+def shutdown():
+    _fanout_executor.shutdown(wait=True)
@@ -1,10 +1,9 @@
 from datetime import datetime, timedelta
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-import database
 from messages import get_subscription_menu_text, get_profile_text, get_subscription_info_text
 from profile import get_profile_keyboard
 from error_handler import error_handler, sync_error_handler
-import asyncio
+from message_cleanup import deletion_scheduler
 
 PRICES = {
     'tier1': 300,
@@ -25,11 +24,11 @@ REFERRAL_PERCENTS = {
 }
 
 
-@sync_error_handler
-def get_subscriptions_keyboard(user_id: int) -> InlineKeyboardMarkup:
-    from database import get_user, is_subscription_active
+@error_handler
+async def get_subscriptions_keyboard(user_id: int) -> InlineKeyboardMarkup:
+    from async_database import get_user, is_subscription_active
 
-    user = get_user(user_id)
+    user = await get_user(user_id)
     if not user:
         return InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(
@@ -37,7 +36,7 @@ def get_subscriptions_keyboard(user_id: int) -> InlineKeyboardMarkup:
         ])
 
     current_sub = user.get('subscription_type', 'free')
-    active = is_subscription_active(user_id)
+    active = await is_subscription_active(user_id)
     buttons = []
 
     # Показываем только доступные для апгрейда подписки
@@ -94,8 +93,8 @@ async def show_subscriptions_menu(callback: CallbackQuery):
     # Редактируем текущее сообщение вместо отправки нового
     try:
         await callback.message.edit_text(
-            text=get_subscription_menu_text(callback.from_user.id),
-            reply_markup=get_subscriptions_keyboard(callback.from_user.id)
+            text=await get_subscription_menu_text(callback.from_user.id),
+            reply_markup=await get_subscriptions_keyboard(callback.from_user.id)
         )
         await callback.answer()
     except Exception as e:
@@ -118,8 +117,8 @@ async def handle_subscription_selection(callback: CallbackQuery):
             return
 
         # Получаем информацию о пользователе
-        from database import get_user, get_user_active_discount, mark_discount_as_used, update_purchase_balance, update_subscription
-        user = get_user(user_id)
+        from async_database import get_user, get_user_active_discount, mark_discount_as_used, update_purchase_balance, update_subscription
+        user = await get_user(user_id)
         if not user:
             await callback.answer("Пользователь не найден", show_alert=True)
             return
@@ -141,7 +140,7 @@ async def handle_subscription_selection(callback: CallbackQuery):
         sub_name = sub_names.get(sub_type, 'Неизвестная подписка')
 
         # Проверяем наличие скидки
-        discount_info = get_user_active_discount(user_id)
+        discount_info = await get_user_active_discount(user_id)
         discount_percent = 0
         if discount_info:
             discount_percent = discount_info['discount_percent']
@@ -156,14 +155,14 @@ async def handle_subscription_selection(callback: CallbackQuery):
             return
 
         # Списываем средства с баланса покупок
-        update_purchase_balance(user_id, -int(final_price))
+        await update_purchase_balance(user_id, -int(final_price))
 
         # Отмечаем скидку как использованную (если была)
         if discount_info:
-            mark_discount_as_used(user_id, discount_info['discount_code'])
+            await mark_discount_as_used(user_id, discount_info['discount_code'])
 
         # Активируем подписку на 30 дней
-        update_subscription(user_id, sub_type, 30)
+        await update_subscription(user_id, sub_type, 30)
 
         # Обрабатываем реферальные бонусы
         await process_referral_bonuses(user_id, final_price, sub_type)
@@ -179,11 +178,7 @@ async def handle_subscription_selection(callback: CallbackQuery):
             await callback.answer()
 
             # Удаляем сообщение об успехе через 2 секунды
-            await asyncio.sleep(2)
-            try:
-                await success_msg.delete()
-            except:
-                pass
+            await deletion_scheduler.schedule(success_msg.chat.id, success_msg.message_id, 2)
 
             # Возвращаем в профиль
             from profile import show_clean_profile_menu
@@ -221,12 +216,12 @@ def get_subscription_name(sub_type: str) -> str:
 async def handle_back_to_profile(callback: CallbackQuery):
     """Возврат в профиль"""
     try:
-        from database import get_user as db_get_user
+        from async_database import get_user as db_get_user
         from messages import get_profile_text, get_subscription_info_text
         from profile import get_profile_keyboard  # Локальный импорт
 
         user_id = callback.from_user.id
-        user = db_get_user(user_id)
+        user = await db_get_user(user_id)
 
         if user:
             profile_text = get_profile_text(user)
@@ -269,14 +264,14 @@ async def handle_back_to_profile(callback: CallbackQuery):
 @error_handler
 async def process_referral_bonuses(user_id: int, amount: float, sub_type: str):
     """Обрабатывает реферальные бонусы для цепочки рефереров"""
-    from database import get_referrer_id, add_referral_payment, update_referral_balance
+    from async_database import get_referrer_id, add_referral_payment, update_referral_balance
 
     current_id = user_id
     print(
         f"Начало обработки реферальных бонусов для пользователя {user_id}, сумма: {amount}")
 
     for level in range(1, 4):  # Обрабатываем 3 уровня
-        referrer_id = get_referrer_id(current_id)
+        referrer_id = await get_referrer_id(current_id)
         if not referrer_id:
             print(f"Нет реферера уровня {level} для пользователя {current_id}")
             break
@@ -288,10 +283,10 @@ async def process_referral_bonuses(user_id: int, amount: float, sub_type: str):
             f"Начисление бонуса уровня {level}: {bonus} руб. рефереру {referrer_id}")
 
         # Начисляем бонус на реферальный баланс рефереру
-        update_referral_balance(referrer_id, bonus)
+        await update_referral_balance(referrer_id, bonus)
 
         # Записываем транзакцию
-        add_referral_payment(user_id, referrer_id, bonus, level, sub_type)
+        await add_referral_payment(user_id, referrer_id, bonus, level, sub_type)
 
         # Переходим к следующему уровню
         current_id = referrer_id
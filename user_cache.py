@@ -0,0 +1,111 @@
+"""
+Кэш записей пользователей перед database.get_user.
+
+За одно действие пользователя одна и та же строка users читается несколько раз
+(приветствие, клавиатура, меню подписок), поэтому get_user читает через кэш,
+а все функции, изменяющие users, обновляют или сбрасывают запись.
+Кэш ограничен по размеру (LRU) и по времени жизни записи (TTL).
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from config import USER_CACHE_SIZE, USER_CACHE_TTL
+from records import User
+
+
+class UserCache:
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # {user_id: (expires_at, user)}
+        self._lock = threading.Lock()
+        # Версия записи растет при каждом ее изменении: чтение, начатое до изменения, не попадет в кэш.
+        # Версии свои у каждого пользователя, чтобы запись одного не отбрасывала чтения других.
+        # Забытые версии (при чистке) считаются равными _floor - это не меньше любой из них
+        self._counter = 0
+        self._floor = 0
+        self._versions: Dict[int, int] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id: int) -> Optional[User]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return user
+
+    def begin_read(self, user_id: int) -> int:
+        """Запоминается перед чтением из БД и передается в put"""
+        with self._lock:
+            return self._versions.get(user_id, self._floor)
+
+    def put(self, user_id: int, user: User, version: Optional[int] = None):
+        with self._lock:
+            if version is not None and version != self._versions.get(user_id, self._floor):
+                return
+            self._entries[user_id] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def update(self, user_id: int, **fields):
+        """Меняет поля закэшированной записи вслед за UPDATE в БД, если запись есть"""
+        with self._lock:
+            # Чтение, начатое до UPDATE, не должно положить в кэш старую запись
+            self._bump(user_id)
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                expires_at, user = entry
+                self._entries[user_id] = (expires_at, user.replace(**fields))
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._bump(user_id)
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counter += 1
+            self._floor = self._counter
+            self._versions.clear()
+
+    def _bump(self, user_id: int):
+        self._counter += 1
+        self._versions[user_id] = self._counter
+        if len(self._versions) > self.max_size * 2:
+            # Чтения, начатые до чистки, в кэш не попадут - это безопасно
+            self._floor = self._counter
+            self._versions.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+
+user_cache = UserCache()
@@ -0,0 +1,168 @@
+"""
+Работа бота через вебхуки: встроенный aiohttp-сервер принимает обновления
+Telegram (WEBHOOK_PATH) и уведомления ЮKassa (YOOKASSA_WEBHOOK_PATH).
+
+В режиме опроса (BOT_RUN_MODE = "polling") бот сам забирает обновления
+getUpdates, и каждое ждет очередного запроса к Telegram. С вебхуком Telegram
+присылает обновление сразу, как оно появилось. Сервер отвечает 200 сразу после
+чтения тела запроса, а обработка идет в фоновой задаче: долгий ответ модели
+не держит соединение Telegram, а ЮKassa не повторяет уведомление из-за таймаута.
+При остановке сервер перестает принимать запросы и ждет уже принятые
+обновления не дольше WEBHOOK_SHUTDOWN_TIMEOUT секунд.
+
+Запросы Telegram проверяются по секретному заголовку (WEBHOOK_SECRET),
+уведомления ЮKassa - по адресу отправителя (YOOKASSA_WEBHOOK_NETWORKS). За
+прокси (WEBHOOK_BEHIND_PROXY) адрес берется из последней записи X-Forwarded-For,
+которую добавляет сам прокси.
+
+Если WEBHOOK_BASE_URL пуст, setWebhook не вызывается, и сервер можно проверить
+локально, отправляя обновления вручную:
+    curl -X POST localhost:8080/telegram/webhook -H 'Content-Type: application/json' \\
+        -d '{"update_id": 1, "message": {"message_id": 1, "date": 0, "text": "/start",
+             "chat": {"id": 1, "type": "private"}, "from": {"id": 1, "is_bot": false, "first_name": "Test"}}}'
+"""
+import asyncio
+import secrets
+from ipaddress import ip_address, ip_network
+from typing import Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.webhook.aiohttp_server import setup_application
+
+from config import (
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_BASE_URL,
+    WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONNECTIONS,
+    WEBHOOK_BEHIND_PROXY,
+    WEBHOOK_SHUTDOWN_TIMEOUT,
+    YOOKASSA_WEBHOOK_PATH,
+    YOOKASSA_WEBHOOK_NETWORKS
+)
+from error_handler import error_handler
+
+
+class WebhookServer:
+    def __init__(self, bot: Bot, dispatcher: Dispatcher,
+                 secret: str = WEBHOOK_SECRET,
+                 yookassa_networks=YOOKASSA_WEBHOOK_NETWORKS,
+                 behind_proxy: bool = WEBHOOK_BEHIND_PROXY,
+                 shutdown_timeout: float = WEBHOOK_SHUTDOWN_TIMEOUT):
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.secret = secret
+        self.yookassa_networks = [ip_network(network) for network in yookassa_networks]
+        self.behind_proxy = behind_proxy
+        self.shutdown_timeout = shutdown_timeout
+        # Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора и их можно было дождаться
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.updates = 0
+        self.payment_notifications = 0
+        self.rejected = 0
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self.handle_telegram)
+        app.router.add_post(YOOKASSA_WEBHOOK_PATH, self.handle_yookassa)
+        # Те же события startup/shutdown диспетчера, что и при опросе
+        setup_application(app, self.dispatcher, bot=self.bot)
+        app.on_shutdown.append(self._on_shutdown)
+        return app
+
+    async def handle_telegram(self, request: web.Request) -> web.Response:
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if self.secret and not secrets.compare_digest(token, self.secret):
+            self.rejected += 1
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        self.updates += 1
+        self._spawn(self._feed_update(update))
+        return web.Response()
+
+    async def handle_yookassa(self, request: web.Request) -> web.Response:
+        if not self._trusted_sender(request):
+            self.rejected += 1
+            return web.Response(status=403)
+        try:
+            notification = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        self.payment_notifications += 1
+
+        from yookassa_integration import handle_payment_webhook
+        self._spawn(handle_payment_webhook(notification))
+        return web.Response()
+
+    @error_handler
+    async def _feed_update(self, update: dict):
+        result = await self.dispatcher.feed_raw_update(self.bot, update)
+        # Обработчик может вернуть метод Telegram вместо вызова - выполняем его сами
+        if isinstance(result, TelegramMethod):
+            await self.dispatcher.silent_call_request(self.bot, result)
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _trusted_sender(self, request: web.Request) -> bool:
+        if not self.yookassa_networks:
+            return True
+        remote = request.remote or ""
+        if self.behind_proxy:
+            forwarded = request.headers.get("X-Forwarded-For", "")
+            # Правый адрес дописал наш прокси - это тот, кто к нему подключился.
+            # Левые записи присылает сам клиент, им верить нельзя
+            remote = forwarded.split(",")[-1].strip() or remote
+        try:
+            address = ip_address(remote)
+        except ValueError:
+            return False
+        return any(address in network for network in self.yookassa_networks)
+
+    async def _on_shutdown(self, app: web.Application):
+        await self.drain()
+
+    async def drain(self):
+        """Ждет обработки уже принятых обновлений, остальные отменяет"""
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(set(self._tasks), timeout=self.shutdown_timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+
+async def run_webhook(bot: Bot, dispatcher: Dispatcher):
+    """Запускает сервер вебхуков и работает до отмены (Ctrl+C)"""
+    server = WebhookServer(bot, dispatcher)
+    runner = web.AppRunner(server.make_app())
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    print(f"Вебхуки: http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}, ЮKassa: {YOOKASSA_WEBHOOK_PATH}")
+
+    if WEBHOOK_BASE_URL:
+        await bot.set_webhook(
+            url=WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+            max_connections=WEBHOOK_MAX_CONNECTIONS
+        )
+    try:
+        await asyncio.Event().wait()
+    finally:
+        # Вебхук в Telegram не снимается: обновления дождутся следующего запуска
+        await runner.cleanup()
+        await bot.session.close()
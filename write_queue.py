@@ -0,0 +1,282 @@
+"""
+Отложенная (write-behind) запись частых INSERT/UPDATE.
+
+log_message, счетчики токенов (increment_token_usage, add_token_usage) и log_error не коммитят каждую строку отдельно:
+записи складываются в ограниченный буфер, а фоновый поток сбрасывает их одной
+транзакцией раз в DB_WRITE_FLUSH_INTERVAL_MS или как только набралось
+DB_WRITE_BATCH_ROWS строк. Так вместо fsync на каждое сообщение получается
+один fsync на пачку.
+
+Режимы надежности (DB_WRITE_DURABILITY):
+- "buffered"  - вызов возвращается сразу, запись попадет в БД при ближайшем сбросе;
+- "group"     - вызов ждет commit своей пачки (group commit: данные не теряются,
+                но несколько одновременных записей делят один fsync);
+- "immediate" - буфер не используется, каждая запись коммитится сразу.
+
+Запись можно пометить ключом (например, user_id). Чтение, которому нужны
+только что записанные данные, вызывает flush_writes с тем же ключом и ждет сброса,
+только если записи с этим ключом еще в буфере; иначе оно сразу идет в БД.
+
+Вызов submit может ждать (group или переполненный буфер), поэтому из event loop
+записи ставятся через пул записи async_database.
+"""
+import atexit
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from config import (
+    DB_WRITE_FLUSH_INTERVAL_MS,
+    DB_WRITE_BATCH_ROWS,
+    DB_WRITE_QUEUE_SIZE,
+    DB_WRITE_DURABILITY
+)
+from db_pool import get_connection
+
+DURABILITY_BUFFERED = "buffered"
+DURABILITY_GROUP = "group"
+DURABILITY_IMMEDIATE = "immediate"
+
+
+class WriteBehindQueue:
+    """Буфер записей одной базы с фоновым групповым сбросом"""
+
+    def __init__(self, database: str, flush_interval_ms: int = DB_WRITE_FLUSH_INTERVAL_MS,
+                 batch_rows: int = DB_WRITE_BATCH_ROWS, max_pending: int = DB_WRITE_QUEUE_SIZE,
+                 durability: str = DB_WRITE_DURABILITY):
+        self.database = database
+        self.flush_interval = flush_interval_ms / 1000
+        self.batch_rows = batch_rows
+        self.max_pending = max_pending
+        self.durability = durability
+
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._submitted_seq = 0
+        self._committed_seq = 0
+        self._key_seqs: Dict[object, int] = {}  # Ключ -> номер последней записи с ним, еще не сброшенной
+        self._flush_requested = False
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+        # Метрики
+        self.max_depth = 0
+        self.flush_count = 0
+        self.rows_flushed = 0
+        self.failed_rows = 0
+        self.backpressure_waits = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name=f"db-flush:{self.database}", daemon=True)
+        self._thread.start()
+
+    def submit(self, sql: str, params: tuple = (), key=None):
+        """Ставит запись в очередь (или выполняет сразу в режиме immediate); key - для flush(key=...)"""
+        if self.durability == DURABILITY_IMMEDIATE or not self._running:
+            self._execute_now(sql, params)
+            return
+
+        with self._cond:
+            # Буфер ограничен: если флашер не успевает, писатель ждет (backpressure)
+            while len(self._pending) >= self.max_pending and self._running:
+                self.backpressure_waits += 1
+                self._flush_requested = True
+                self._cond.notify_all()
+                self._cond.wait(self.flush_interval)
+            self._submitted_seq += 1
+            seq = self._submitted_seq
+            self._pending.append((sql, params))
+            if key is not None:
+                self._key_seqs[key] = seq
+            depth = len(self._pending)
+            if depth > self.max_depth:
+                self.max_depth = depth
+            if depth >= self.batch_rows:
+                self._cond.notify_all()
+
+            if self.durability == DURABILITY_GROUP:
+                while self._committed_seq < seq and self._running:
+                    self._cond.wait(self.flush_interval)
+
+    def flush(self, timeout: float = 5.0, key=None):
+        """Дожидается записи в БД всего, что было поставлено в очередь до вызова (или последней записи с key)"""
+        if not self._running:
+            self._drain()
+            return
+        if threading.current_thread() is self._thread:
+            return
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            target = self._submitted_seq if key is None else self._key_seqs.get(key, 0)
+            if self._committed_seq >= target:
+                return
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._committed_seq < target and self._running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+    def stop(self):
+        """Останавливает фоновый поток, предварительно сбросив буфер"""
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._drain()
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def stats(self) -> Dict:
+        return {
+            'database': self.database,
+            'durability': self.durability,
+            'depth': len(self._pending),
+            'max_depth': self.max_depth,
+            'flush_count': self.flush_count,
+            'rows_flushed': self.rows_flushed,
+            'failed_rows': self.failed_rows,
+            'backpressure_waits': self.backpressure_waits,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'avg_flush_ms': round(self._total_flush_ms / self.flush_count, 2) if self.flush_count else 0.0,
+            'max_flush_ms': round(self.max_flush_ms, 2)
+        }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._running and len(self._pending) < self.batch_rows and not self._flush_requested:
+                    self._cond.wait(self.flush_interval)
+                if not self._running:
+                    return
+                self._flush_requested = False
+                batch, seq = self._take_batch()
+            if batch:
+                self._write_batch(batch)
+            with self._cond:
+                self._mark_committed(seq)
+
+    def _take_batch(self):
+        count = min(len(self._pending), self.batch_rows)
+        batch = [self._pending.popleft() for _ in range(count)]
+        # Номер последней записи, попавшей в пачку
+        seq = self._submitted_seq - len(self._pending)
+        return batch, seq
+
+    def _drain(self):
+        while True:
+            with self._cond:
+                batch, seq = self._take_batch()
+            if not batch:
+                break
+            self._write_batch(batch)
+            with self._cond:
+                self._mark_committed(seq)
+
+    def _mark_committed(self, seq: int):
+        self._committed_seq = max(self._committed_seq, seq)
+        if self._key_seqs:
+            # Ключи, все записи которых уже в БД, больше не нужны
+            self._key_seqs = {key: key_seq for key, key_seq in self._key_seqs.items()
+                              if key_seq > self._committed_seq}
+        self._cond.notify_all()
+
+    def _write_batch(self, batch):
+        started = time.perf_counter()
+        conn = get_connection(self.database)
+        try:
+            with conn:
+                # Соседние записи с одинаковым SQL выполняются одним executemany
+                i = 0
+                while i < len(batch):
+                    sql = batch[i][0]
+                    j = i
+                    while j < len(batch) and batch[j][0] == sql:
+                        j += 1
+                    conn.executemany(sql, [params for _, params in batch[i:j]])
+                    i = j
+            self.rows_flushed += len(batch)
+        except Exception as e:
+            print(f"Ошибка группового сброса записей в {self.database}: {e}")
+            # Пробуем записать строки по одной, чтобы одна плохая строка не потянула за собой всю пачку
+            for sql, params in batch:
+                try:
+                    self._execute_now(sql, params)
+                    self.rows_flushed += 1
+                except Exception as row_error:
+                    self.failed_rows += 1
+                    print(f"Запись отброшена: {row_error}")
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.flush_count += 1
+        self.last_flush_ms = elapsed_ms
+        self._total_flush_ms += elapsed_ms
+        if elapsed_ms > self.max_flush_ms:
+            self.max_flush_ms = elapsed_ms
+
+    def _execute_now(self, sql: str, params: tuple):
+        with get_connection(self.database) as conn:
+            conn.execute(sql, params)
+
+
+_queues: Dict[str, WriteBehindQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def get_write_queue(database: str) -> WriteBehindQueue:
+    queue = _queues.get(database)
+    if queue is None:
+        with _queues_lock:
+            queue = _queues.get(database)
+            if queue is None:
+                queue = WriteBehindQueue(database)
+                queue.start()
+                _queues[database] = queue
+    return queue
+
+
+def enqueue_write(database: str, sql: str, params: tuple = (), key=None):
+    """Ставит INSERT/UPDATE в очередь отложенной записи базы"""
+    get_write_queue(database).submit(sql, params, key)
+
+
+def flush_writes(database: str, key=None):
+    """
+    Сбрасывает буфер базы перед чтением, которому нужны только что записанные данные.
+    С key ждет только, если в буфере есть записи с этим ключом.
+    """
+    queue = _queues.get(database)
+    if queue is not None:
+        queue.flush(key=key)
+
+
+def get_write_queue_stats():
+    with _queues_lock:
+        return [queue.stats() for queue in _queues.values()]
+
+
+def shutdown_write_queues():
+    """Сбрасывает все буферы и останавливает фоновые потоки (при остановке бота)"""
+    with _queues_lock:
+        queues = list(_queues.values())
+    for queue in queues:
+        queue.stop()
+
+
+atexit.register(shutdown_write_queues)
@@ -2,7 +2,7 @@ import uuid
 import asyncio
 from yookassa import Payment, Configuration  # type: ignore
 from config import YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY
-from database import update_purchase_balance
+from async_database import update_purchase_balance
 from shared import bot
 from error_handler import error_handler
 
@@ -131,7 +131,7 @@ async def check_payment_status(payment_id: str):
 
                     print(
                         f"НАЧИСЛЕНИЕ БАЛАНСА: пользователь {user_id}, сумма {amount}")
-                    update_purchase_balance(user_id, amount)
+                    await update_purchase_balance(user_id, amount)
 
                     # Помечаем как обработанный
                     active_payments[payment_id]["processed"] = True
@@ -227,7 +227,7 @@ async def handle_payment_webhook(request_data: dict):
 
                         print(
                             f"ВЕБХУК НАЧИСЛЕНИЕ: пользователь {user_id}, сумма {amount}")
-                        update_purchase_balance(user_id, amount)
+                        await update_purchase_balance(user_id, amount)
 
                         # Помечаем как обработанный
                         active_payments[payment_id]["processed"] = True